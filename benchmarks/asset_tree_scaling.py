@@ -0,0 +1,78 @@
+"""Benchmark: AssetTree indexing cost from 1k to 200k synthetic files.
+
+Usage:
+    python benchmarks/asset_tree_scaling.py [--sizes=1000,10000,200000]
+
+The walk is replaced with synthetic folder listings so that only the indexing
+work is measured, not the disk. Per-file cost should stay flat as the tree
+grows; a quadratic index shows up as a per-file cost that rises with size.
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from mpfam.core.AssetTree import AssetTree  # noqa: E402
+
+DEFAULT_SIZES = [1000, 5000, 20000, 50000, 100000, 200000]
+FILES_PER_FOLDER = 250
+DUPLICATE_EVERY = 100
+
+
+class SyntheticAssetTree(AssetTree):
+    """AssetTree that indexes generated folder listings instead of walking a disk."""
+
+    def __init__(self, count, log):
+        self._count = count
+        super().__init__("/synthetic", log)
+
+    def _walk(self, fileroot, paths_to_exclude):
+        folder = 0
+        for start in range(0, self._count, FILES_PER_FOLDER):
+            files = []
+            for idx in range(start, min(start + FILES_PER_FOLDER, self._count)):
+                # Reuse an earlier name every so often to exercise duplicate detection
+                nameidx = idx - FILES_PER_FOLDER if idx % DUPLICATE_EVERY == 0 and idx >= FILES_PER_FOLDER else idx
+                files.append("sound_{:07d}.{}".format(nameidx, "wav" if idx % 2 else "ogg"))
+            files.append("readme_{}.txt".format(folder))
+            yield "{}/folder_{:05d}".format(fileroot, folder), 0, [], files
+            folder += 1
+
+
+def run(sizes):
+    log = logging.getLogger("mpfam.benchmark")
+    log.addHandler(logging.NullHandler())
+    log.propagate = False
+
+    print("{:>10} {:>12} {:>14} {:>12} {:>12}".format("files", "scan (s)", "per file (us)", "lookups (s)", "dupes (s)"))
+    baseline = None
+    for size in sizes:
+        start = time.perf_counter()
+        tree = SyntheticAssetTree(size, log)
+        scan = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for filename in tree.get_files():
+            tree.get_file_path(filename)
+        lookups = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tree.get_duplicates()
+        dupes = time.perf_counter() - start
+
+        per_file = scan / size * 1e6
+        baseline = baseline or per_file
+        print("{:>10} {:>12.4f} {:>14.2f} {:>12.4f} {:>12.4f}".format(size, scan, per_file, lookups, dupes))
+
+    print("\nPer-file scan cost at the largest size is {:.1f}x the smallest (1.0x is linear).".format(
+        per_file / baseline))
+
+
+if __name__ == "__main__":
+    sizes = DEFAULT_SIZES
+    for arg in sys.argv[1:]:
+        if arg.startswith("--sizes="):
+            sizes = [int(x) for x in arg.split("=", 1)[1].split(",")]
+    run(sizes)
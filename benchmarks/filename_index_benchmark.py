@@ -0,0 +1,106 @@
+"""Benchmark: FilenameIndex build time and suggestion latency from 1k to 60k filenames.
+
+Usage:
+    python benchmarks/filename_index_benchmark.py [--sizes=1000,10000,60000] [--queries=N]
+
+Filenames are generated the way sound libraries name them: a few category
+prefixes ("sfx_", "voice_", "music_"), then words that are half of the time
+common pinball terms and otherwise character, song, and callout names. Common
+trigrams like "sfx" and "all" appear in a large share of the index.
+Each query is an indexed name with one typo (a dropped, doubled, or swapped
+letter), or a different separator and case. The median and 95th percentile
+time per suggestion should stay around a couple of milliseconds, and grow
+much slower than the index.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from mpfam.core.FilenameIndex import FilenameIndex  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 30000, 60000]
+DEFAULT_QUERIES = 500
+SEED = 20
+PREFIXES = ["sfx", "sfx", "sfx", "voice", "voice", "music", "amb", "ui"]
+WORDS = ["ball", "save", "drain", "jackpot", "multiball", "ramp", "orbit", "spinner", "bumper", "sling", "target",
+         "lock", "shoot", "again", "extra", "bonus", "combo", "super", "mode", "start", "complete", "hurry", "up",
+         "skill", "shot", "tilt", "warning", "game", "over", "high", "score", "loop", "intro", "outro", "hit",
+         "laser", "explosion", "crowd", "cheer", "alarm", "engine", "door", "open", "close", "whoosh", "impact"]
+SYLLABLES = ["ka", "ri", "mo", "zen", "tor", "bla", "qu", "ix", "el", "dra", "vo", "sh", "an", "ter", "po", "lu",
+             "gar", "nim", "o", "fe", "sta", "rk", "ul", "be", "th", "cy", "ma", "sol", "gri", "ne"]
+VOCABULARY = 3000  # Distinct generated words
+COMMON_WORD_SHARE = 0.5  # Share of the words in a filename taken from WORDS
+
+
+def make_vocabulary(rng):
+    """Return VOCABULARY distinct names (characters, songs, callouts) made from syllables."""
+    names = set()
+    while len(names) < VOCABULARY:
+        names.add("".join(rng.choice(SYLLABLES) for __syllable in range(rng.randint(2, 4))))
+    return sorted(names)
+
+
+def make_filenames(count, rng):
+    """Return count distinct filenames like "sfx_ramp_shot_03.wav" or "voice_korimba_jackpot_12.ogg"."""
+    vocabulary = make_vocabulary(rng)
+    filenames = set()
+    while len(filenames) < count:
+        words = "_".join(rng.choice(WORDS) if rng.random() < COMMON_WORD_SHARE else rng.choice(vocabulary)
+                         for __word in range(rng.randint(1, 3)))
+        filenames.add("{}_{}_{:02d}.{}".format(rng.choice(PREFIXES), words, rng.randint(1, 40),
+                                               rng.choice(["wav", "wav", "ogg"])))
+    return sorted(filenames)
+
+
+def make_query(filename, rng):
+    """Return a filename with one typo, or with different separators and case."""
+    stem, __, ext = filename.rpartition(".")
+    idx = rng.randrange(1, len(stem) - 1)
+    change = rng.randrange(4)
+    if change == 0:
+        stem = stem[:idx] + stem[idx + 1:]
+    elif change == 1:
+        stem = stem[:idx] + stem[idx] + stem[idx:]
+    elif change == 2:
+        stem = stem[:idx - 1] + stem[idx] + stem[idx - 1] + stem[idx + 1:]
+    else:
+        stem = stem.replace("_", "-").title()
+    return "{}.{}".format(stem, ext)
+
+
+def run(sizes, queries):
+    rng = random.Random(SEED)
+    print("{:>8} {:>10} {:>12} {:>12} {:>10}".format("files", "build (s)", "median (ms)", "p95 (ms)", "found"))
+    for size in sizes:
+        filenames = make_filenames(size, rng)
+        start = time.perf_counter()
+        index = FilenameIndex(filenames)
+        build = time.perf_counter() - start
+
+        targets = [rng.choice(filenames) for __query in range(queries)]
+        times = []
+        found = 0
+        for target in targets:
+            query = make_query(target, rng)
+            start = time.perf_counter()
+            suggestions = index.suggest(query)
+            times.append((time.perf_counter() - start) * 1000)
+            found += target in [candidate for __score, candidate in suggestions]
+        times.sort()
+        print("{:>8} {:>10.3f} {:>12.3f} {:>12.3f} {:>9.0%}".format(
+            size, build, statistics.median(times), times[int(len(times) * 0.95)], found / queries))
+
+
+if __name__ == "__main__":
+    sizes = DEFAULT_SIZES
+    queries = DEFAULT_QUERIES
+    for arg in sys.argv[1:]:
+        if arg.startswith("--sizes="):
+            sizes = [int(x) for x in arg.split("=", 1)[1].split(",")]
+        elif arg.startswith("--queries="):
+            queries = int(arg.split("=", 1)[1])
+    run(sizes, queries)
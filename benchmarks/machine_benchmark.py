@@ -0,0 +1,316 @@
+"""Benchmark: AssetManager operations on synthetic MPF machines at several scales.
+
+Usage:
+    python benchmarks/machine_benchmark.py [--scales=small,medium,large] [--output=PATH]
+                                           [--workdir=PATH] [--no-memory] [--keep]
+
+Each scale generates a machine folder (modes with tracks, sound pools, and child
+configs imported via "config:") and a nested source folder of short WAV and OGG
+files. Part of the assets start in place, some in the wrong mode, and some
+orphaned, so every step has real work to do. The steps run in order, each with a
+fresh AssetManager as the command line would:
+
+    parse (cold)  parse_machine_assets with empty caches
+    parse (warm)  parse_machine_assets again, with the caches from the first run
+    cleanup       cleanup_machine_assets(write_mode=True)
+    check (cold)  check_machine_assets, with no snapshot from an earlier check
+    check (warm)  check_machine_assets again, on the unchanged machine
+    export        export_machine_assets to a folder
+    export zip    export_machine_assets(saveAsZip=True)
+    export delta  export_machine_assets(delta=True), after rewriting a few assets
+    check (delta) add a config in a new folder, then check_machine_assets from
+                  the snapshot and from scratch. The run fails if they disagree,
+                  e.g. if the delta export folder was indexed as machine assets.
+    verify (edit) cleanup_machine_assets(verify=True), then overwrite a source
+                  file in place and verify again. The run fails unless the
+                  incremental refresh finds it outdated, as a full verify does.
+    check (cli)   "mpfam check" in the machine folder, with stdin from /dev/null
+                  and no saved config. The run fails if it asks for a folder,
+                  crashes, or exits with a configuration error.
+    sample rates  analyze_sample_rates
+
+Wall time and peak Python memory (tracemalloc, which doesn't see worker
+processes) are printed and appended as one JSON line per step to the results
+file (by default mpfam_benchmark_results.jsonl in the temp folder), along with
+the git commit, so runs can be compared across commits.
+Tracemalloc slows the run down; pass --no-memory for timings alone.
+"""
+from datetime import datetime
+import glob
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from mpfam.core.AssetManager import AssetManager  # noqa: E402
+
+# Key: scale name, Value: (modes, sounds per mode, source folders)
+SCALES = {
+    "small": (5, 20, 4),
+    "medium": (20, 100, 20),
+    "large": (60, 300, 100),
+    "wide": (150, 100, 50),  # As many modes as a full game, for check
+}
+DEFAULT_SCALES = ["small", "medium", "large"]
+# Outside the checkout, so runs don't leave changes to commit
+DEFAULT_OUTPUT = os.path.join(tempfile.gettempdir(), "mpfam_benchmark_results.jsonl")
+TRACKS = ["music", "voice", "sfx"]
+CHILD_EVERY = 4  # Every Nth mode imports a child config
+POOL_SIZE = 5
+SAMPLE_RATES = [44100] * 6 + [22050, 48000]  # Mostly one rate, so resampling has something to find
+SECONDS = 0.05
+PLACED = 0.5  # Share of assets already in their mode folders
+MISPLACED = 0.05  # Share of assets in the wrong mode folder
+ORPHANS = 0.02  # Extra unused files in the mode folders, as a share of all assets
+SEED = 1
+DELTA_CHANGES = 5  # Assets rewritten before the delta export, so it has files to write
+
+
+class BenchmarkAssetManager(AssetManager):
+    """AssetManager with fixed paths, instead of reading and prompting for the user's config."""
+
+    def __init__(self, source_path, machine_path, **kwargs):
+        self._benchmark_paths = {"source_path": source_path, "machine_path": machine_path}
+        super().__init__(**kwargs)
+
+    def _get_config_path(self, path_type):
+        self._paths[path_type] = self._benchmark_paths[path_type]
+        return self._paths[path_type]
+
+
+def write_sound(path, rng):
+    """Write a short noise burst as WAV or OGG, depending on the extension."""
+    samplerate = rng.choice(SAMPLE_RATES)
+    channels = rng.choice([1, 2])
+    data = np.random.default_rng(rng.randrange(1 << 30)).uniform(
+        -0.5, 0.5, (int(samplerate * SECONDS), channels)).astype("float32")
+    sf.write(path, data, samplerate)
+
+
+def generate_machine(root, modes, sounds_per_mode, source_folders):
+    """Create a machine and source folder under root, returning their paths and the number of assets."""
+    rng = random.Random(SEED)
+    machine_path = os.path.join(root, "machine")
+    source_path = os.path.join(root, "source")
+    placements = []  # Tuples of (filename, mode folder, track)
+
+    for modeidx in range(modes):
+        modename = "mode_{:03d}".format(modeidx)
+        configs = [(modename, modename)]
+        if modeidx % CHILD_EVERY == 0:
+            configs.append(("{}_child".format(modename), modename))
+        for configname, parent in configs:
+            sounds = {}
+            pools = {}
+            count = sounds_per_mode // len(configs)
+            for soundidx in range(count):
+                soundname = "{}_s{:04d}".format(configname, soundidx)
+                filename = "{}.{}".format(soundname, "ogg" if soundidx % 5 == 0 else "wav")
+                track = TRACKS[soundidx % len(TRACKS)]
+                if track == "sfx":
+                    # Sound effects take their track from a pool
+                    pools.setdefault("{}_pool{}".format(configname, soundidx // POOL_SIZE), []).append(soundname)
+                    sounds[soundname] = {"file": filename}
+                else:
+                    sounds[soundname] = {"file": filename, "track": track}
+                placements.append((filename, parent, track))
+            lines = []
+            if configname == parent and len(configs) > 1:
+                lines += ["config:", "  - {}_child.yaml".format(modename)]
+            lines.append("sounds:")
+            for soundname, sound in sounds.items():
+                lines.append("  {}:".format(soundname))
+                lines += ["    {}: {}".format(key, value) for key, value in sound.items()]
+            if pools:
+                lines.append("sound_pools:")
+                for poolname, members in pools.items():
+                    lines += ["  {}:".format(poolname), "    sounds: {}".format(", ".join(members)),
+                              "    track: sfx"]
+            configfolder = os.path.join(machine_path, "modes", configname, "config")
+            os.makedirs(configfolder, exist_ok=True)
+            with open(os.path.join(configfolder, "{}.yaml".format(configname)), "w") as f:
+                f.write("\n".join(lines) + "\n")
+
+    sourcefolders = [os.path.join(source_path, "disc_{}".format(idx % 4), "folder_{:04d}".format(idx))
+                     for idx in range(source_folders)]
+    for folder in sourcefolders:
+        os.makedirs(folder, exist_ok=True)
+    for filename, parent, track in placements:
+        sourcefile = os.path.join(rng.choice(sourcefolders), filename)
+        write_sound(sourcefile, rng)
+        roll = rng.random()
+        if roll < PLACED + MISPLACED:
+            if roll < PLACED:
+                modefolder = parent
+            else:
+                modefolder = "mode_{:03d}".format(rng.randrange(modes))
+            target = os.path.join(machine_path, "modes", modefolder, "sounds", track)
+            os.makedirs(target, exist_ok=True)
+            shutil.copy2(sourcefile, target)
+    for idx in range(int(len(placements) * ORPHANS)):
+        target = os.path.join(machine_path, "modes", "mode_{:03d}".format(idx % modes), "sounds", "music")
+        os.makedirs(target, exist_ok=True)
+        write_sound(os.path.join(target, "orphan_{:05d}.wav".format(idx)), rng)
+    return source_path, machine_path, len(placements)
+
+
+def change_assets(machine_path, count, rng):
+    """Rewrite some assets in the mode folders with new audio, so a delta export has files to write."""
+    for path in sorted(glob.glob(os.path.join(machine_path, "modes", "*", "sounds", "*", "*.wav")))[:count]:
+        write_sound(path, rng)
+
+
+def check_after_delta(manager, machine_path):
+    """Check from the last check's snapshot and again from scratch, and fail if the results differ.
+
+    A config is added in a new folder first, which no config folder known to the snapshot would show.
+    """
+    folder = os.path.join(machine_path, "modes", "added", "config", "extra")
+    os.makedirs(folder)
+    with open(os.path.join(folder, "added.yaml"), "w") as f:
+        f.write("sounds:\n  added:\n    file: added_sound.wav\n    track: sfx\n")
+    incremental = manager().check_machine_assets()
+    os.remove(manager()._get_check_state_path())
+    full = manager().check_machine_assets()
+    if incremental != full:
+        raise RuntimeError("Check from the snapshot returned {}, but a full check returned {}".format(
+            incremental, full))
+
+
+def verify_in_place(manager, rng):
+    """Verify, overwrite one source file in place, and fail unless the incremental refresh finds it outdated.
+
+    Overwriting a file doesn't change its folder's mtime, so only a re-stat of the
+    verified files can notice it.
+    """
+    current = manager()
+    current.cleanup_machine_assets(write_mode=True, verify=True)
+    analysis = current._get_analysis(verify=True)
+    filename = sorted(analysis['found'])[0]
+    sourcepath = current.source_media.get_file_path(filename)
+    write_sound(sourcepath, rng)
+    os.utime(sourcepath, ns=(time.time_ns(), time.time_ns() + 1000000000))
+    incremental = sorted(current._get_analysis(verify=True)['outdated'].values())
+    full = manager()
+    full.parse_machine_assets(verify=True)
+    if sourcepath not in incremental or incremental != sorted(full._analysis['outdated'].values()):
+        raise RuntimeError("After overwriting {} in place, the refresh found {} outdated, but a full verify "
+                           "found {}".format(sourcepath, incremental, sorted(full._analysis['outdated'].values())))
+
+
+def check_without_config(machine_path, workdir):
+    """Run "mpfam check" as a CI job would, and fail if it asks for a folder or doesn't finish its check.
+
+    The package is copied first, so there's no saved config beside it.
+    """
+    package = os.path.join(workdir, "package")
+    if not os.path.exists(package):
+        shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "mpfam"),
+                        os.path.join(package, "mpfam"), ignore=shutil.ignore_patterns("__pycache__"))
+    env = dict(os.environ, PYTHONPATH=package, TMPDIR=tempfile.gettempdir())
+    result = subprocess.run([sys.executable, "-m", "mpfam", "check"], cwd=machine_path, env=env,
+                            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = result.stdout.decode(errors="replace")
+    if result.returncode in (1, 2) or "Traceback" in output:
+        raise RuntimeError("mpfam check without a config exited with {}:\n{}".format(result.returncode, output))
+
+
+def measure(step, memory):
+    """Run a step, returning its wall time in seconds and peak traced memory in bytes (or None)."""
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    step()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def get_commit():
+    """Return the current git commit, if the benchmark is run from a checkout."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except(OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales, output, workdir, memory, keep):
+    root = tempfile.mkdtemp(prefix="mpfam_benchmark_", dir=workdir)
+    # Keep the mpfam caches inside the benchmark folder, away from the user's own
+    tempfile.tempdir = os.path.join(root, "tmp")
+    os.makedirs(tempfile.tempdir)
+    logging.disable(logging.CRITICAL)
+    run_info = {"commit": get_commit(), "date": datetime.now().isoformat(timespec="seconds"),
+                "python": sys.version.split()[0], "cpus": os.cpu_count()}
+
+    print("{:<8} {:>7} {:<14} {:>10} {:>12}".format("scale", "assets", "step", "wall (s)", "peak (MB)"))
+    results = []
+    try:
+        for scale in scales:
+            modes, sounds_per_mode, source_folders = SCALES[scale]
+            source_path, machine_path, assets = generate_machine(
+                os.path.join(root, scale), modes, sounds_per_mode, source_folders)
+
+            def manager():
+                return BenchmarkAssetManager(source_path, machine_path)
+
+            steps = [
+                ("parse (cold)", lambda: manager().parse_machine_assets()),
+                ("parse (warm)", lambda: manager().parse_machine_assets()),
+                ("cleanup", lambda: manager().cleanup_machine_assets(write_mode=True)),
+                ("check (cold)", lambda: manager().check_machine_assets()),
+                ("check (warm)", lambda: manager().check_machine_assets()),
+                ("export", lambda: manager().export_machine_assets()),
+                ("export zip", lambda: manager().export_machine_assets(saveAsZip=True)),
+                ("export delta", lambda: (change_assets(machine_path, DELTA_CHANGES, random.Random(SEED)),
+                                          manager().export_machine_assets(delta=True))),
+                ("check (delta)", lambda: check_after_delta(manager, machine_path)),
+                ("verify (edit)", lambda: verify_in_place(manager, random.Random(SEED))),
+                ("check (cli)", lambda: check_without_config(machine_path, root)),
+                ("sample rates", lambda: manager().analyze_sample_rates()),
+            ]
+            for name, step in steps:
+                elapsed, peak = measure(step, memory)
+                print("{:<8} {:>7} {:<14} {:>10.3f} {:>12}".format(
+                    scale, assets, name, elapsed, "{:.1f}".format(peak / 1000000) if peak is not None else "-"))
+                results.append(dict(run_info, scale=scale, modes=modes, assets=assets, step=name,
+                                    seconds=round(elapsed, 4), peak_bytes=peak))
+    finally:
+        logging.disable(logging.NOTSET)
+        if keep:
+            print("\nBenchmark machines kept in {}".format(root))
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    with open(output, "a") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    print("\nResults appended to {}".format(output))
+
+
+if __name__ == "__main__":
+    options = {"scales": ",".join(DEFAULT_SCALES), "output": DEFAULT_OUTPUT, "workdir": None}
+    for arg in sys.argv[1:]:
+        name, __, value = arg[2:].partition("=")
+        if name in options:
+            options[name] = value
+    scales = options["scales"].split(",")
+    for scale in scales:
+        if scale not in SCALES:
+            sys.exit("Unknown scale '{}', expected one of: {}".format(scale, ", ".join(SCALES)))
+    run(scales, options["output"], options["workdir"], "--no-memory" not in sys.argv, "--keep" in sys.argv)
@@ -0,0 +1,100 @@
+"""Benchmark: wall time of trivial mpfam commands, from process start to exit.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs=N] [--target=MS] [--output=PATH]
+
+mpfam is run from git hooks and editor tasks, so startup cost adds up. Each
+command runs N times in a fresh interpreter, as "python -m mpfam", and the
+best and median times are printed. The temp folder is redirected to a scratch
+folder, so "clear" doesn't remove the real caches. For reference, the time of
+a bare interpreter ("python -c pass") and of importing mpfam.mpfam are also
+measured.
+
+Results are appended as one JSON line per command to the results file (by
+default mpfam_benchmark_results.jsonl in the temp folder), along with the git
+commit. Exits with an error if the median of any mpfam command is
+over the target (default: 100 ms).
+"""
+from datetime import datetime
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+# Outside the checkout (and the scratch temp folder the commands run with), so runs don't leave changes to commit
+DEFAULT_OUTPUT = os.path.join(tempfile.gettempdir(), "mpfam_benchmark_results.jsonl")
+DEFAULT_RUNS = 10
+DEFAULT_TARGET = 100  # Milliseconds
+# (label, interpreter arguments, whether it counts against the target)
+COMMANDS = [
+    ("python (baseline)", ["-c", "pass"], False),
+    ("import mpfam.mpfam", ["-c", "import mpfam.mpfam"], False),
+    ("mpfam help", ["-m", "mpfam", "help"], True),
+    ("mpfam clear", ["-m", "mpfam", "clear"], True),
+]
+
+
+def get_commit():
+    """Return the current git commit, if the benchmark is run from a checkout."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except(OSError, subprocess.CalledProcessError):
+        return None
+
+
+def time_command(args, runs, env):
+    """Return the wall time in milliseconds of each run of the interpreter with the given arguments."""
+    times = []
+    for __run in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def run(runs, target, output):
+    scratch = tempfile.mkdtemp(prefix="mpfam_startup_")
+    env = dict(os.environ, TMPDIR=scratch, TEMP=scratch, TMP=scratch)
+    commit = get_commit()
+    over = []
+    print("{:<20} {:>10} {:>10}".format("Command", "Best (ms)", "Median (ms)"))
+    try:
+        with open(output, 'a') as f:
+            for label, args, counted in COMMANDS:
+                times = time_command(args, runs, env)
+                median = statistics.median(times)
+                print("{:<20} {:>10.1f} {:>10.1f}".format(label, min(times), median))
+                f.write(json.dumps({"benchmark": "startup", "command": label, "runs": runs, "best_ms": min(times),
+                                    "median_ms": median, "commit": commit,
+                                    "date": datetime.now().isoformat(timespec="seconds")}) + "\n")
+                if counted and median > target:
+                    over.append(label)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if over:
+        print("\nOver the {} ms target: {}".format(target, ", ".join(over)))
+        return 1
+    print("\nAll commands within the {} ms target.".format(target))
+    return 0
+
+
+if __name__ == "__main__":
+    runs = DEFAULT_RUNS
+    target = DEFAULT_TARGET
+    output = DEFAULT_OUTPUT
+    for arg in sys.argv[1:]:
+        if arg.startswith("--runs="):
+            runs = int(arg.split("=", 1)[1])
+        elif arg.startswith("--target="):
+            target = float(arg.split("=", 1)[1])
+        elif arg.startswith("--output="):
+            output = arg.split("=", 1)[1]
+    sys.exit(run(runs, target, output))
@@ -1,7 +1,9 @@
+import sys
+
 import mpfam.mpfam
 
 def main():
-  mpfam.mpfam.launch()
+  sys.exit(mpfam.mpfam.launch())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,230 @@
+import os
+import sqlite3
+
+# Bump when the schema changes, so an old catalog is rebuilt
+SCHEMA_VERSION = 3
+SCHEMA = """
+CREATE TABLE folders (tree TEXT, path TEXT, mtime_ns INTEGER, PRIMARY KEY (tree, path));
+CREATE TABLE files (tree TEXT, folder TEXT, filename TEXT, PRIMARY KEY (tree, folder, filename));
+CREATE INDEX files_by_name ON files (filename, tree);
+CREATE TABLE requirements (machine TEXT, filename TEXT, mode TEXT, track TEXT, parent TEXT, streaming INTEGER,
+                           PRIMARY KEY (machine, filename));
+CREATE TABLE hashes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT);
+CREATE TABLE audio (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,
+                    samplerate INTEGER, channels INTEGER, frames INTEGER, subtype TEXT);
+CREATE TABLE levels (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, peak REAL, rms REAL, lead INTEGER,
+                     trail INTEGER, frames INTEGER, samplerate INTEGER, channels INTEGER, threshold REAL);
+CREATE TABLE exports (machine TEXT, arcname TEXT, path TEXT, size INTEGER, mtime REAL, hash TEXT,
+                      exported TEXT, PRIMARY KEY (machine, arcname));
+"""
+# Tables of file metadata keyed by path, pruned as files are removed from their trees
+CACHE_TABLES = ("hashes", "audio", "levels")
+
+
+class CatalogCache(object):
+    """StatCache-compatible view of one catalog table, for HashIndex and get_audio_info()."""
+
+    def __init__(self, catalog, table, columns, factory):
+        """Initialize with the table's value columns and a function building a value from them."""
+        self.catalog = catalog
+        self.table = table
+        self.columns = columns
+        self.factory = factory
+        self._pending = {}  # Key: file path, Value: row waiting for save()
+
+    def get(self, path, stat=None):
+        """Return the cached value for a path, or None if it is missing or the file has changed."""
+        row = self._pending.get(path)
+        if row is None:
+            row = self.catalog.db.execute("SELECT size, mtime_ns, {} FROM {} WHERE path = ?".format(
+                ", ".join(self.columns), self.table), (path,)).fetchone()
+        if row is None:
+            return None
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except(FileNotFoundError):
+                return None
+        if row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return self.factory(*row[2:])
+
+    def set(self, path, value, stat=None):
+        """Store a value for a path, stamped with the file's current size and mtime."""
+        if stat is None:
+            stat = os.stat(path)
+        values = tuple(value) if len(self.columns) > 1 else (value,)
+        self._pending[path] = (stat.st_size, stat.st_mtime_ns) + values
+
+    def prune(self, paths):
+        """Drop entries for any path not in the given collection."""
+        self.save()
+        with self.catalog.db:
+            self.catalog.db.execute("CREATE TEMP TABLE IF NOT EXISTS keep (path TEXT PRIMARY KEY)")
+            self.catalog.db.execute("DELETE FROM keep")
+            self.catalog.db.executemany("INSERT OR IGNORE INTO keep VALUES (?)", ((path,) for path in paths))
+            self.catalog.db.execute("DELETE FROM {} WHERE path NOT IN (SELECT path FROM keep)".format(self.table))
+
+    def save(self):
+        """Write new entries to the catalog."""
+        if not self._pending:
+            return
+        with self.catalog.db:
+            self.catalog.db.executemany("INSERT OR REPLACE INTO {} (path, size, mtime_ns, {}) VALUES ({})".format(
+                self.table, ", ".join(self.columns), ", ".join("?" * (len(self.columns) + 3))),
+                ((path,) + row for path, row in self._pending.items()))
+        self._pending = {}
+
+    def __len__(self):
+        """Length is the number of cached entries."""
+        self.save()
+        return self.catalog.db.execute("SELECT COUNT(*) FROM {}".format(self.table)).fetchone()[0]
+
+
+class AssetCatalog(object):
+    """Persistent SQLite catalog of source and machine files, config requirements, file metadata, and exports.
+
+    Trees and requirements are synced incrementally after each scan, so later
+    queries (which mode needs a file, what changed since the last export) are
+    indexed lookups instead of rescans.
+    """
+
+    def __init__(self, db_path, log):
+        """Initialize: open the catalog, creating or rebuilding its schema if needed."""
+        self.db_path = db_path
+        self.log = log
+        try:
+            self.db = self._open()
+        except(sqlite3.DatabaseError) as e:
+            self.log.warning("    - Could not open catalog {}, rebuilding it:\n        {}".format(db_path, e))
+            os.remove(db_path)
+            self.db = self._open()
+
+    def _open(self):
+        db = sqlite3.connect(self.db_path)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            with db:
+                for (table,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                    db.execute("DROP TABLE {}".format(table))
+                db.executescript(SCHEMA)
+                db.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        return db
+
+    def close(self):
+        self.db.close()
+
+    def get_hash_cache(self):
+        """Return a cache of file content hashes, for a HashIndex."""
+        return CatalogCache(self, "hashes", ("hash",), lambda filehash: filehash)
+
+    def get_audio_cache(self):
+        """Return a cache of audio header metadata, for get_audio_info()."""
+        from mpfam.core.AudioMetadata import AudioInfo  # Imported here, since it loads soundfile
+        return CatalogCache(self, "audio", AudioInfo._fields, AudioInfo)
+
+    def get_levels_cache(self):
+        """Return a cache of audio peak, RMS, and silence levels, for get_audio_levels()."""
+        from mpfam.core.AudioAnalysis import AudioLevels  # Imported here, since it loads numpy and soundfile
+        return CatalogCache(self, "levels", AudioLevels._fields, AudioLevels)
+
+    def sync_tree(self, tree):
+        """Update the files of an AssetTree, rewriting only folders whose mtime changed. Return the count updated.
+
+        Hashes, audio metadata, and levels cached for files that were removed are deleted.
+        """
+        stored = dict(self.db.execute("SELECT path, mtime_ns FROM folders WHERE tree = ?", (tree.root,)))
+        folders = tree.get_folders()
+        changed = [path for path, (mtime, __dirs, __files) in folders.items() if stored.get(path) != mtime]
+        removed = [path for path in stored if path not in folders]
+        if not changed and not removed:
+            return 0
+        # Files no longer in a rescanned folder can't be looked up again, so drop their cached metadata
+        gone = []
+        for path in [path for path in changed + removed if path in stored]:
+            current = set(folders[path][2]) if path in folders else set()
+            gone.extend(os.path.join(path, filename) for (filename,) in self.db.execute(
+                "SELECT filename FROM files WHERE tree = ? AND folder = ?", (tree.root, path))
+                if filename not in current)
+        with self.db:
+            for table in CACHE_TABLES:
+                self.db.executemany("DELETE FROM {} WHERE path = ?".format(table), ((path,) for path in gone))
+            self.db.executemany("DELETE FROM files WHERE tree = ? AND folder = ?",
+                                ((tree.root, path) for path in changed + removed))
+            self.db.executemany("DELETE FROM folders WHERE tree = ? AND path = ?",
+                                ((tree.root, path) for path in removed))
+            self.db.executemany("INSERT OR REPLACE INTO folders VALUES (?, ?, ?)",
+                                ((tree.root, path, folders[path][0]) for path in changed))
+            self.db.executemany("INSERT OR IGNORE INTO files VALUES (?, ?, ?)",
+                                ((tree.root, path, filename) for path in changed for filename in folders[path][2]))
+        return len(changed) + len(removed)
+
+    def sync_requirements(self, machine_path, required_assets):
+        """Update the files each mode requires from a RequiredAssets, writing only the differences."""
+        current = {}
+        for mode, sounds in required_assets.get_all_configs().items():
+            parent = required_assets.get_mode_parent(mode)
+            for track, filenames in sounds.by_track().items():
+                for filename in filenames:
+                    if filename not in current:
+                        current[filename] = (mode, track, parent, int(sounds.is_streaming(filename)))
+        stored = {row[0]: tuple(row[1:]) for row in self.db.execute(
+            "SELECT filename, mode, track, parent, streaming FROM requirements WHERE machine = ?", (machine_path,))}
+        changed = [filename for filename, row in current.items() if stored.get(filename) != row]
+        removed = [filename for filename in stored if filename not in current]
+        if changed or removed:
+            with self.db:
+                self.db.executemany("DELETE FROM requirements WHERE machine = ? AND filename = ?",
+                                    ((machine_path, filename) for filename in removed))
+                self.db.executemany("INSERT OR REPLACE INTO requirements VALUES (?, ?, ?, ?, ?, ?)",
+                                    ((machine_path, filename) + current[filename] for filename in changed))
+        return len(changed) + len(removed)
+
+    def find_requirement(self, machine_path, filename):
+        """Return (mode, track, parent, streaming) for the mode requiring a file, or None."""
+        return self.db.execute("SELECT mode, track, parent, streaming FROM requirements "
+                               "WHERE machine = ? AND filename = ?", (machine_path, filename)).fetchone()
+
+    def find_file(self, tree_root, filename):
+        """Return every path of a filename within a tree."""
+        return [os.path.join(folder, filename) for (folder,) in self.db.execute(
+            "SELECT folder FROM files WHERE filename = ? AND tree = ? ORDER BY folder", (filename, tree_root))]
+
+    def record_export(self, machine_path, manifest):
+        """Replace the last export of a machine with the files of an ExportManifest."""
+        with self.db:
+            self.db.execute("DELETE FROM exports WHERE machine = ?", (machine_path,))
+            self.db.executemany("INSERT INTO exports VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                ((machine_path, arcname, entry["path"], entry["size"], entry["mtime"],
+                                  entry["hash"], manifest.exported) for arcname, entry in manifest.files.items()))
+
+    def get_last_export(self, machine_path):
+        """Return the timestamp of the machine's last recorded export, or None."""
+        row = self.db.execute("SELECT MAX(exported) FROM exports WHERE machine = ?", (machine_path,)).fetchone()
+        return row[0]
+
+    def changed_since_export(self, machine_path, files):
+        """Compare (arcname, path, stat) tuples to the last export, returning (added, changed, removed) arcnames.
+
+        A file whose size or mtime differs but whose cached hash matches the export is unchanged.
+        """
+        with self.db:
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS current_files "
+                            "(arcname TEXT PRIMARY KEY, path TEXT, size INTEGER, mtime REAL, mtime_ns INTEGER)")
+            self.db.execute("DELETE FROM current_files")
+            self.db.executemany("INSERT OR REPLACE INTO current_files VALUES (?, ?, ?, ?, ?)",
+                                ((arcname, path, stat.st_size, stat.st_mtime, stat.st_mtime_ns)
+                                 for arcname, path, stat in files))
+        added = [arcname for (arcname,) in self.db.execute(
+            "SELECT c.arcname FROM current_files c LEFT JOIN exports e ON e.machine = ? AND e.arcname = c.arcname "
+            "WHERE e.arcname IS NULL ORDER BY c.arcname", (machine_path,))]
+        changed = [arcname for (arcname,) in self.db.execute(
+            "SELECT c.arcname FROM current_files c JOIN exports e ON e.machine = ? AND e.arcname = c.arcname "
+            "LEFT JOIN hashes h ON h.path = c.path AND h.size = c.size AND h.mtime_ns = c.mtime_ns "
+            "WHERE (e.size != c.size OR e.mtime != c.mtime) AND (h.hash IS NULL OR h.hash != e.hash) "
+            "ORDER BY c.arcname", (machine_path,))]
+        removed = [arcname for (arcname,) in self.db.execute(
+            "SELECT arcname FROM exports WHERE machine = ? AND arcname NOT IN (SELECT arcname FROM current_files) "
+            "ORDER BY arcname", (machine_path,))]
+        return added, changed, removed
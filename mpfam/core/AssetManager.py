@@ -1,4 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import difflib
+import glob
+import hashlib
+import json
 import logging
 import os
 import pickle
@@ -6,77 +11,185 @@ import re
 import shutil
 import sys
 import tempfile
-from zipfile import ZipFile
+import time
+import zipfile
 
-# Requires: pysoundfile (via pip)
-import soundfile as sf
 import mpfam
-from mpfam.core.AssetTree import AssetTree
-from mpfam.core.RequiredAssets import RequiredAssets
+from mpfam.core.AssetCatalog import AssetCatalog
+from mpfam.core.AssetTree import AssetTree, get_backup_path
+from mpfam.core.CheckReport import CheckReport
+from mpfam.core.CopyEngine import CopyEngine
+from mpfam.core.ExecutionPlan import ExecutionPlan, PlanJournal
+from mpfam.core.ExportArchive import CONFIG_PATCH_NAME, EXPORT_MANIFEST_NAME, RENAMES_NAME, ExportArchive, ExportManifest
+from mpfam.core.HashIndex import HashIndex, crc32_file
+from mpfam.core.MemoryFootprint import BYTES_PER_SAMPLE, MEGABYTE, MemoryFootprint
+from mpfam.core.PhaseTimer import PhaseTimer
+from mpfam.core.SourceMedia import SourceMedia
+from mpfam.core.StatCache import StatCache, get_cache_path
+from mpfam.core.Transcoder import get_cached_path, get_output_name, get_profile_key, transcode_file
+from mpfam.core.TreeWalker import CONFIG_EXTENSIONS, MachineScan, get_extension, scan_folder, walk_tree
+from mpfam.core.WorkerPool import process_map
+from mpfam.core.ZipAssetTree import ZipAssetTree
+# The audio (numpy, soundfile) and config (MPF) modules are imported by the methods that use them,
+# so commands that don't read audio or configs start quickly
+
 
 class AssetManager():
     """Master class for managing audio and video assets."""
 
-    def __init__(self, verbose=False):
+    # Bump when the contents of the check snapshot change, so stale snapshots are discarded
+    CHECK_STATE_VERSION = 1
+
+    def __init__(self, verbose=False, workers=None, timing=False, threads=None, link_mode=None, transcode=None):
         """Initialize and find sources."""
         mpfam_path = os.path.abspath(os.path.join(mpfam.__path__[0],
                                                      os.pardir))
         self.machine_configs = None
         self.machine_assets = None
+        self.machine_scan = None
         self.source_media = None
+        self.catalog = None
         self._analysis = None
+        self._analysis_entries = {}  # Key: filename, Value: (category, key) pairs it added to the analysis
+        self._analysis_verify = False  # Whether the analysis compares assets in place to their source
+        # Key: filename, Value: (expected path, source path, their stamps) when last verified
+        self._verify_stamps = {}
+        self._config_stamps = {}  # Key: config path, Value: (size, mtime_ns) when the configs were loaded
+        self._last_refresh = {}  # Counts of the changes found by the last refresh_analysis()
         self._paths = { "source_path": None, "machine_path": None }
+        self._extra_source_paths = []  # Lower priority source folders, highest priority first
+        self._config_loaded = False
+        self._prompt = True  # Whether a missing folder is asked for, or left unset
         self._config_file_path = os.path.join(mpfam_path, ".mpfam_config")
         self.cache_file_name = "mpfam_cache"
+        self.config_cache_name = "config_cache"
+        self.catalog_name = "catalog.sqlite"
+        self.check_state_name = "check"
+        self.transcode_cache_name = "transcoded"
+        self.workers = workers
+        self.timing = timing
+        self.threads = threads
+        self.link_mode = link_mode
+        self.transcode = transcode  # TranscodeProfile applied to assets as they are exported or copied
+        self.timer = PhaseTimer()
 
         self.log = logging.getLogger()
         self.log.addHandler(logging.StreamHandler(sys.stdout))
         self.log.setLevel("DEBUG" if verbose else "INFO")
-        self._get_config_path("source_path")
-        self._get_config_path("machine_path")
-
-        self.conversion_root_folder = os.path.join(self.machine_path, "mpfam_resample")
-        self.conversion_originals_folder = os.path.join(self.conversion_root_folder, "originals")
-        self.conversion_converted_folder = os.path.join(self.conversion_root_folder, "converted")
+        # The machine and source folders are read (or asked for) when a command first needs them
         self.converted_media = None
 
-    def _get_cache_path(self):
-        return os.path.join(tempfile.gettempdir(), self.cache_file_name)
+    def _get_cache_path(self, root):
+        # Each source folder has its own cache, so switching or adding sources doesn't discard it
+        key = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(tempfile.gettempdir(), "{}_{}".format(self.cache_file_name, key))
 
-    def _write_to_cache(self, data):
-        with open(self._get_cache_path(), 'wb') as f:
-            pickle.dump(data, f)
+    def _write_to_cache(self, tree):
+        cache_path = self._get_cache_path(tree.root)
+        tmp_path = "{}.tmp".format(cache_path)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
 
     def clear_cache(self):
-        """Remove cached asset tree, if it exists."""
-        try:
-            os.remove(self._get_cache_path())
-            self.log.info("Cache file removed")
-        except Exception as e:
-            self.log.warning("Unable to remove cache file: {}".format(e))
+        """Remove cached asset trees, parsed configs, and the asset catalog, if they exist."""
+        self.source_media = None
+        # The analysis was made from the trees being dropped, so it can't be refreshed from them
+        self._analysis = None
+        self._analysis_entries = {}
+        self._verify_stamps = {}
+        # Only the folders already configured have caches, so don't ask for missing ones
+        self._load_config()
+        for root in [root for root in [self._paths["source_path"]] + self._extra_source_paths if root]:
+            try:
+                os.remove(self._get_cache_path(root))
+                self.log.info("Cache file removed for {}".format(root))
+            except Exception as e:
+                self.log.warning("Unable to remove cache file for {}: {}".format(root, e))
+        if self.catalog:
+            self.catalog.close()
+            self.catalog = None
+        catalog_path = get_cache_path(self.catalog_name)
+        for path in (get_cache_path(self.config_cache_name), catalog_path,
+                     "{}-wal".format(catalog_path), "{}-shm".format(catalog_path)):
+            try:
+                os.remove(path)
+            except(FileNotFoundError):
+                pass
+        shutil.rmtree(get_cache_path(self.transcode_cache_name), ignore_errors=True)
+        for path in glob.glob("{}_*".format(get_cache_path(self.check_state_name))):
+            os.remove(path)
+
+    def _get_catalog(self):
+        """Return the persistent asset catalog, opening it on first use."""
+        if not self.catalog:
+            self.catalog = AssetCatalog(get_cache_path(self.catalog_name), self.log)
+        return self.catalog
+
+    def _get_machine_scan(self, refresh=False):
+        """Walk the machine folder once for its audio, video, and config files."""
+        if refresh or not self.machine_scan:
+            with self.timer.phase("machine scan") as span:
+                self.machine_scan = MachineScan(self.machine_path, exclude=self._get_machine_excludes())
+                span.add(sum(len(files) for __path, __mtime, __dirs, files in self.machine_scan.sound_folders) +
+                         len(self.machine_scan.configs) + len(self.machine_scan.videos))
+        return self.machine_scan
 
-    def _load_machine_configs(self, refresh=False):
+    def _get_machine_excludes(self):
+        """Return the path prefixes of the folders mpfam writes to inside the machine folder, which aren't assets.
+
+        They are matched by prefix on every walk and revalidation, so delta exports
+        (mpfam_exports_delta_*) made after a tree was built are excluded too.
+        """
+        return [self.exports_path, self.conversion_root_folder]
+
+    def _load_machine_configs(self, refresh=False, configs=None):
         if refresh or not self.machine_configs:
+            from mpfam.core.RequiredAssets import RequiredAssets  # Imported here, since it loads MPF
             self.log.info("  Loading config files...")
-            self.machine_configs = RequiredAssets(self.machine_path, self.log)
+            if configs is None:
+                configs = self._get_machine_scan().configs
+            with self.timer.phase("config load") as span:
+                self.machine_configs = RequiredAssets(self.machine_path, self.log,
+                                                      cache=StatCache(get_cache_path(self.config_cache_name), self.log),
+                                                      workers=self.workers, report_timing=self.timing,
+                                                      configs=configs)
+                span.add(len(configs), sum(stat.st_size for __path, stat in configs))
+            self._config_stamps = self._get_config_stamps()
+            for filename, mode, othermode in self.machine_configs.conflicts:
+                self.log.error("ERROR: Sound file '{}' in mode {} also exists in mode {}".format(
+                               filename, othermode, mode))
+            self._get_catalog().sync_requirements(self.machine_path, self.machine_configs)
 
-    def _load_source_media(self, refresh=False):
-        self.log.info("  Looking for source media cache...")
-        try:
-            with open(self._get_cache_path(), 'rb') as f:
-                self.source_media = pickle.load(f)
-                stamp = os.path.getmtime(self._get_cache_path())
-                self.log.info("    - Cache found from {}".format(
-                              datetime.fromtimestamp(stamp).strftime("%b %d %Y %H:%M:%S")))
-        except Exception as e:
-            self.log.warning("    - Could not load cache file:\n        {}".format(e))
+    @staticmethod
+    def _get_source_tree_class(root):
+        """Exported zip files can be used as a source directly, without extracting them."""
+        return ZipAssetTree if os.path.isfile(root) and zipfile.is_zipfile(root) else AssetTree
 
-        if refresh or not self.source_media:
-            self.log.info("  Loading media files from source folder...")
-            self.source_media = AssetTree(self._paths["source_path"], self.log)
+    def _get_source_roots(self):
+        """Return the source folders to load, highest priority first.
 
-            self.log.info("   - creating cache of source media...")
-            self._write_to_cache(self.source_media)
+        Lower priority folders that no longer exist are skipped. A zip file can only
+        be the sole source, since its members are extracted instead of copied.
+        """
+        roots = [self.source_path] if self.source_path else []
+        for root in self._extra_source_paths:
+            if os.path.exists(root):
+                roots.append(root)
+            else:
+                self.log.warning("  Source folder {} not found, skipping it".format(root))
+        if len(roots) > 1:
+            for root in [root for root in roots if self._get_source_tree_class(root) is ZipAssetTree]:
+                self.log.warning("  Zip source {} can only be used as the only source, skipping it".format(root))
+                roots.remove(root)
+        return roots
+
+    def _load_source_media(self, refresh=False):
+        with self.timer.phase("source scan") as span:
+            self._load_source_trees()
+            span.add(len(self.source_media))
+        for tree in self.source_media.trees:
+            self._get_catalog().sync_tree(tree)
 
         if refresh or not self.converted_media:
             try:
@@ -86,14 +199,77 @@ class AssetManager():
             except(FileNotFoundError):
                 self.log.info("  No converted media files found.")
 
+    def _load_source_trees(self):
+        """Load every source folder's tree and merge them, or rescan the changed folders of trees already loaded.
+
+        Each folder has its own cache, and the folders are loaded concurrently.
+        """
+        roots = self._get_source_roots()
+        if self.source_media and self.source_media.roots == roots:
+            changed = self.source_media.revalidate(self.log)
+            for tree in self.source_media.changed_trees:
+                self._write_to_cache(tree)
+            if changed:
+                self.log.info("    - {} changed source folder{} rescanned".format(changed, "" if changed == 1 else "s"))
+            return
+        loaded = dict((tree.root, tree) for tree in self.source_media.trees) if self.source_media else {}
+        with ThreadPoolExecutor(max_workers=max(len(roots), 1)) as executor:
+            trees = list(executor.map(lambda root: loaded.get(root) or self._load_source_tree(root), roots))
+        self.source_media = SourceMedia(trees, self.log)
+
+    def _load_source_tree(self, root):
+        """Load a source folder's tree from its cache and rescan changed folders, or scan it from scratch."""
+        tree_class = self._get_source_tree_class(root)
+        cache_path = self._get_cache_path(root)
+        tree = None
+        self.log.info("  Looking for source media cache for {}...".format(root))
+        try:
+            with open(cache_path, 'rb') as f:
+                tree = pickle.load(f)
+            if getattr(tree, "version", None) != AssetTree.VERSION or \
+               type(tree) is not tree_class or tree.root != root:
+                tree = None
+                raise ValueError("Cache file does not match this version of mpfam or source folder")
+            stamp = os.path.getmtime(cache_path)
+            self.log.info("    - Cache found from {}".format(
+                          datetime.fromtimestamp(stamp).strftime("%b %d %Y %H:%M:%S")))
+        except(FileNotFoundError):
+            self.log.info("    - No cache found for {}".format(root))
+        except Exception as e:
+            tree = None
+            self.log.warning("    - Could not load cache file:\n        {}".format(e))
+
+        if tree:
+            changed = tree.revalidate(self.log)
+            if changed:
+                self.log.info("    - {} changed folder{} rescanned in {}, updating cache...".format(
+                              changed, "" if changed == 1 else "s", root))
+                self._write_to_cache(tree)
+            else:
+                self.log.info("    - Source media unchanged across {} folders in {}".format(
+                              tree.get_folder_count(), root))
+        else:
+            self.log.info("  Loading media files from source folder {}...".format(root))
+            tree = tree_class(root, self.log)
+
+            self.log.info("   - creating cache of source media...")
+            self._write_to_cache(tree)
+        return tree
+
     def _load_machine_assets(self, refresh=False):
         if refresh or not self.machine_assets:
-            self.log.info("  Loading assets from machine folder {}...".format(self._paths["machine_path"]))
-            self.machine_assets = AssetTree(self._paths["machine_path"], self.log, paths_to_exclude=[
-                self.exports_path, self.conversion_originals_folder, self.conversion_converted_folder])
+            self.log.info("  Loading assets from machine folder {}...".format(self.machine_path))
+            folders = self._get_machine_scan().sound_folders
+            with self.timer.phase("machine index") as span:
+                self.machine_assets = AssetTree(self.machine_path, self.log,
+                                                paths_to_exclude=self._get_machine_excludes(), folders=folders)
+                span.add(len(self.machine_assets))
+            self._get_catalog().sync_tree(self.machine_assets)
 
     def refresh(self):
         """Re-traverse the configs and asset folders."""
+        self._analysis = None
+        self._get_machine_scan(refresh=True)
         self._load_machine_configs(refresh=True)
         self._load_source_media(refresh=True)
         self._load_machine_assets(refresh=True)
@@ -101,6 +277,8 @@ class AssetManager():
     def _set_config_path(self, path_type):
         """Define the path to look for media assets."""
         target = "media source" if path_type == "source_path" else "MPF machine"
+        # Read the saved folders first, so saving doesn't forget the other one
+        self._load_config()
         # Use print instead of log because this requires explicit user input and shouldn't be muted
         print("Set path to your {} folder:".format(target))
         rawpath = input(">> ").strip()
@@ -112,22 +290,44 @@ class AssetManager():
             self._paths[path_type] = rawpath.replace("~", root)
         else:
             self._paths[path_type] = rawpath
+        self._save_config()
+        # Source trees are cached per path, so a new path only needs to drop the in-memory tree
+        if path_type == "source_path":
+            self.source_media = None
+            self._analysis = None
+        return self._paths[path_type]
+
+    def _save_config(self):
         with open(self._config_file_path, 'wb') as f:
             config = {
                 "source_path": self._paths["source_path"],
-                "machine_path": self._paths["machine_path"]
+                "machine_path": self._paths["machine_path"],
+                "extra_source_paths": self._extra_source_paths
             }
             pickle.dump(config, f)
-        self.clear_cache()
-        return self._paths[path_type]
+
+    def _load_config(self):
+        """Read the saved folders from the config file, if there is one, without asking for missing ones."""
+        if self._config_loaded:
+            return
+        self._config_loaded = True
+        try:
+            with open(self._config_file_path, 'rb') as f:
+                config = pickle.load(f)
+        except(FileNotFoundError):
+            return
+        self._paths["source_path"] = config.get("source_path")
+        self._paths["machine_path"] = config.get("machine_path")
+        self._extra_source_paths = config.get("extra_source_paths", [])
 
     def _get_config_path(self, path_type):
         if not self._paths[path_type]:
+            self._load_config()
+            if not self._prompt:
+                if self._paths[path_type] and not os.path.exists(self._paths[path_type]):
+                    self._paths[path_type] = None
+                return self._paths[path_type]
             try:
-                with open(self._config_file_path, 'rb') as f:
-                    config = pickle.load(f)
-                    self._paths["source_path"] = config.get("source_path")
-                    self._paths["machine_path"] = config.get("machine_path")
                 if not self._paths[path_type] or not os.stat(self._paths[path_type]):
                     raise FileNotFoundError()
             except(FileNotFoundError):
@@ -142,22 +342,96 @@ class AssetManager():
                 sys.exit()
         return self._paths[path_type]
 
+    def use_machine_path(self, path):
+        """Use a machine folder for this run only, and never ask for a folder.
+
+        The saved source folders are used if they exist. Without one, required files
+        that aren't in the machine folder can only be reported as missing.
+        """
+        self._load_config()
+        self._paths["machine_path"] = os.path.abspath(os.path.expanduser(path))
+        self._prompt = False
+
     @property
     def source_path(self):
-        return self._paths["source_path"]
+        return self._get_config_path("source_path")
 
     def set_source_path(self):
         return self._set_config_path("source_path")
 
+    @property
+    def source_paths(self):
+        """Return every configured source folder, highest priority first."""
+        return [self.source_path] + self._extra_source_paths
+
+    def add_source_path(self, path, first=False):
+        """Add a source folder, at the lowest priority or (with first) the highest."""
+        path = os.path.abspath(os.path.expanduser(path))
+        if not os.path.exists(path):
+            self.log.error("ERROR: Source folder {} not found".format(path))
+            return False
+        if path in self.source_paths:
+            self.remove_source_path(path)
+        if first:
+            self._extra_source_paths.insert(0, self._paths["source_path"])
+            self._paths["source_path"] = path
+        else:
+            self._extra_source_paths.append(path)
+        self._save_config()
+        self._analysis = None
+        return True
+
+    def remove_source_path(self, path):
+        """Remove a source folder. The highest priority folder can only be removed if there's another."""
+        path = os.path.abspath(os.path.expanduser(path))
+        if path in self._extra_source_paths:
+            self._extra_source_paths.remove(path)
+        elif path == self._paths["source_path"] and self._extra_source_paths:
+            self._paths["source_path"] = self._extra_source_paths.pop(0)
+        else:
+            self.log.error("ERROR: {} is not a removable source folder".format(path))
+            return False
+        self._save_config()
+        self._analysis = None
+        return True
+
+    def list_source_paths(self):
+        """Log the source folders in priority order."""
+        self.log.info("\nSource folders, highest priority first:")
+        for index, path in enumerate(self.source_paths):
+            self.log.info("  {}. {}{}".format(index + 1, path, "" if os.path.exists(path) else " (not found)"))
+
     @property
     def machine_path(self):
-        return self._paths["machine_path"]
+        return self._get_config_path("machine_path")
+
     @property
     def exports_path(self):
-        return os.path.join(self._paths["machine_path"], "mpfam_exports")
+        return os.path.join(self.machine_path, "mpfam_exports")
+
+    @property
+    def conversion_root_folder(self):
+        return os.path.join(self.machine_path, "mpfam_resample")
 
-    def parse_machine_assets(self, write_mode=False, force_update=False, export_only=False):
-        """Main method for mapping assets to config files and updating (if write-mode)."""
+    @property
+    def conversion_originals_folder(self):
+        return os.path.join(self.conversion_root_folder, "originals")
+
+    @property
+    def conversion_converted_folder(self):
+        return os.path.join(self.conversion_root_folder, "converted")
+
+    @property
+    def export_manifest_path(self):
+        # Kept beside the exports so a delta export can compare against the last one
+        return "{}.manifest.json".format(self.exports_path)
+
+    def parse_machine_assets(self, write_mode=False, force_update=False, export_only=False, verify=False):
+        """Main method for mapping assets to config files and updating (if write-mode).
+
+        With verify (or force_update), assets already in place are compared to their
+        source files and any that differ are marked as outdated, to be copied again.
+        """
         self.log.info("\nMPF Asset Manager [{}]".format(
             "EXPORT ONLY" if export_only else "WRITE MODE" if write_mode else "READ-ONLY"))
         self.log.info("----------------------------------------------------")
@@ -165,90 +439,32 @@ class AssetManager():
         self._load_machine_configs()
         self._load_machine_assets()
         self._load_source_media()
-        matchedfilescount = 0
 
         self._analysis = {
-            'found': [],
-            'missing': [],
-            'available': {},
-            'unavailable': [],
+            'found': {},  # Key: sound file name
+            'missing': {},  # Key: sound file name
+            'available': {},  # Key: expected file path; Value: source file path
+            'outdated': {},  # Key: expected file path; Value: source file path with different contents
+            'unavailable': {},  # Key: sound file name
             'misplaced': {},  # Key: expected file path; Value: current/wrong file path
-            'orphaned': [],
-            'duplicated': [],
+            'orphaned': {},  # Key: file path
+            'duplicated': {},  # Key: file path
             'sounds': {}  # Key: sound file name; Value: sound object
         }
+        self._analysis_entries = {}
+        self._verify_stamps = {}
+        self._analysis_verify = force_update or verify
 
         self.log.info("\nComparing current file tree to config assets:")
-
-        dupes = self.machine_assets.get_duplicates()
-        # First, look through all the files that exist in the mode folders to find orphaned, misplaced, and duplicate
-        for __idx, filename in enumerate(self.machine_assets.get_files()):
-            filepath = self.machine_assets.get_file_path(filename)
-            mode = self.machine_configs.find_requiring_mode(filename)
-            # If this file is not required by any configs
-            if not mode:
-                self._analysis['orphaned'].append(filepath)
-            else:
-                expectedpath = "{}/modes/{}/sounds/{}/{}".format(
-                    self.machine_path,
-                    self.machine_configs.get_mode_parent(mode.name),
-                    mode.find_track_for_sound(filename),
-                    filename
-                    )
-                if filepath != expectedpath:
-                    self.log.info("{} is in the wrong place. Expected {}".format(filepath, expectedpath))
-                    self._analysis['misplaced'][expectedpath] = filepath
-                elif filename in dupes:
-                    # The expected path is for the ONE mode that legit requires this file
-                    for dupepath in dupes[filename]:
-                        if expectedpath != dupepath and dupepath not in self._analysis['duplicated']:
-                            self._analysis['duplicated'].append(dupepath)
-                else:
-                    matchedfilescount += 1
-                    self.log.debug("Matched {} in node {}".format(filename, mode.name))
-
-        allconfigs = self.machine_configs.get_all_configs()
-
-        for mode, modesounds in allconfigs.items():
-            for track, sounds in modesounds.by_track().items():
-                for sound in sounds:
-                    if sound in self._analysis['sounds']:
-                        self.log.error("ERROR: Sound file '{}' in mode {} also exists in mode {}".format(
-                              sound, mode, self._analysis['sounds'][sound]['mode']))
-                        return
-                    modepath = "{}/modes/{}/sounds/{}/".format(
-                        self.machine_path,
-                        self.machine_configs.get_mode_parent(mode),
-                        track
-                    )
-                    sourcepath = None
-                    exists = False
-                    expectedpath = "{}{}".format(modepath, sound)
-                    try:
-                        # To force an update, don't "find" any files
-                        if force_update:
-                            raise FileNotFoundError
-                        exists = os.stat(expectedpath)
-                        self._analysis['found'].append(sound)
-                    except(FileNotFoundError):
-                        # Is this file misplaced? Are we planning on moving it?
-                        if expectedpath in self._analysis['misplaced']:
-                            pass
-                        else:
-                            self._analysis['missing'].append(sound)
-                            try:
-                                sourcepath = self.source_media.get_file_path(sound)
-                                self._analysis['available'][expectedpath] = sourcepath
-                            except(ValueError):
-                                self._analysis['unavailable'].append(sound)
-
-                    self._analysis['sounds'][sound] = {"mode": mode,
-                                                       "modepath": modepath,
-                                                       "sourcepath": sourcepath,
-                                                       "exists": exists}
+        with self.timer.phase("comparison") as span:
+            # Required files in config order, then the files in the mode folders that no config requires
+            self._update_analysis(self.machine_configs.get_required_files() +
+                                  [filename for filename in self.machine_assets.get_files()
+                                   if not self.machine_configs.find_sound_location(filename)])
+            span.add(len(self._analysis['sounds']))
 
         self.log.info("  Found {} assets defined across {} config files.".format(
-                      len(self._analysis['sounds']), len(allconfigs)))
+                      len(self._analysis['sounds']), len(self.machine_configs.get_all_configs())))
         self.log.info("   - {} files correctly accounted for".format(
                       len(self._analysis['found'])))
         if self._analysis['misplaced']:
@@ -265,67 +481,301 @@ class AssetManager():
                           len(self._analysis['available']), "and copied" if write_mode else "for copy"))
             for filename, sourcepath in self._analysis['available'].items():
                 self.log.debug("    : {} -> {}".format(sourcepath, filename))
+        if self._analysis['outdated']:
+            self.log.info("   - {} files differ from the source{}".format(
+                          len(self._analysis['outdated']), " and will be replaced" if write_mode else ""))
+            for filename, sourcepath in self._analysis['outdated'].items():
+                self.log.debug("    : {} -> {}".format(sourcepath, filename))
         if self._analysis['unavailable']:
             self.log.info("   - {} files missing and unavailable".format(
                           len(self._analysis['unavailable'])))
 
-    def cleanup_machine_assets(self, write_mode=False, force_update=False):
+    def _update_analysis(self, filenames):
+        """Re-evaluate the given filenames, replacing whatever the analysis recorded for them before."""
+        verifications = []  # Tuples of (expected path, stat, source path) to compare
+        for filename in filenames:
+            for category, key in self._analysis_entries.pop(filename, []):
+                self._analysis[category].pop(key, None)
+            self._verify_stamps.pop(filename, None)
+        for filename in filenames:
+            self._evaluate_file(filename, verifications)
+        if verifications:
+            with self.timer.phase("verify") as span:
+                self._find_outdated_assets(verifications)
+                span.add(len(verifications))
+
+    def _add_entry(self, filename, category, key, value=None):
+        """Record a file in an analysis category, remembering it so it can be replaced later."""
+        self._analysis[category][key] = value
+        self._analysis_entries.setdefault(filename, []).append((category, key))
+
+    def _evaluate_file(self, filename, verifications):
+        """Compare a single filename's config entry, mode folder copies, and source file."""
+        paths = self.machine_assets.get_file_paths(filename)
+        location = self.machine_configs.find_sound_location(filename)
+        # If this file is not required by any configs
+        if not location:
+            for filepath in paths:
+                self._add_entry(filename, 'orphaned', filepath, filename)
+            return
+
+        modepath = "{}/modes/{}/sounds/{}/".format(self.machine_path, location.parent, location.track)
+        expectedpath = "{}{}".format(modepath, filename)
+        if paths and expectedpath not in paths:
+            self.log.info("{} is in the wrong place. Expected {}".format(paths[0], expectedpath))
+            self._add_entry(filename, 'misplaced', expectedpath, paths[0])
+        else:
+            # The expected path is for the ONE mode that legit requires this file
+            for dupepath in paths:
+                if dupepath != expectedpath:
+                    self._add_entry(filename, 'duplicated', dupepath, filename)
+
+        sourcepath = None
+        exists = False
+        try:
+            exists = os.stat(expectedpath)
+            self._add_entry(filename, 'found', filename)
+            self.log.debug("Matched {} in node {}".format(filename, location.mode.name))
+            if self._analysis_verify:
+                try:
+                    sourcepath = self.source_media.get_file_path(filename)
+                    verifications.append((expectedpath, exists, sourcepath))
+                    self._verify_stamps[filename] = (expectedpath, sourcepath,
+                                                     self._get_verify_stamps(expectedpath, sourcepath))
+                except(ValueError):
+                    pass
+        except(FileNotFoundError):
+            # Is this file misplaced? Are we planning on moving it?
+            if expectedpath not in self._analysis['misplaced']:
+                self._add_entry(filename, 'missing', filename)
+                try:
+                    sourcepath = self.source_media.get_file_path(filename)
+                    self._add_entry(filename, 'available', expectedpath, sourcepath)
+                except(ValueError):
+                    self._add_entry(filename, 'unavailable', filename)
+
+        self._add_entry(filename, 'sounds', filename, {"mode": location.mode.name,
+                                                        "track": location.track,
+                                                        "modepath": modepath,
+                                                        "sourcepath": sourcepath,
+                                                        "exists": exists})
+
+    def refresh_analysis(self):
+        """Bring the analysis up to date with changes to the configs, source folder, and mode folders.
+
+        Only files whose mode or track changed in the configs, or whose folder changed
+        on disk, are re-evaluated. A file overwritten in place doesn't change its
+        folder, so when the analysis verifies, every verified file and its source are
+        also stat'ed again. Return the number of files re-evaluated.
+        """
+        filenames = set()
+        if self._analysis_verify:
+            filenames.update(filename for filename, (expectedpath, sourcepath, stamps) in self._verify_stamps.items()
+                             if self._get_verify_stamps(expectedpath, sourcepath) != stamps)
+        source_changed = self.source_media.revalidate(self.log)
+        for tree in self.source_media.changed_trees:
+            self._write_to_cache(tree)
+            self._get_catalog().sync_tree(tree)
+        filenames.update(self.source_media.changed_files)
+        machine_changed = self.machine_assets.revalidate(self.log)
+        if machine_changed:
+            self._get_catalog().sync_tree(self.machine_assets)
+            filenames.update(self.machine_assets.changed_files)
+
+        # A config added in a new folder changes no known config, only the folder it was added to
+        stamps = self._get_config_stamps(rescan=bool(machine_changed))
+        configs_changed = len([path for path in set(stamps) | set(self._config_stamps)
+                               if stamps.get(path) != self._config_stamps.get(path)])
+        if configs_changed:
+            previous = self.machine_configs
+            try:
+                self._load_machine_configs(refresh=True, configs=[(path, os.stat(path)) for path in stamps])
+                filenames.update(self.machine_configs.get_changed_files(previous))
+            except Exception as e:
+                # A config saved mid-edit may not parse; keep the previous configs until it's saved again
+                self.log.error("ERROR: Unable to reload configs: {}".format(e))
+                self._config_stamps = stamps
+
+        self._last_refresh = {"files": len(filenames), "configs": configs_changed, "source folders": source_changed,
+                              "mode folders": machine_changed}
+        if filenames:
+            self.log.info("\n[{}] Re-evaluating {} files after changes to {} configs, {} source folders, "
+                          "and {} mode folders".format(datetime.now().strftime("%H:%M:%S"), len(filenames),
+                                                       configs_changed, source_changed, machine_changed))
+            with self.timer.phase("comparison") as span:
+                self._update_analysis(filenames)
+                span.add(len(filenames))
+        return len(filenames)
+
+    def _get_analysis(self, write_mode=False, force_update=False, export_only=False, verify=False):
+        """Run the full analysis the first time, and bring it up to date incrementally after that."""
+        if not self._analysis or not self.source_media or not self.machine_assets or \
+                ((force_update or verify) and not self._analysis_verify):
+            self.parse_machine_assets(write_mode=write_mode, force_update=force_update,
+                                      export_only=export_only, verify=verify)
+        else:
+            self.refresh_analysis()
+        return self._analysis
+
+    def _get_verify_stamps(self, expectedpath, sourcepath):
+        """Return the (size, mtime_ns) of a machine file and its source file, with None for a missing one.
+
+        Members of a zip source aren't stat'ed, since the zip's own mtime already marks them changed.
+        """
+        stamps = []
+        for path in (expectedpath, None if self._get_archive() else sourcepath):
+            try:
+                stat = os.stat(path) if path else None
+                stamps.append((stat.st_size, stat.st_mtime_ns) if stat else None)
+            except(FileNotFoundError):
+                stamps.append(None)
+        return tuple(stamps)
+
+    def _get_verify_candidates(self, expectedpath, stat):
+        """Return the (path, stat) of a machine file and of its ".original." backup, if it has one.
+
+        A file converted by "resample --convert" is current as long as its backup
+        still matches the source, so either one matching counts.
+        """
+        candidates = [(expectedpath, stat)]
+        backup = self.machine_assets.get_backup(expectedpath)
+        if backup:
+            try:
+                candidates.append((backup, os.stat(backup)))
+            except(FileNotFoundError):
+                pass
+        return candidates
+
+    def _find_outdated_assets(self, verifications):
+        """Compare machine assets (or their backups) to their source files by size and mtime, then by content hash."""
+        self.log.info("  Verifying {} assets against the source folder...".format(len(verifications)))
+        to_hash = []  # Tuples of (expected path, source path, paths of the same size as the source)
+        if self._get_archive():
+            self._find_outdated_archive_assets(verifications)
+            return
+        for expectedpath, stat, sourcepath in verifications:
+            sourcestat = os.stat(sourcepath)
+            candidates = self._get_verify_candidates(expectedpath, stat)
+            if any(filestat.st_size == sourcestat.st_size and filestat.st_mtime_ns == sourcestat.st_mtime_ns
+                   for __path, filestat in candidates):
+                continue
+            # Same size but a different timestamp: only the contents can tell
+            samesize = [path for path, filestat in candidates if filestat.st_size == sourcestat.st_size]
+            if samesize:
+                to_hash.append((expectedpath, sourcepath, samesize))
+            else:
+                self._add_entry(os.path.basename(expectedpath), 'outdated', expectedpath, sourcepath)
+
+        if to_hash:
+            hashes = self._get_hash_index()
+            filehashes = hashes.get_hashes([path for __exp, sourcepath, paths in to_hash for path in [sourcepath] + paths])
+            hashes.save()
+            for expectedpath, sourcepath, paths in to_hash:
+                if filehashes[sourcepath] not in [filehashes[path] for path in paths]:
+                    self._add_entry(os.path.basename(expectedpath), 'outdated', expectedpath, sourcepath)
+
+    def _find_outdated_archive_assets(self, verifications):
+        """Compare machine assets (or their backups) to the members of a zip source by size, then by CRC."""
+        to_check = []  # Tuples of (expected path, source path, member CRC, paths of the member's size)
+        for expectedpath, stat, sourcepath in verifications:
+            info = self._get_archive().get_member_info(sourcepath)
+            samesize = [path for path, filestat in self._get_verify_candidates(expectedpath, stat)
+                        if filestat.st_size == info.file_size]
+            if samesize:
+                to_check.append((expectedpath, sourcepath, info.CRC, samesize))
+            else:
+                self._add_entry(os.path.basename(expectedpath), 'outdated', expectedpath, sourcepath)
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            paths = [path for __exp, __src, __crc, samesize in to_check for path in samesize]
+            crcs = dict(zip(paths, executor.map(crc32_file, paths)))
+            for expectedpath, sourcepath, crc, samesize in to_check:
+                if crc not in [crcs[path] for path in samesize]:
+                    self._add_entry(os.path.basename(expectedpath), 'outdated', expectedpath, sourcepath)
+
+    def cleanup_machine_assets(self, write_mode=False, force_update=False, verify=False):
         """Method to actually move/copy/delete asset files from MPF mode folders."""
-        if not self._analysis:
-            self.parse_machine_assets(write_mode=write_mode, force_update=force_update)
+        self._get_analysis(write_mode=write_mode, force_update=force_update, verify=verify)
 
         files_changed = 0
 
         if self._analysis['orphaned']:
             self.log.info(("Removing {} orphaned files:" if write_mode else "{} orphaned files to remove").format(
                           len(self._analysis["orphaned"])))
-            for orphan in self._analysis['orphaned']:
-                self.log.info(" - {}".format(orphan))
-                if write_mode:
-                    os.remove(orphan)
-                    files_changed += 1
+            with self.timer.phase("remove orphans") as span:
+                for orphan in self._analysis['orphaned']:
+                    self.log.info(" - {}".format(orphan))
+                    if write_mode:
+                        os.remove(orphan)
+                        files_changed += 1
+                        span.add(1)
         if self._analysis['duplicated']:
             self.log.info(("Removing {} duplicate files..." if write_mode else "{} duplicate files to remove").format(
                           len(self._analysis["duplicated"])))
-            for orphan in self._analysis['duplicated']:
-                self.log.info(" - {}".format(orphan))
-                if write_mode:
-                    os.remove(orphan)
-                    files_changed += 1
+            with self.timer.phase("remove duplicates") as span:
+                for orphan in self._analysis['duplicated']:
+                    self.log.info(" - {}".format(orphan))
+                    if write_mode:
+                        os.remove(orphan)
+                        files_changed += 1
+                        span.add(1)
         if self._analysis['misplaced']:
             self.log.info(("Moving {} misplaced files..." if write_mode else "{} misplaced files will be moved").format(
                           len(self._analysis["misplaced"])))
-            for expectedpath, filepath in self._analysis['misplaced'].items():
-                self.log.info(" - {} -> {}".format(filepath, expectedpath))
+            with self.timer.phase("move misplaced") as span:
                 if write_mode:
-                    os.makedirs(expectedpath.rsplit("/", 1)[0], mode=0o755, exist_ok=True)
-                    os.rename(filepath, expectedpath)
-                    files_changed += 1
+                    for folder in {os.path.dirname(expectedpath) for expectedpath in self._analysis['misplaced']}:
+                        os.makedirs(folder, mode=0o755, exist_ok=True)
+                for expectedpath, filepath in self._analysis['misplaced'].items():
+                    self.log.info(" - {} -> {}".format(filepath, expectedpath))
+                    if write_mode:
+                        os.rename(filepath, expectedpath)
+                        files_changed += 1
+                        span.add(1)
         if self._analysis['available']:
             self.log.info(("Copying {} new files..." if write_mode else "{} new files will be copied").format(
                           len(self._analysis["available"])))
-            original_umask = os.umask(0)
-            for idx, availitem in enumerate(self._analysis['available'].items()):
-                dst = availitem[0]
-                src = availitem[1]
-                self.log.debug(" - {}/{}: {} -> {}".format(idx + 1, len(self._analysis['available']), src, dst))
-                # Ensure the target directory exists
-                if write_mode:
-                    os.makedirs(dst.rsplit("/", 1)[0], mode=0o755, exist_ok=True)
-                    shutil.copy2(src, dst)
-                    files_changed += 1
-            os.umask(original_umask)
+            if write_mode:
+                original_umask = os.umask(0)
+                try:
+                    with self.timer.phase("copy new"):
+                        files_changed += self._copy_files(self._get_transcoded_pairs(
+                            [(src, dst) for dst, src in self._analysis['available'].items()]), archive=self._get_archive())
+                finally:
+                    os.umask(original_umask)
+            else:
+                for idx, availitem in enumerate(self._analysis['available'].items()):
+                    self.log.debug(" - {}/{}: {} -> {}".format(
+                        idx + 1, len(self._analysis['available']), availitem[1], availitem[0]))
+        if self._analysis['outdated']:
+            self.log.info(("Replacing {} changed files..." if write_mode else "{} changed files will be replaced").format(
+                          len(self._analysis["outdated"])))
+            for expectedpath, sourcepath in self._analysis['outdated'].items():
+                self.log.info(" - {} -> {}".format(sourcepath, expectedpath))
+            if write_mode:
+                with self.timer.phase("replace changed"):
+                    files_changed += self._copy_files(self._get_transcoded_pairs(
+                        [(src, dst) for dst, src in self._analysis['outdated'].items()]), archive=self._get_archive(),
+                        on_copied=lambda src, dst: self._remove_backup(dst))
 
         if self._analysis['unavailable']:
             self.log.info("\nWARNING: {} file{} could not be found:".format(
                           len(self._analysis['unavailable']), "" if len(self._analysis['unavailable']) == 1 else "s"))
+            suggestions = self._get_suggestions(self._analysis['unavailable'])
             for filename in self._analysis['unavailable']:
                 self.log.warning(" - {} ({})".format(filename, self._analysis['sounds'][filename]['mode']))
+                if suggestions[filename]:
+                    self.log.warning("     did you mean {}?".format(
+                                     ", ".join(candidate for __score, candidate in suggestions[filename])))
 
-        # Any previous analysis is no longer valid
         if write_mode:
-            videocount = self._copy_video_assets(export=False)
-            self._analysis = None
+            with self.timer.phase("video copy"):
+                videocount = self._copy_video_assets(export=False)
+            # Re-evaluate only the files just written, so the analysis stays current for the next operation
+            touched = {os.path.basename(path) for category in ('orphaned', 'duplicated', 'misplaced', 'available',
+                                                               'outdated') for path in self._analysis[category]}
+            if self.machine_assets.revalidate(self.log):
+                self._get_catalog().sync_tree(self.machine_assets)
+            self._update_analysis(touched | self.machine_assets.changed_files)
             self.log.info("\nMachine copy and cleanup complete! {} audio file{} and {} video file{} changed.".format(
                 files_changed or "No",
                 "" if files_changed == 1 else "s",
@@ -334,31 +784,413 @@ class AssetManager():
         else:
             self.log.info("\nSimulation complete, no files changed.")
 
-    def export_machine_assets(self, saveAsZip=False):
-        """Batch output all assets within MPF folders to a single folder for compression/backup."""
-        if not self._analysis:
-            self.parse_machine_assets(export_only=True)
+    def _remove_backup(self, path):
+        """Remove the ".original." backup of a machine file that was just replaced from the source.
 
-        count = 0
-        size = 0
-        zipFile = None
-        if saveAsZip:
-            zipfilename = "{}{}".format(self.exports_path, ".zip")
-            zipFile = ZipFile(zipfilename, mode='w')
-        else:
-            os.makedirs(self.exports_path, mode=0o755, exist_ok=True)
+        The backup no longer matches the file in place, and trimming or resampling
+        again keeps an existing backup, so verify would report their output as outdated.
+        """
+        try:
+            os.remove(get_backup_path(path))
+        except(FileNotFoundError):
+            pass
+
+    def _get_suggestions(self, filenames, limit=3):
+        """Return the closest source filenames for each of the given filenames, as (score, filename) tuples."""
+        indexed = [tree.has_name_index() for tree in self.source_media.trees]
+        with self.timer.phase("suggestions") as span:
+            suggestions = dict((filename, self.source_media.suggest(filename, limit)) for filename in filenames)
+            span.add(len(filenames))
+        # Save the filename index with any tree that just built it, so later runs start with it
+        for tree, had_index in zip(self.source_media.trees, indexed):
+            if not had_index:
+                self._write_to_cache(tree)
+        return suggestions
+
+    def suggest_missing(self, patch_path=None, limit=3):
+        """Suggest the closest source files for each file the configs require that isn't in the source folder.
+
+        With patch_path, also write a patch to the mode configs that replaces each
+        missing file with its best suggestion, for review before applying (e.g. with
+        "git apply" or "patch -p1" in the machine folder). Return the number of missing files.
+        """
+        self._get_analysis()
+        unavailable = sorted(self._analysis['unavailable'])
+        if not unavailable:
+            self.log.info("\nAll required files are in the machine or source folders.")
+            return 0
+        suggestions = self._get_suggestions(unavailable, limit)
+        self.log.info("\nSuggestions for {} missing file{}:".format(len(unavailable), "" if len(unavailable) == 1 else "s"))
+        replacements = {}  # Key: config path, Value: {missing filename: suggested filename}
+        for filename in unavailable:
+            mode = self._analysis['sounds'][filename]['mode']
+            self.log.info(" - {} ({})".format(filename, mode))
+            if not suggestions[filename]:
+                self.log.info("     no similar files found")
+                continue
+            for score, candidate in suggestions[filename]:
+                self.log.info("     {:>4.0%}  {}".format(score, candidate))
+            configpath = self.machine_configs.get_config_path(mode)
+            if configpath:
+                replacements.setdefault(configpath, {})[filename] = suggestions[filename][0][1]
 
+        if patch_path:
+            patch = self._get_config_patch(replacements)
+            with open(patch_path, 'w', encoding='utf-8') as f:
+                f.write(patch)
+            self.log.info("\nConfig patch written to {} (apply it in {})".format(patch_path, self.machine_path))
+        return len(unavailable)
+
+    def _get_config_patch(self, replacements):
+        """Return a unified diff replacing the "file:" entries of the given filenames in each config."""
+        patch = []
+        for configpath in sorted(replacements):
+            with open(configpath, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+            patterns = [(re.compile(r"^(\s*file:\s*['\"]?){}(['\"]?\s*(#.*)?)$".format(re.escape(filename))), candidate)
+                        for filename, candidate in replacements[configpath].items()]
+            patched = []
+            for line in lines:
+                for pattern, candidate in patterns:
+                    line = pattern.sub(lambda match: "{}{}{}".format(match.group(1), candidate, match.group(2)), line)
+                patched.append(line)
+            relpath = self._get_relative_path(configpath, self.machine_path)
+            patch.extend(difflib.unified_diff(lines, patched, "a/{}".format(relpath), "b/{}".format(relpath)))
+        return "".join(patch)
+
+    def create_plan(self, plan_path, verify=False):
+        """Write the deletes, moves, and copies an update would make to a plan file, without changing any files."""
+        self._get_analysis(write_mode=True, verify=verify)
+        plan = ExecutionPlan(source_is_archive=bool(self._get_archive()))
+        for path in list(self._analysis['orphaned']) + list(self._analysis['duplicated']):
+            plan.add("delete", path=self._get_relative_path(path, self.machine_path), stat=os.stat(path))
+        for expectedpath, filepath in self._analysis['misplaced'].items():
+            plan.add("move", src=self._get_relative_path(filepath, self.machine_path),
+                     dst=self._get_relative_path(expectedpath, self.machine_path), stat=os.stat(filepath))
+        copies = list(self._analysis['available'].items()) + list(self._analysis['outdated'].items())
+        copies = [(src, dst, "audio") for dst, src in copies] + \
+                 [(src, dst, "video") for src, dst in self._get_video_imports()]
+        roots = self.source_media.roots
+        for src, dst, kind in copies:
+            root = self.source_media.get_tree(src).root
+            plan.add("copy", src=self._get_relative_path(src, root), dst=self._get_relative_path(dst, self.machine_path),
+                     root=roots.index(root), kind=kind, **self._get_source_stat(src))
+        plan.save(plan_path)
+        # Progress applying an earlier plan written to the same file doesn't apply to this one
+        PlanJournal.remove(plan_path)
+        self.log.info("\nPlan written to {}: {} deletes, {} moves, {} copies".format(
+                      plan_path, len(plan.by_op("delete")), len(plan.by_op("move")), len(plan.by_op("copy"))))
+        return plan
+
+    def apply_plan(self, plan_path):
+        """Apply a plan file, resuming from its journal if an earlier apply was interrupted.
+
+        Each operation first checks that its file still has the size and mtime recorded
+        in the plan, and is skipped if not. Skipped and failed operations are left out of
+        the journal, so running apply again retries them, and 1 is returned. The journal
+        is removed once every operation has been applied.
+        """
+        plan = ExecutionPlan.load(plan_path)
+        journal = PlanJournal(plan_path, plan.digest)
+        if journal.discarded:
+            self.log.warning("  Ignoring the journal of a different plan at {}".format(journal.path))
+        pending = [operation for operation in plan.operations if operation not in journal]
+        self.log.info("\nApplying plan {} from {}: {} of {} operations remaining".format(
+                      plan_path, plan.created, len(pending), len(plan)))
+        counts = {"done": 0, "skipped": 0, "failed": 0}
+
+        def finish(operation, status, message=None):
+            if status == "done":
+                journal.record(operation)
+            counts[status] += 1
+            if message:
+                self.log.warning(" - Skipped {}: {}".format(operation.get("path") or operation["src"], message))
+
+        try:
+            for operation in [operation for operation in pending if operation["op"] == "delete"]:
+                path = self._get_absolute_path(operation["path"], self.machine_path)
+                try:
+                    if not ExecutionPlan.matches(operation, os.stat(path)):
+                        finish(operation, "skipped", "changed since the plan was made")
+                        continue
+                    os.remove(path)
+                except(FileNotFoundError):
+                    pass
+                finish(operation, "done")
+            journal.sync()
+
+            moves = [operation for operation in pending if operation["op"] == "move"]
+            for folder in {os.path.dirname(self._get_absolute_path(operation["dst"], self.machine_path))
+                           for operation in moves}:
+                os.makedirs(folder, mode=0o755, exist_ok=True)
+            for operation in moves:
+                src = self._get_absolute_path(operation["src"], self.machine_path)
+                dst = self._get_absolute_path(operation["dst"], self.machine_path)
+                try:
+                    if not ExecutionPlan.matches(operation, os.stat(src)):
+                        finish(operation, "skipped", "changed since the plan was made")
+                        continue
+                    os.rename(src, dst)
+                except(FileNotFoundError):
+                    # Already moved by an apply that was interrupted before it could record it
+                    if not os.path.exists(dst):
+                        finish(operation, "skipped", "no longer exists")
+                        continue
+                finish(operation, "done")
+            journal.sync()
+
+            copies = {}  # Key: destination path, Value: (source path, operation)
+            roots = self._get_source_roots()
+            archive = None
+            if self._get_source_tree_class(roots[0]) is ZipAssetTree:
+                # Only a zip source needs its index, to find members; a folder source is read directly
+                self._load_source_trees()
+                archive = self._get_archive()
+            if plan.source_is_archive != bool(archive):
+                self.log.warning("  The plan was made with a {} source, but the source is now a {}".format(
+                                 "zip" if plan.source_is_archive else "folder", "zip" if archive else "folder"))
+            for operation in [operation for operation in pending if operation["op"] == "copy"]:
+                try:
+                    src = self._get_absolute_path(operation["src"], roots[operation.get("root", 0)])
+                except(IndexError):
+                    finish(operation, "skipped", "its source folder is no longer configured")
+                    continue
+                try:
+                    if not ExecutionPlan.matches(operation, **self._get_source_stat(src)):
+                        finish(operation, "skipped", "changed since the plan was made")
+                        continue
+                except(FileNotFoundError, KeyError):
+                    finish(operation, "skipped", "not found in the source")
+                    continue
+                copies[self._get_absolute_path(operation["dst"], self.machine_path)] = (src, operation)
+            original_umask = os.umask(0)
+            try:
+                copied = self._copy_files([(src, dst) for dst, (src, __op) in copies.items()], archive=archive,
+                                          on_copied=lambda src, dst: (self._remove_backup(dst),
+                                                                      finish(copies[dst][1], "done")))
+            finally:
+                os.umask(original_umask)
+            counts["failed"] += len(copies) - copied
+        finally:
+            journal.close()
+
+        self.log.info("\nPlan applied: {done} operations done, {skipped} skipped, {failed} failed".format(**counts))
+        if counts["failed"] or counts["skipped"]:
+            self.log.info("Run apply again to retry the skipped and failed operations.")
+            return 1
+        PlanJournal.remove(plan_path)
+        return 0
+
+    def _get_source_stat(self, src):
+        """Return the plan precondition for a source file: its stat, or just its size inside a zip source."""
+        if self._get_archive():
+            return {"size": self._get_archive().get_member_info(src).file_size}
+        return {"stat": os.stat(src)}
+
+    @staticmethod
+    def _get_relative_path(path, root):
+        """Return a path relative to a root folder, with "/" separators so plans work across platforms."""
+        return os.path.relpath(path, root).replace(os.sep, "/")
+
+    @staticmethod
+    def _get_absolute_path(relpath, root):
+        return os.path.join(root, *relpath.split("/"))
+
+    def watch(self, interval=1.0, verify=False):
+        """Keep the mode folders in sync as configs and the source folder change, until interrupted.
+
+        The configs, source tree, machine tree, and analysis stay loaded between checks.
+        Each check stats the config folders and revalidates the trees by folder mtime,
+        and only changed configs are parsed again (the rest come from the cache).
+        """
+        self.cleanup_machine_assets(write_mode=True, verify=verify)
+        self.log.info("\nWatching {} config files and the source folder for changes every {}s (Ctrl+C to stop)...".format(
+                      len(self._config_stamps), interval))
+        try:
+            while True:
+                time.sleep(interval)
+                try:
+                    if self.refresh_analysis():
+                        self.cleanup_machine_assets(write_mode=True, verify=verify)
+                except Exception as e:
+                    self.log.error("ERROR: Unable to apply changes: {}".format(e))
+        except(KeyboardInterrupt):
+            self.log.info("\nStopped watching.")
+
+    def _get_config_stamps(self, rescan=False):
+        """Return the (size, mtime_ns) of every config in the mode config folders, keyed by path.
+
+        The folders are those of the configs already known, so the machine folder isn't walked
+        again. With rescan (after the machine tree found changed folders, e.g. a new one), the
+        modes folder is walked instead, so configs in folders not seen before are found too.
+        """
+        if rescan:
+            return dict((os.path.join(path, filename), (stat.st_size, stat.st_mtime_ns))
+                        for path, __mtime, __dirs, files, stats in walk_tree(
+                            os.path.join(self.machine_path, "modes"), CONFIG_EXTENSIONS,
+                            self._get_machine_excludes(), with_stats=True)
+                        for filename, stat in zip(files, stats))
+        folders = {os.path.dirname(path) for path in self._config_stamps}
+        if self.machine_scan:
+            folders.update(os.path.dirname(path) for path, __stat in self.machine_scan.configs)
+        folders.update(glob.glob(os.path.join(self.machine_path, "modes", "*", "config")))
+        stamps = {}
+        for folder in sorted(folders):
+            try:
+                __dirs, files, stats = scan_folder(folder, CONFIG_EXTENSIONS, with_stats=True)
+            except(FileNotFoundError, NotADirectoryError):
+                continue
+            for filename, stat in zip(files, stats):
+                stamps[os.path.join(folder, filename)] = (stat.st_size, stat.st_mtime_ns)
+        return stamps
+
+    def check_machine_assets(self, json_path=None):
+        """Verify that the mode folders match the configs, without changing any files, and return an exit code.
+
+        The configs, trees, and analysis are saved in a snapshot after each check, so the
+        next check only reads the configs and folders that changed since. Returns the sum
+        of the CHECK_EXIT_CODES of the problems found, or 0 if there are none.
+        """
+        # The analysis logs every step, which only matters with -v
+        level = self.log.level
+        if level > logging.DEBUG:
+            self.log.setLevel(logging.WARNING)
+        try:
+            with self.timer.phase("check state"):
+                incremental = self._load_check_state()
+            if incremental:
+                self.refresh_analysis()
+                changes = self._last_refresh
+            else:
+                self.parse_machine_assets()
+                changes = None
+            if changes is None or any(changes.values()):
+                with self.timer.phase("check state"):
+                    self._save_check_state()
+        finally:
+            self.log.setLevel(level)
+
+        report = CheckReport(self.machine_path, self._analysis, changes)
+        for line in report.format_lines():
+            self.log.info(line)
+        if json_path:
+            with open(json_path, mode="w") as f:
+                f.write(report.to_json())
+            self.log.info("Check report written to {}".format(json_path))
+        return report.exit_code
+
+    def _get_check_state_path(self):
+        # Each machine folder has its own snapshot
+        key = hashlib.sha1(os.path.abspath(self.machine_path).encode("utf-8")).hexdigest()[:16]
+        return "{}_{}".format(get_cache_path(self.check_state_name), key)
+
+    def _load_check_state(self):
+        """Restore the configs, trees, and analysis saved by the last check, and return whether they were."""
+        try:
+            with open(self._get_check_state_path(), 'rb') as f:
+                state = pickle.load(f)
+        except(FileNotFoundError):
+            return False
+        except Exception as e:
+            self.log.warning("  Could not load the last check:\n        {}".format(e))
+            return False
+        if state.get("version") != (self.CHECK_STATE_VERSION, AssetTree.VERSION) or \
+           state["machine_path"] != self.machine_path or state["source_media"].roots != self._get_source_roots():
+            return False
+        self.machine_configs = state["machine_configs"]
+        self.machine_assets = state["machine_assets"]
+        self.source_media = state["source_media"]
+        self._config_stamps = state["config_stamps"]
+        self._analysis = state["analysis"]
+        self._analysis_entries = state["analysis_entries"]
+        self._verify_stamps = {}
+        self._analysis_verify = False
+        return True
+
+    def _save_check_state(self):
+        path = self._get_check_state_path()
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"version": (self.CHECK_STATE_VERSION, AssetTree.VERSION), "machine_path": self.machine_path,
+                         "machine_configs": self.machine_configs, "machine_assets": self.machine_assets,
+                         "source_media": self.source_media, "config_stamps": self._config_stamps,
+                         "analysis": self._analysis, "analysis_entries": self._analysis_entries},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def export_machine_assets(self, saveAsZip=False, delta=False, compression=None, dedup=True):
+        """Batch output all assets within MPF folders to a single folder for compression/backup.
+
+        With delta, only assets added or changed since the last export are written,
+        to a new timestamped folder or zip beside the full export. With dedup, audio
+        files with identical contents are written once, and the manifest maps the
+        other filenames to it (an update from the export writes them all).
+        """
+        self._get_analysis(export_only=True)
+
+        entries = []  # Tuples of (file path, exported name)
         for filename in self._analysis['found']:
             sound = self._analysis['sounds'][filename]
-            path = "{}{}".format(sound['modepath'], filename)
+            entries.append(("{}{}".format(sound['modepath'], filename), filename))
+        videos = self._get_video_files()
+        self.log.info("\nBuilding export manifest for {} files...".format(len(entries) + len(videos)))
+        with self.timer.phase("export manifest") as span:
+            manifest = ExportManifest.build(entries + [(path, "videos/{}".format(filename)) for path, filename in videos],
+                                            self._get_hash_index())
+            span.add(len(manifest.files), sum(entry["size"] for entry in manifest.files.values()))
+        if self.transcode:
+            # Recorded before the delta comparison, so changing profiles exports every file again
+            names = set(manifest.files)
+            for __path, arcname in entries:
+                name = get_output_name(arcname, self.transcode)
+                if name != arcname and name in names:
+                    self.log.warning("  Not transcoding {}, since {} is also exported".format(arcname, name))
+                    continue
+                names.add(name)
+                manifest.files[arcname].update(name=name, profile=get_profile_key(self.transcode))
+
+        exportpath = self.exports_path
+        skipped_videos = set()
+        if delta:
+            previous = ExportManifest.load(self.export_manifest_path)
+            changed = set(manifest.changed_since(previous))
+            removed = manifest.removed_since(previous)
+            self.log.info("  Last export: {}. {} files added or changed, {} removed.".format(
+                          previous.exported or "never", len(changed), len(removed)))
+            entries = [entry for entry in entries if entry[1] in changed]
+            skipped_videos = {filename for __path, filename in videos if "videos/{}".format(filename) not in changed}
+            exportpath = "{}_delta_{}".format(self.exports_path, datetime.now().strftime("%Y%m%d_%H%M%S"))
+            for arcname in removed:
+                self.log.info(" - removed since last export: {}".format(arcname))
+
+        deduplicated = 0
+        if dedup:
+            unique = set(manifest.deduplicate([arcname for __path, arcname in entries]))
+            deduplicated = len(entries) - len(unique)
+            if deduplicated:
+                saved = sum(manifest.files[arcname]["size"] for __path, arcname in entries if arcname not in unique)
+                self.log.info("  {} files have the same contents as another, saving {:.1f} MB".format(
+                              deduplicated, saved / 1000000))
+                entries = [entry for entry in entries if entry[1] in unique]
+        if self.transcode:
+            entries = self._get_transcoded_entries(entries, manifest)
+
+        size = 0
+        zipFile = None
+        with self.timer.phase("export") as span:
             if saveAsZip:
-                zipFile.write(path, filename)
+                zipfilename = "{}{}".format(exportpath, ".zip")
+                zipFile = ExportArchive(zipfilename, self.log, compression=compression, threads=self.threads)
+                size = zipFile.write_files(entries)
+                span.add(len(entries), size)
             else:
-                shutil.copy2(path, "{}/{}".format(self.exports_path, filename))
-            size += sound['exists'].st_size
-            count += 1
+                os.makedirs(exportpath, mode=0o755, exist_ok=True)
+                self._copy_files([(path, os.path.join(exportpath, filename)) for path, filename in entries])
+                size = sum(os.path.getsize(path) for path, __filename in entries)
+            count = len(entries)
 
-        videocount = self._copy_video_assets(export=True, zipFile=zipFile)
+            with self.timer.phase("video copy"):
+                videocount = self._copy_video_assets(export=True, zipFile=zipFile, exclude=skipped_videos)
 
         # Dump the readme too, to have instructions handy on the in-cabinet controller
         readme_filename = "_README.txt"
@@ -368,7 +1200,9 @@ these files into your machine's mode folders, run:
 
     mpfam update
 
-and set your media source folder to this directory.
+and set your media source folder to this directory
+(or to the exported zip file, which can be used
+without extracting it).
 
 If you don't have mpfam on this computer, you can
 install it via:
@@ -379,22 +1213,205 @@ For more information, visit
 https://github.com/avanwinkle/mpf-asset-manager
         """
 
+        # Transcoding can change extensions, so the configs need the new filenames
+        extras = {}  # Key: filename, Value: text written beside the readme
+        renames = manifest.get_renames()
+        if renames:
+            extras[RENAMES_NAME] = json.dumps(renames, indent=1, sort_keys=True)
+            extras[CONFIG_PATCH_NAME] = self._get_config_patch(self._get_rename_replacements(renames))
+            self.log.info("  {} files were renamed by transcoding. Apply {} in the machine folder where the export "
+                          "is used (see {}).".format(len(renames), CONFIG_PATCH_NAME, RENAMES_NAME))
+
         if saveAsZip:
             zipFile.writestr(readme_filename, readme_text)
+            for filename, text in extras.items():
+                zipFile.writestr(filename, text)
+            zipFile.writestr(EXPORT_MANIFEST_NAME, manifest.dumps())
+            zipFile.close()
         else:
-            text = open(os.path.join(self.exports_path, readme_filename), mode="w")
+            text = open(os.path.join(exportpath, readme_filename), mode="w")
             text.write(readme_text)
             text.close()
+            for filename, text in extras.items():
+                with open(os.path.join(exportpath, filename), mode="w", encoding="utf-8") as f:
+                    f.write(text)
+            manifest.save(os.path.join(exportpath, EXPORT_MANIFEST_NAME))
+        manifest.save(self.export_manifest_path)
+        # The manifest describes every current asset, so a delta export also becomes the new baseline
+        self._get_catalog().record_export(self.machine_path, manifest)
+
+        self.log.info("\nExport complete: {} audio files, {} MB (plus {} videos{})".format(
+                      count, round(size / 100000) / 10, videocount,
+                      " and {} deduplicated audio files".format(deduplicated) if deduplicated else ""))
 
-        self.log.info("\nExport complete: {} audio files, {} MB (plus {} videos)".format(
-                      count, round(size / 100000) / 10, videocount))
+    def _get_transcoded_entries(self, entries, manifest):
+        """Replace (path, exported name) entries with their transcoded outputs and new names.
+
+        A file that fails to transcode is exported as it is, under its own name.
+        """
+        outputs = self._transcode_files([path for path, arcname in entries if manifest.files[arcname].get("profile")])
+        transcoded = []
+        for path, arcname in entries:
+            if path in outputs and manifest.files[arcname].get("profile"):
+                transcoded.append((outputs[path], manifest.files[arcname]["name"]))
+                continue
+            for details in [manifest.files[arcname]] + [details for details in manifest.files.values()
+                                                         if details.get("blob") == arcname]:
+                details.pop("name", None)
+                details.pop("profile", None)
+            transcoded.append((path, arcname))
+        return transcoded
+
+    def _get_transcoded_pairs(self, pairs):
+        """Replace the sources of (source, destination) pairs with their transcoded outputs, if there is a profile.
+
+        Only files already in the profile's format are transcoded when updating, since
+        a new extension would no longer match the configs ("export" writes a rename map).
+        """
+        if not self.transcode or not pairs:
+            return pairs
+        if self._get_archive():
+            self.log.warning("  Files in a zip source can't be transcoded, copying them as they are.")
+            return pairs
+        matching = [src for src, dst in pairs if get_extension(dst) == self.transcode.extension]
+        if len(matching) < len(pairs):
+            self.log.info("  {} files aren't {} files, copying them as they are so they still match the configs".format(
+                          len(pairs) - len(matching), self.transcode.extension))
+        outputs = self._transcode_files(matching)
+        return [(outputs.get(src, src), dst) for src, dst in pairs]
 
-    def analyze_sample_rates(self, mode=None):
-        """Assess all sound files to determine sample rates."""
-        if not self._analysis:
-            write_mode = mode == "import"
-            export_only = mode == "export"
-            self.parse_machine_assets(write_mode=write_mode, export_only=export_only)
+    def _transcode_files(self, paths):
+        """Return a mapping of path to its transcoded output, encoding only contents not already in the cache.
+
+        Outputs are cached by content hash and profile, so renamed or unchanged files aren't encoded again.
+        """
+        if not paths:
+            return {}
+        folder = get_cache_path(self.transcode_cache_name)
+        os.makedirs(folder, exist_ok=True)
+        hash_index = self._get_hash_index()
+        hashes = hash_index.get_hashes(paths)
+        hash_index.save()
+        outputs = dict((path, get_cached_path(folder, hashes[path], self.transcode)) for path in paths)
+        jobs = {}  # Key: output path, Value: job, so identical contents are only encoded once
+        for path in paths:
+            if outputs[path] not in jobs and not os.path.exists(outputs[path]):
+                jobs[outputs[path]] = (path, outputs[path], self.transcode)
+        self.log.info("  Transcoding {} files with profile {} ({} cached)...".format(
+                      len(jobs), self.transcode.name, len(paths) - len(jobs)))
+        with self.timer.phase("transcode") as span:
+            for path, error in process_map(transcode_file, list(jobs.values()), self.workers, self.log):
+                if error:
+                    self.log.error("ERROR: Unable to transcode {}: {}".format(path, error))
+                else:
+                    span.add(1, os.path.getsize(path))
+        return dict((path, output) for path, output in outputs.items() if os.path.exists(output))
+
+    def _get_rename_replacements(self, renames):
+        """Group renamed files by the config requiring them, for _get_config_patch()."""
+        replacements = {}  # Key: config path, Value: {old filename: new filename}
+        for filename, name in renames.items():
+            configpath = self.machine_configs.get_config_path(self._analysis['sounds'][filename]['mode'])
+            if configpath:
+                replacements.setdefault(configpath, {})[filename] = name
+        return replacements
+
+    def find_asset(self, filename):
+        """Report which mode requires a file, where it belongs, and where it exists in the machine and source."""
+        self._load_machine_configs()
+        self._load_machine_assets()
+        self._load_source_media()
+        catalog = self._get_catalog()
+        requirement = catalog.find_requirement(self.machine_path, filename)
+        if requirement:
+            mode, track, parent, streaming = requirement
+            self.log.info("\n{} is required by mode {} on track {}{}".format(
+                          filename, mode, track, " (streaming)" if streaming else ""))
+            self.log.info("  Expected at {}/modes/{}/sounds/{}/{}".format(self.machine_path, parent, track, filename))
+        else:
+            self.log.info("\n{} is not required by any mode".format(filename))
+        machine_paths = catalog.find_file(self.machine_path, filename)
+        # Source folders are listed in priority order, so the copy that would be used comes first
+        source_paths = [path for root in self.source_media.roots for path in catalog.find_file(root, filename)]
+        for label, paths in (("Machine", machine_paths), ("Source", source_paths)):
+            self.log.info("  {} folder: {}".format(label, ", ".join(paths) if paths else "not found"))
+        return requirement
+
+    def report_duplicate_content(self, top=10):
+        """Report audio files with identical contents under different names, and the space they waste per mode.
+
+        The first file of each group (by name) counts as the original, and every
+        other copy counts against the mode requiring it. Return the bytes wasted.
+        """
+        self._get_analysis(export_only=True)
+        paths = dict((filename, "{}{}".format(self._analysis['sounds'][filename]['modepath'], filename))
+                     for filename in self._analysis['found'])
+        with self.timer.phase("hash") as span:
+            hash_index = self._get_hash_index()
+            hashes = hash_index.get_hashes(list(paths.values()))
+            hash_index.save()
+            span.add(len(hashes))
+        groups = {}  # Key: content hash, Value: filenames with those contents
+        for filename in sorted(paths):
+            groups.setdefault(hashes[paths[filename]], []).append(filename)
+        groups = [(os.path.getsize(paths[group[0]]), group) for group in groups.values() if len(group) > 1]
+
+        by_mode = {}  # Key: mode name, Value: [duplicate files, bytes]
+        for size, group in groups:
+            for filename in group[1:]:
+                totals = by_mode.setdefault(self._analysis['sounds'][filename]['mode'], [0, 0])
+                totals[0] += 1
+                totals[1] += size
+        wasted = sum(size * (len(group) - 1) for size, group in groups)
+        if not groups:
+            self.log.info("\nNo duplicate audio contents found across {} files.".format(len(paths)))
+            return 0
+        self.log.info("\nDuplicate audio contents: {} files in {} groups waste {:.1f} MB".format(
+                      sum(len(group) - 1 for __size, group in groups), len(groups), wasted / MEGABYTE))
+        self.log.info("\n  {:<30} {:>8} {:>12}".format("Mode", "Files", "Wasted (MB)"))
+        for mode, (count, size) in sorted(by_mode.items(), key=lambda item: (-item[1][1], item[0])):
+            self.log.info("  {:<30} {:>8} {:>12.2f}".format(mode, count, size / MEGABYTE))
+        self.log.info("\n  Largest groups:")
+        for size, group in sorted(groups, key=lambda item: (-item[0] * (len(item[1]) - 1), item[1]))[:top]:
+            self.log.info("  {:>9.2f} MB  {}".format(size * (len(group) - 1) / MEGABYTE, ", ".join(group)))
+        return wasted
+
+    def report_changes(self):
+        """Report the assets added, changed, or removed since the last export."""
+        self._get_analysis(export_only=True)
+        catalog = self._get_catalog()
+        last_export = catalog.get_last_export(self.machine_path)
+        if not last_export:
+            self.log.info("\nNo export has been recorded for this machine.")
+            return
+        files = []  # Tuples of (exported name, path, stat)
+        for filename in self._analysis['found']:
+            path = "{}{}".format(self._analysis['sounds'][filename]['modepath'], filename)
+            files.append((filename, path, os.stat(path)))
+        for path, stat in self._get_machine_scan().videos:
+            files.append(("videos/{}".format(os.path.basename(path)), path, stat))
+        added, changed, removed = catalog.changed_since_export(self.machine_path, files)
+        if changed:
+            # Files that were only touched are unchanged once their hashes match the export
+            paths = dict((arcname, path) for arcname, path, __stat in files)
+            hash_index = self._get_hash_index()
+            hash_index.get_hashes([paths[arcname] for arcname in changed])
+            hash_index.save()
+            added, changed, removed = catalog.changed_since_export(self.machine_path, files)
+        self.log.info("\nChanges since the last export ({}):".format(last_export))
+        for label, arcnames in (("added", added), ("changed", changed), ("removed", removed)):
+            self.log.info("  {} files {}".format(len(arcnames), label))
+            for arcname in arcnames:
+                self.log.info("   - {}".format(arcname))
+        return added, changed, removed
+
+    def analyze_sample_rates(self, mode=None, target_rate=None):
+        """Assess all sound files to determine sample rates.
+
+        With mode "convert", every asset not at the target rate (the most common
+        rate, unless one is given) is resampled in place, keeping an ".original." backup.
+        """
+        self._get_analysis(write_mode=mode in ("import", "convert"), export_only=mode == "export")
         if mode == "export":
             os.makedirs(self.conversion_originals_folder, mode=0o755, exist_ok=True)
             os.makedirs(self.conversion_converted_folder, mode=0o755, exist_ok=True)
@@ -406,10 +1423,13 @@ https://github.com/avanwinkle/mpf-asset-manager
         self.log.info("\nAnalyzing sample rates for {} files...".format(len(self._analysis['sounds'])))
 
         if mode != "import":
-            for filename in self._analysis['found']:
-                sound = self._analysis['sounds'][filename]
-                path = "{}{}".format(sound['modepath'], filename)
-                data, samplerate = sf.read(path)
+            paths = ["{}{}".format(self._analysis['sounds'][filename]['modepath'], filename)
+                     for filename in self._analysis['found']]
+            infos = self._get_audio_info(paths)
+            for path in paths:
+                if path not in infos:
+                    continue
+                samplerate = infos[path].samplerate
                 if samplerate not in rates:
                     rates[samplerate] = {"count": 0, "files": []}
                 rates[samplerate]["count"] += 1
@@ -423,7 +1443,10 @@ https://github.com/avanwinkle/mpf-asset-manager
                 else:
                     leastCommonFiles += rates[rankedRate]["files"]
 
-        if mode == "export":
+        if mode == "convert":
+            self._convert_sample_rates(infos, target_rate or mostCommonRate)
+
+        elif mode == "export":
             text = open("{}/RatesAnalysis.txt".format(self.conversion_root_folder), mode="w")
             text.write("\n".join(leastCommonFiles))
             text.close()
@@ -451,44 +1474,210 @@ https://github.com/avanwinkle/mpf-asset-manager
 
                 self.log.debug("{} -> {}".format(source_path, dest_path))
                 # Make a backup of the original
-                shutil.move(dest_path, re.sub(r'\.([A-Za-z0-9]+)$', '.original.\g<1>', dest_path))
+                shutil.move(dest_path, get_backup_path(dest_path))
                 shutil.copy2(source_path, dest_path)
                 count += 1
             self.log.info("Successfully copied {} converted files into their mode folders".format(count))
 
-    def _copy_video_assets(self, export=True, zipFile=None):
-        videoroot = os.path.join(self.machine_path, "videos")
-        exportroot = os.path.join(self.source_path, "videos")
+    def analyze_levels(self, trim=False, threshold=None, top=10):
+        """Report the peak, RMS, and leading/trailing silence of every asset, optionally trimming the silence.
+
+        Each file is read in blocks on a process pool, and the results are cached
+        in the catalog by path, size, and mtime. With trim, assets with at least
+        MIN_TRIM seconds of silence are trimmed in place, keeping an ".original." backup.
+        """
+        from mpfam.core.AudioAnalysis import DEFAULT_THRESHOLD, MIN_TRIM, get_audio_levels, to_db
+        threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+        self._get_analysis(write_mode=trim, export_only=not trim)
+        paths = ["{}{}".format(self._analysis['sounds'][filename]['modepath'], filename)
+                 for filename in self._analysis['found']]
+        self.log.info("\nAnalyzing levels for {} files (silence below {:.0f} dBFS)...".format(len(paths), threshold))
+        with self.timer.phase("audio levels") as span:
+            levels = get_audio_levels(paths, self._get_catalog().get_levels_cache(), self.log,
+                                      workers=self.workers, threshold=threshold)
+            span.add(len(levels))
+
+        def silence(item):
+            return (item[1].lead + item[1].trail) / item[1].samplerate
+
+        trimmable = [(path, info) for path, info in levels.items()
+                     if info.lead < info.frames and silence((path, info)) >= MIN_TRIM]
+        silent = sorted(path for path, info in levels.items() if info.frames and info.lead == info.frames)
+        clipped = sorted(path for path, info in levels.items() if info.peak >= 1.0)
+        seconds = sum(silence(item) for item in trimmable)
+        decoded = sum((info.lead + info.trail) * info.channels * BYTES_PER_SAMPLE for __path, info in trimmable)
+        self.log.info("\nLevels analysis complete:")
+        self.log.info("  {} files have {:.1f} seconds of leading/trailing silence ({:.1f} MB decoded)".format(
+                      len(trimmable), seconds, decoded / MEGABYTE))
+        for label, files in (("are silent", silent), ("peak at 0 dBFS and may be clipped", clipped)):
+            if files:
+                self.log.info("  {} files {}:".format(len(files), label))
+                for path in files:
+                    self.log.info("   - {}".format(path))
+        if trimmable:
+            self.log.info("\n  {:>9} {:>9} {:>9} {:>9}  {}".format("Lead (ms)", "Trail (ms)", "Peak (dB)", "RMS (dB)",
+                                                                 "File"))
+            for path, info in sorted(trimmable, key=lambda item: (-silence(item), item[0]))[:top]:
+                self.log.info("  {:>9.0f} {:>9.0f} {:>9.1f} {:>9.1f}  {}".format(
+                              info.lead * 1000 / info.samplerate, info.trail * 1000 / info.samplerate,
+                              to_db(info.peak), to_db(info.rms), self._get_relative_path(path, self.machine_path)))
+
+        if trim and trimmable:
+            self._trim_silence(trimmable)
+        return levels
+
+    def _trim_silence(self, trimmable):
+        """Trim the leading and trailing silence of (path, AudioLevels) pairs in place, in parallel."""
+        from mpfam.core.AudioAnalysis import get_trim_range, trim_file
+        jobs = [(path,) + get_trim_range(info) for path, info in trimmable]
+        self.log.info("\nTrimming silence from {} files (originals are kept with an \".original\" extension)...".format(
+                      len(jobs)))
+        count = 0
+        with self.timer.phase("trim") as span:
+            for path, removed, error in process_map(trim_file, jobs, self.workers, self.log):
+                if error:
+                    self.log.error("ERROR: Unable to trim {}: {}".format(path, error))
+                    continue
+                self.log.debug(" - {}: {} frames removed".format(path, removed))
+                count += 1
+                span.add(1, os.path.getsize(path))
+        self.log.info("Successfully trimmed {} of {} files".format(count, len(jobs)))
+
+    def report_footprint(self, samplerate=None, channels=None, budget=None, total_budget=None, top=10,
+                         json_path=None):
+        """Report the decoded memory size of each mode's sounds and return 1 if a budget is exceeded.
+
+        Sizes come from the audio headers, assuming MPF decodes to 16-bit samples at the
+        file's own rate and channels unless a playback rate or channel count is given.
+        Missing assets are measured from the source folder when it isn't a zip file.
+        Budgets are in megabytes, per parent mode and for the whole machine.
+        """
+        self._get_analysis(export_only=True)
+
+        paths = {}  # Key: path to read, Value: list of the filenames it provides
+        for filename in self._analysis['found']:
+            paths["{}{}".format(self._analysis['sounds'][filename]['modepath'], filename)] = [filename]
+        if not self._get_archive():
+            # Name each sound after the file it will be copied to, since deduplicated sources share one file
+            for expectedpath, sourcepath in self._analysis['available'].items():
+                paths.setdefault(sourcepath, []).append(os.path.basename(expectedpath))
+        infos = self._get_audio_info(list(paths))
+
+        footprint = MemoryFootprint(samplerate=samplerate, channels=channels)
+        for path, info in infos.items():
+            for filename in paths[path]:
+                sound = self._analysis['sounds'][filename]
+                modeassets = self.machine_configs.get_all_configs()[sound['mode']]
+                footprint.add(filename, path, info, sound['mode'], sound['track'],
+                              self.machine_configs.get_mode_parent(sound['mode']), modeassets.is_streaming(filename))
+        unmeasured = len(self._analysis['sounds']) - len(footprint)
+
+        for line in footprint.format_table(top):
+            self.log.info(line)
+        if unmeasured:
+            self.log.info("{} files could not be measured (unavailable, unreadable, or in a zip source)".format(
+                          unmeasured))
+        if json_path:
+            with open(json_path, mode="w") as f:
+                f.write(footprint.to_json(top))
+            self.log.info("Footprint report written to {}".format(json_path))
+
+        failed = False
+        if budget is not None:
+            for parent, size in footprint.over_budget(budget * MEGABYTE).items():
+                self.log.error("ERROR: Mode {} uses {:.1f} MB, over the budget of {} MB".format(
+                               parent, size / MEGABYTE, budget))
+                failed = True
+        if total_budget is not None and footprint.total() > total_budget * MEGABYTE:
+            self.log.error("ERROR: Machine uses {:.1f} MB, over the budget of {} MB".format(
+                           footprint.total() / MEGABYTE, total_budget))
+            failed = True
+        return 1 if failed else 0
+
+    def _convert_sample_rates(self, infos, target_rate):
+        """Resample all assets that aren't at the target rate, in parallel."""
+        from mpfam.core.Resampler import resample_file
+        jobs = [(path, target_rate) for path, info in infos.items() if info.samplerate != target_rate]
+        if not jobs:
+            self.log.info("\nAll files are already {} Hz, nothing to convert.".format(target_rate))
+            return
+        self.log.info("\nResampling {} files to {} Hz (originals are kept with an \".original\" extension)...".format(
+                      len(jobs), target_rate))
         count = 0
+        with self.timer.phase("resample") as span:
+            for path, source_rate, error in process_map(resample_file, jobs, self.workers, self.log):
+                if error:
+                    self.log.error("ERROR: Unable to resample {}: {}".format(path, error))
+                    continue
+                self.log.debug(" - {}: {} Hz -> {} Hz".format(path, source_rate, target_rate))
+                count += 1
+                span.add(1, os.path.getsize(path))
+        self.log.info("Successfully resampled {} of {} files".format(count, len(jobs)))
 
-        if export:
-            src = videoroot
-            dst = exportroot
-        else:
-            src = exportroot
-            dst = videoroot
+    def _get_hash_index(self):
+        return HashIndex(self._get_catalog().get_hash_cache(), self.log, threads=self.threads)
+
+    def _get_archive(self):
+        """Return the source tree if it's a zip file, for extracting members instead of copying files."""
+        return self.source_media.trees[0] if self.source_media and self.source_media.is_archive else None
+
+    def _get_copy_engine(self):
+        return CopyEngine(self.log, threads=self.threads, link_mode=self.link_mode)
+
+    def _copy_files(self, pairs, archive=None, on_copied=None):
+        """Copy (source, destination) pairs, adding the files and bytes written to the current phase."""
+        engine = self._get_copy_engine()
+        count = engine.copy_files(pairs, archive=archive, on_copied=on_copied)
+        self.timer.current.add(count, engine.bytes_written)
+        return count
+
+    def _get_audio_info(self, paths):
+        """Return header metadata for the given audio files, using the persistent metadata cache."""
+        from mpfam.core.AudioMetadata import get_audio_info
+        cache = self._get_catalog().get_audio_cache()
+        with self.timer.phase("audio headers") as span:
+            infos = get_audio_info(paths, cache, self.log, workers=self.workers)
+            span.add(len(infos))
+        return infos
+
+    def _get_video_files(self):
+        """Return (path, filename) for each video in the machine's videos folder."""
+        return [(path, os.path.basename(path)) for path, __stat in self._get_machine_scan().videos]
+
+    def _copy_video_assets(self, export=True, zipFile=None, exclude=()):
+        if not export:
+            return self._copy_files(self._get_video_imports(), archive=self._get_archive())
+        videos = self._get_video_files()
+        dst = os.path.join(self.source_path, "videos")
 
         # Ensure the destination folder exists
         if not zipFile:
+            if self._get_archive():
+                self.log.warning("  Videos can't be exported into a zip source, skipping videos.")
+                return 0
             os.makedirs(dst, mode=0o755, exist_ok=True)
-        for path, dirs, files in os.walk(src):
-            for filename in files:
-                # Ignore hidden files
-                if filename[0] == ".":
-                    continue
-                target = os.path.join(dst, filename)
-                # Always copy on export, but not import
-                do_copy = export
-                try:
-                    os.stat(target)
-                except(FileNotFoundError):
-                    do_copy = True
-
-                if do_copy:
-                    srcfilepath = os.path.join(src, filename)
-                    if zipFile:
-                        zipFile.write(srcfilepath, os.path.join("videos", filename))
-                    else:
-                        shutil.copy2(srcfilepath, target)
-                    count += 1
-        return count
+
+        pairs = [(srcfilepath, os.path.join(dst, filename)) for srcfilepath, filename in videos
+                 if filename not in exclude]
+        if zipFile:
+            for srcfilepath, target in pairs:
+                zipFile.write(srcfilepath, "videos/{}".format(os.path.basename(target)))
+                self.timer.current.add(1, os.path.getsize(srcfilepath))
+            return len(pairs)
+        return self._copy_files(pairs)
+
+    def _get_video_imports(self):
+        """Return (source, destination) pairs for source videos missing from the machine's videos folder."""
+        videoroot = os.path.join(self.machine_path, "videos")
+        if self._get_archive():
+            archive = self._get_archive()
+            videos = [(os.path.join(archive.root, member), member.split("/")[-1])
+                      for member in archive.get_member_names("videos/")]
+        else:
+            videos = [(os.path.join(path, filename), filename)
+                      for path, __mtime, __dirs, files, __stats in walk_tree(
+                          os.path.join(self.source_path, "videos"))
+                      for filename in files if filename[0] != "."]
+        # Videos already in the machine are never overwritten
+        return [(srcfilepath, os.path.join(videoroot, filename)) for srcfilepath, filename in videos
+                if not os.path.exists(os.path.join(videoroot, filename))]
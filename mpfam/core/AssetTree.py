@@ -1,49 +1,212 @@
 import os
 import re
 
-SOUND_REGEX = 'ogg|wav|mp3|flac|aac'
+from mpfam.core.ExportArchive import EXPORT_MANIFEST_NAME, ExportManifest
+from mpfam.core.FilenameIndex import FilenameIndex
+from mpfam.core.TreeWalker import SOUND_EXTENSIONS, get_extension, scan_folder, walk_tree
+
+
+def get_backup_path(path):
+    """Return the path of the backup made before an asset file is replaced, e.g. "sound.original.wav"."""
+    return re.sub(r'\.([A-Za-z0-9]+)$', r'.original.\g<1>', path)
+
 
 class AssetTree(object):
     """Class to traverse source asset tree and return file information for assets in the MPF machine and mode folders."""
 
-    def __init__(self, fileroot, log, paths_to_exclude=[]):
-        """Initialize: traverse the asset files path and map asset filenames."""
-        # Most efficient way: two arrays in parallel?
-        self._soundfiles, self._soundpaths = [], []
-        self._originalfiles, self._originalpaths = [], []
-        for path, __dirs, files in os.walk(fileroot):
-            # Don't look in the exports folder!
-            if path in paths_to_exclude:
-                continue
+    # Bump when the pickled structure changes, so stale caches are rebuilt
+    VERSION = 7
+    # Whether files are members of an archive rather than paths on disk
+    is_archive = False
+
+    def __init__(self, fileroot, log, paths_to_exclude=[], folders=None):
+        """Initialize: traverse the asset files path and map asset filenames.
+
+        Folders starting with an excluded path prefix are pruned with everything beneath them. If folders is given
+        (e.g. from a MachineScan), those folder listings are indexed instead of walking.
+        """
+        self.version = self.VERSION
+        self.root = fileroot
+        self._paths_to_exclude = tuple(paths_to_exclude)
+        self._folders = {}  # Key: folder path, Value: (mtime_ns, subfolder paths, asset filenames)
+        self._soundfiles = {}  # Key: filename, Value: list of containing paths in scan order
+        self._originalfiles = {}  # Key: filename, Value: list of containing paths
+        self._duplicates = set()  # Filenames found in more than one path
+        self.changed_files = set()  # Filenames added or removed by the last revalidate()
+        self._names = None  # FilenameIndex of the asset filenames, built on first use
+        self._aliases = {}  # Key: filename deduplicated in an export, Value: filename holding its contents
+        if folders is None:
+            folders = self._walk(fileroot, self._paths_to_exclude)
+        for path, mtime, subdirs, files in folders:
+            self._folders[path] = (mtime, subdirs, files)
             for filename in files:
-                if re.search(r'\.(' + SOUND_REGEX + ')$', filename):
-                    if re.search(r'\.original\.(' + SOUND_REGEX + ')$', filename):
-                        self._originalfiles.append(filename)
-                        self._originalpaths.append(path)
-                    else:
-                        if filename in self._soundfiles:
-                            log.info("File {} found in {} but also in {}".format(
-                                  filename, path, self._soundpaths[self._soundfiles.index(filename)]))
-                        self._soundfiles.append(filename)
-                        self._soundpaths.append(path)
+                self._add_file(path, filename, log)
+        if fileroot in self._folders:
+            self._load_aliases()
+
+    def _load_aliases(self):
+        """Read the filename aliases from an export manifest at the root, if this tree is an export."""
+        manifest = ExportManifest.load(os.path.join(self.root, EXPORT_MANIFEST_NAME))
+        return self._set_aliases(manifest.get_aliases())
+
+    def _set_aliases(self, aliases):
+        """Index deduplicated filenames by the filename written with their contents, and return those that changed."""
+        aliases = {filename: blob for filename, blob in aliases.items() if "/" not in filename}
+        changed = {filename for filename in set(aliases) | set(self._aliases)
+                   if aliases.get(filename) != self._aliases.get(filename)}
+        self._aliases = aliases
+        return changed
+
+    def _walk(self, fileroot, paths_to_exclude):
+        """Yield each folder path with its mtime, subfolders, and asset filenames."""
+        for path, mtime, subdirs, files, __stats in walk_tree(fileroot, SOUND_EXTENSIONS, paths_to_exclude):
+            yield path, mtime, subdirs, files
+
+    def _scan_folder(self, path):
+        """List the subfolders and asset files directly inside a folder."""
+        subdirs, files, __stats = scan_folder(path, SOUND_EXTENSIONS, self._paths_to_exclude)
+        return subdirs, files
+
+    def _add_file(self, path, filename, log):
+        """Index a single file, recording duplicates as they are found."""
+        if get_extension(filename) not in SOUND_EXTENSIONS:
+            return
+        if self._is_original(filename):
+            self._originalfiles.setdefault(filename, []).append(path)
+            return
+        paths = self._soundfiles.get(filename)
+        if paths is None:
+            self._soundfiles[filename] = [path]
+            if self._names is not None:
+                self._names.add(filename)
+            return
+        log.info("File {} found in {} but also in {}".format(filename, path, paths[0]))
+        paths.append(path)
+        self._duplicates.add(filename)
+
+    @staticmethod
+    def _is_original(filename):
+        """Check for a backup made before resampling, e.g. "sound.original.wav"."""
+        return filename.rpartition(".")[0].endswith(".original")
+
+    def _remove_file(self, path, filename):
+        """Remove a single file from the index."""
+        index = self._originalfiles if self._is_original(filename) else self._soundfiles
+        paths = index.get(filename)
+        if not paths or path not in paths:
+            return
+        paths.remove(path)
+        if not paths:
+            del index[filename]
+            if self._names is not None and index is self._soundfiles:
+                self._names.remove(filename)
+        if len(paths) < 2:
+            self._duplicates.discard(filename)
+
+    def revalidate(self, log):
+        """Rescan only the folders whose mtime changed since the last scan, and return the count rescanned.
+
+        A folder's mtime changes whenever an entry directly inside it is added,
+        removed, or renamed, so unchanged folders can reuse their cached listing.
+        """
+        folders = {}
+        changed = []
+        self.changed_files = set()
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except(FileNotFoundError, NotADirectoryError):
+                continue
+            cached = self._folders.get(path)
+            if cached and cached[0] == mtime:
+                folders[path] = cached
+            else:
+                try:
+                    subdirs, files = self._scan_folder(path)
+                except(FileNotFoundError, NotADirectoryError):
+                    continue
+                folders[path] = (mtime, subdirs, files)
+                changed.append(path)
+            stack.extend(reversed(folders[path][1]))
+
+        removed = [path for path in self._folders if path not in folders]
+        for path in changed + removed:
+            for filename in self._folders.get(path, (None, None, []))[2]:
+                self._remove_file(path, filename)
+                self.changed_files.add(filename)
+        for path in changed:
+            for filename in folders[path][2]:
+                self._add_file(path, filename, log)
+                self.changed_files.add(filename)
+        self._folders = folders
+        if self.root in changed:
+            # An export's manifest is at its root, so its aliases can only change with the root folder
+            self.changed_files.update(self._load_aliases())
+        return len(changed) + len(removed)
+
+    def _resolve_alias(self, filename):
+        """Return the filename holding a file's contents: its deduplicated blob, or the filename itself."""
+        if filename not in self._soundfiles and self._aliases.get(filename) in self._soundfiles:
+            return self._aliases[filename]
+        return filename
 
     def get_file_path(self, filename):
-        """Return the path of the first occurrance of a filename."""
-        idx = self._soundfiles.index(filename)
-        return os.path.join(self._soundpaths[idx], filename)
+        """Return the path of the first occurrance of a filename (or of the file holding its contents)."""
+        blob = self._resolve_alias(filename)
+        try:
+            return os.path.join(self._soundfiles[blob][0], blob)
+        except(KeyError):
+            raise ValueError("{} is not in the asset tree".format(filename))
+
+    def get_file_paths(self, filename):
+        """Return the paths of every occurrance of a filename, in scan order."""
+        blob = self._resolve_alias(filename)
+        return [os.path.join(path, blob) for path in self._soundfiles.get(blob, [])]
+
+    def has_name_index(self):
+        """Check whether the filename index has been built (and so would be saved with the tree)."""
+        return self._names is not None
+
+    def suggest(self, filename, limit=3):
+        """Return up to limit (score, filename) tuples for the filenames closest to one that isn't in the tree.
+
+        The trigram index is built on first use and kept up to date by revalidate().
+        """
+        if self._names is None:
+            self._names = FilenameIndex(self._soundfiles)
+        return self._names.suggest(filename, limit)
+
+    def get_backup(self, path):
+        """Return the path of the ".original." backup kept beside an asset file, or None if it has none."""
+        backup = get_backup_path(path)
+        if os.path.dirname(backup) in self._originalfiles.get(os.path.basename(backup), []):
+            return backup
+        return None
 
     def get_duplicates(self):
         """Return a mapping of assets with filenames appearing in multiple mode folders."""
-        dupes = {}
-        for idx, filename in enumerate(self._soundfiles):
-            if self._soundfiles.index(filename) != idx:
-                if filename not in dupes:
-                    # Add the first instance from before we knew it was a dupe
-                    dupes[filename] = [os.path.join(self._soundpaths[self._soundfiles.index(filename)], filename)]
-                dupes[filename].append(os.path.join(self._soundpaths[idx], filename))
-        return dupes
+        return {filename: [os.path.join(path, filename) for path in self._soundfiles[filename]]
+                for filename in self._duplicates}
 
     def get_files(self):
-        """Return the mapping of asset files to their containing mode folders."""
-        return self._soundfiles
+        """Return the asset filenames in the tree, including deduplicated filenames."""
+        return list(self._soundfiles) + [filename for filename in self._aliases
+                                         if filename not in self._soundfiles and self._aliases[filename] in self._soundfiles]
+
+    def get_folders(self):
+        """Return the scanned folders, mapped to their (mtime_ns, subfolder paths, asset filenames)."""
+        return self._folders
+
+    def get_folder_count(self):
+        """Return the number of folders scanned."""
+        return len(self._folders)
+
+    def __contains__(self, filename):
+        """Check whether a filename exists in the tree, or is deduplicated into a file that does."""
+        return self._resolve_alias(filename) in self._soundfiles
 
+    def __len__(self):
+        """Length is the number of unique filenames."""
+        return len(self._soundfiles)
@@ -0,0 +1,133 @@
+from collections import namedtuple
+import math
+import os
+
+# Requires: numpy and pysoundfile (via pip)
+import numpy as np
+import soundfile as sf
+from mpfam.core.Resampler import replace_keeping_original
+from mpfam.core.WorkerPool import process_map
+
+# Frames read per block, so memory stays bounded however long the file is
+BLOCK_FRAMES = 64 * 1024
+# Samples quieter than this (in dBFS) count as silence
+DEFAULT_THRESHOLD = -60.0
+# Seconds of silence kept at each end when trimming, so sounds don't start or stop abruptly
+TRIM_PADDING = 0.01
+# Files with less silence than this (in seconds) aren't worth rewriting
+MIN_TRIM = 0.05
+
+# Levels of an audio file. Peak and RMS are linear (0 to 1), and lead/trail are frames of silence.
+AudioLevels = namedtuple("AudioLevels", ["peak", "rms", "lead", "trail", "frames", "samplerate", "channels",
+                                         "threshold"])
+
+
+def to_db(level):
+    """Convert a linear level to dBFS."""
+    return 20 * math.log10(level) if level > 0 else -math.inf
+
+
+def analyze_file(job):
+    """Read an audio file block by block, returning (path, AudioLevels or None, error message or None).
+
+    Takes a (path, threshold in dBFS) tuple so it can run on a process pool.
+    """
+    path, threshold = job
+    limit = 10 ** (threshold / 20)
+    peak, squares, frames = 0.0, 0.0, 0
+    first, last = None, None  # First and last frames above the threshold
+    try:
+        with sf.SoundFile(path) as f:
+            samplerate, channels = f.samplerate, f.channels
+            for block in f.blocks(blocksize=BLOCK_FRAMES, dtype="float32", always_2d=True):
+                levels = np.abs(block).max(axis=1)
+                loud = np.flatnonzero(levels > limit)
+                if loud.size:
+                    if first is None:
+                        first = frames + int(loud[0])
+                    last = frames + int(loud[-1])
+                if levels.size:
+                    peak = max(peak, float(levels.max()))
+                squares += float(np.square(block, dtype=np.float64).sum())
+                frames += block.shape[0]
+    except Exception as e:
+        return path, None, str(e) or type(e).__name__
+    rms = math.sqrt(squares / (frames * channels)) if frames else 0.0
+    if first is None:
+        # A silent file is all lead, with nothing to trail
+        lead, trail = frames, 0
+    else:
+        lead, trail = first, frames - 1 - last
+    return path, AudioLevels(peak, rms, lead, trail, frames, samplerate, channels, threshold), None
+
+
+def get_audio_levels(paths, cache, log, workers=None, threshold=DEFAULT_THRESHOLD):
+    """Return a mapping of path to AudioLevels, analyzing only files that aren't cached at this threshold.
+
+    Unreadable files are logged and left out of the result.
+    """
+    results = {}
+    stats = {}
+    misses = []
+    for path in paths:
+        try:
+            stats[path] = os.stat(path)
+        except(FileNotFoundError):
+            log.warning("    - File not found: {}".format(path))
+            continue
+        levels = cache.get(path, stats[path]) if cache is not None else None
+        if levels is None or levels.threshold != threshold:
+            misses.append(path)
+        else:
+            results[path] = levels
+
+    if misses:
+        log.info("    - Analyzing {} files ({} cached)".format(len(misses), len(results)))
+        for path, levels, error in process_map(analyze_file, [(path, threshold) for path in misses], workers, log):
+            if levels is None:
+                log.warning("    - Unable to analyze {}: {}".format(path, error))
+                continue
+            results[path] = levels
+            if cache is not None:
+                cache.set(path, levels, stats[path])
+        if cache is not None:
+            cache.save()
+    return results
+
+
+def get_trim_range(levels, padding=TRIM_PADDING):
+    """Return the (start, stop) frames to keep when trimming silence, leaving some padding at each end."""
+    pad = int(levels.samplerate * padding)
+    return max(0, levels.lead - pad), min(levels.frames, levels.frames - levels.trail + pad)
+
+
+def trim_file(job):
+    """Trim leading and trailing silence from an asset file in place, keeping a ".original." backup.
+
+    Takes a (path, start frame, stop frame) tuple so it can run on a process pool,
+    and returns (path, frames removed, error message or None). The audio is copied
+    block by block, in its original format and subtype.
+    """
+    path, start, stop = job
+    tmp_path = "{}.trim.tmp".format(path)
+    try:
+        with sf.SoundFile(path) as fsrc:
+            frames = fsrc.frames
+            with sf.SoundFile(tmp_path, "w", samplerate=fsrc.samplerate, channels=fsrc.channels,
+                              subtype=fsrc.subtype, format=fsrc.format) as fdst:
+                # Integer samples round-trip PCM exactly, where float would rescale them
+                dtype = "int32" if fsrc.subtype.startswith("PCM") else "float64"
+                fsrc.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    block = fsrc.read(min(remaining, BLOCK_FRAMES), dtype=dtype, always_2d=True)
+                    if not len(block):
+                        break
+                    fdst.write(block)
+                    remaining -= len(block)
+        replace_keeping_original(path, tmp_path)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return path, 0, str(e) or type(e).__name__
+    return path, frames - (stop - start), None
@@ -0,0 +1,52 @@
+from collections import namedtuple
+import os
+
+# Requires: pysoundfile (via pip)
+import soundfile as sf
+from mpfam.core.WorkerPool import process_map
+
+# Header fields of an audio file, read without decoding any samples
+AudioInfo = namedtuple("AudioInfo", ["samplerate", "channels", "frames", "subtype"])
+
+
+def read_audio_info(path):
+    """Read the header of an audio file, returning (path, AudioInfo or None, error message or None)."""
+    try:
+        info = sf.info(path)
+    except Exception as e:
+        return path, None, str(e) or type(e).__name__
+    return path, AudioInfo(info.samplerate, info.channels, info.frames, info.subtype), None
+
+
+def get_audio_info(paths, cache, log, workers=None):
+    """Return a mapping of path to AudioInfo, reading headers only for files that aren't cached.
+
+    Unreadable files are logged and left out of the result.
+    """
+    results = {}
+    stats = {}
+    misses = []
+    for path in paths:
+        try:
+            stats[path] = os.stat(path)
+        except(FileNotFoundError):
+            log.warning("    - File not found: {}".format(path))
+            continue
+        info = cache.get(path, stats[path]) if cache is not None else None
+        if info is None:
+            misses.append(path)
+        else:
+            results[path] = info
+
+    if misses:
+        log.info("    - Reading headers of {} files ({} cached)".format(len(misses), len(results)))
+        for path, info, error in process_map(read_audio_info, misses, workers, log):
+            if info is None:
+                log.warning("    - Unable to read {}: {}".format(path, error))
+                continue
+            results[path] = info
+            if cache is not None:
+                cache.set(path, info, stats[path])
+        if cache is not None:
+            cache.save()
+    return results
@@ -0,0 +1,82 @@
+from datetime import datetime
+import json
+import os
+
+# Exit code for each kind of problem, added together when there are several. 1 and 2 are left for errors.
+CHECK_EXIT_CODES = {
+    "missing": 4,  # Required by a config, but in neither the mode folders nor a source folder
+    "misplaced": 8,  # In another mode's folder
+    "orphaned": 16,  # In a mode folder, but unused or a duplicate of a file in its right place
+    "uncopied": 32,  # Required by a config and in a source folder, but not copied to its mode folder yet
+}
+
+
+class CheckReport(object):
+    """Class to summarize the problems in an asset analysis, as log lines, JSON, and an exit code.
+
+    Paths in the machine folder are given relative to it, so reports from different
+    checkouts of the same project can be compared.
+    """
+
+    VERSION = 1
+
+    def __init__(self, machine_path, analysis, changes=None):
+        """Initialize with an AssetManager analysis, and the changes since the last check (None for a full check)."""
+        self.machine_path = machine_path
+        self.changes = changes
+        self.sounds = len(analysis['sounds'])
+        self.problems = dict((name, []) for name in CHECK_EXIT_CODES)  # Key: problem, Value: list of dicts
+
+        def sound(filename):
+            details = analysis['sounds'][filename]
+            return {"file": filename, "mode": details['mode'],
+                    "expected": self._relative("{}{}".format(details['modepath'], filename))}
+
+        for filename in analysis['unavailable']:
+            self.problems["missing"].append(sound(filename))
+        for expectedpath, sourcepath in analysis['available'].items():
+            self.problems["uncopied"].append(dict(sound(os.path.basename(expectedpath)), source=sourcepath))
+        for expectedpath, filepath in analysis['misplaced'].items():
+            self.problems["misplaced"].append(dict(sound(os.path.basename(expectedpath)), path=self._relative(filepath)))
+        for category, reason in (('orphaned', "unused"), ('duplicated', "duplicate")):
+            for filepath in analysis[category]:
+                self.problems["orphaned"].append({"file": os.path.basename(filepath), "path": self._relative(filepath),
+                                                  "reason": reason})
+        for problems in self.problems.values():
+            problems.sort(key=lambda problem: (problem["file"], problem.get("path", "")))
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.machine_path)
+
+    @property
+    def exit_code(self):
+        return sum(code for name, code in CHECK_EXIT_CODES.items() if self.problems[name])
+
+    def format_lines(self):
+        """Return the report as lines of text: a summary, then one line per problem."""
+        if self.changes is None:
+            scope = "full check"
+        elif not any(self.changes.values()):
+            scope = "nothing changed since the last check"
+        else:
+            scope = "{} files re-evaluated after changes to {} configs, {} source folders, and {} mode folders".format(
+                self.changes["files"], self.changes["configs"], self.changes["source folders"],
+                self.changes["mode folders"])
+        counts = ["{} {}".format(len(self.problems[name]), name) for name in CHECK_EXIT_CODES if self.problems[name]]
+        lines = ["\nCheck {}: {} sounds, {} ({})".format("failed" if counts else "passed", self.sounds,
+                                                         ", ".join(counts) or "no problems", scope)]
+        for name in CHECK_EXIT_CODES:
+            for problem in self.problems[name]:
+                if "mode" in problem:
+                    where = "{} (mode {})".format(problem.get("path", problem["expected"]), problem["mode"])
+                else:
+                    where = "{} ({})".format(problem["path"], problem["reason"])
+                lines.append("  {:<9} {}".format(name, where))
+        return lines
+
+    def to_json(self):
+        return json.dumps({"version": self.VERSION, "checked": datetime.now().isoformat(timespec="seconds"),
+                           "machine_path": self.machine_path, "incremental": self.changes is not None,
+                           "changes": self.changes, "sounds": self.sounds, "exit_code": self.exit_code,
+                           "counts": dict((name, len(problems)) for name, problems in self.problems.items()),
+                           "problems": self.problems}, indent=1)
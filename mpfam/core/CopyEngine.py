@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import os
+import shutil
+import sys
+import time
+
+LINK_MODES = ("hardlink", "reflink")
+# Linux ioctl to clone a file's extents (btrfs, xfs, and other copy-on-write filesystems)
+FICLONE = 0x40049409
+
+
+class CopyEngine(object):
+    """Class to copy batches of files on a thread pool, linking instead of copying when possible."""
+
+    def __init__(self, log, threads=None, link_mode=None):
+        """Initialize with a thread count and an optional link mode ("hardlink" or "reflink")."""
+        if link_mode and link_mode not in LINK_MODES:
+            raise ValueError("Unknown link mode '{}', expected one of {}".format(link_mode, ", ".join(LINK_MODES)))
+        self.log = log
+        self.threads = threads or min(32, (os.cpu_count() or 1) * 4)
+        self.link_mode = link_mode
+        self._devices = {}  # Key: folder path, Value: st_dev of that folder
+        self._reflink_supported = link_mode == "reflink" and sys.platform.startswith("linux")
+        self.bytes_written = 0  # Total across all batches
+
+    def copy_files(self, pairs, archive=None, on_copied=None):
+        """Copy each (source, destination) pair, returning the number of files written.
+
+        If an archive (a ZipAssetTree) is given, sources are its member paths and are extracted.
+        If on_copied is given, it's called with each written pair, in order, on the calling thread.
+        """
+        if not pairs:
+            return 0
+        starttime = time.perf_counter()
+        # Create every target folder once, instead of once per file
+        for folder in sorted({os.path.dirname(dst) for __src, dst in pairs}):
+            os.makedirs(folder, mode=0o755, exist_ok=True)
+
+        methods = {"copy": 0, "extract": 0, "hardlink": 0, "reflink": 0}
+        count, size, errors = 0, 0, []
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            if archive:
+                futures = [executor.submit(self._extract_file, archive, src, dst) for src, dst in pairs]
+            else:
+                futures = [executor.submit(self._copy_file, src, dst) for src, dst in pairs]
+            for (src, dst), future in zip(pairs, futures):
+                try:
+                    method, nbytes = future.result()
+                except OSError as e:
+                    errors.append((src, e))
+                    continue
+                methods[method] += 1
+                size += nbytes
+                count += 1
+                if on_copied:
+                    on_copied(src, dst)
+
+        if archive:
+            archive.close_handles()
+        for src, error in errors:
+            self.log.error("ERROR: Unable to copy {}: {}".format(src, error))
+        self.bytes_written += size
+        self._report(count, size, methods, time.perf_counter() - starttime)
+        return count
+
+    def _copy_file(self, src, dst):
+        """Write a single file, returning the method used and the bytes it represents."""
+        self.log.debug(" - {} -> {}".format(src, dst))
+        size = os.stat(src).st_size
+        if self.link_mode and self._same_device(src, dst):
+            if self.link_mode == "hardlink":
+                try:
+                    self._write_over(src, dst, os.link)
+                    return "hardlink", size
+                except OSError as e:
+                    # Some filesystems (e.g. FAT) don't support hardlinks, and some folders are read-only
+                    self.log.debug("   Unable to hardlink {}, copying instead: {}".format(src, e))
+            if self._reflink_supported and self._reflink(src, dst):
+                return "reflink", size
+        # Also via a temporary name, since dst may still be a hardlink of src from an earlier update
+        self._write_over(src, dst, shutil.copy2)
+        return "copy", size
+
+    def _extract_file(self, archive, src, dst):
+        """Write a single archive member."""
+        self.log.debug(" - {} -> {}".format(src, dst))
+        return "extract", archive.extract_member(src, dst)
+
+    def _same_device(self, src, dst):
+        """Check whether the source file and destination folder are on the same filesystem."""
+        return self._get_device(os.path.dirname(src)) == self._get_device(os.path.dirname(dst))
+
+    def _get_device(self, folder):
+        device = self._devices.get(folder)
+        if device is None:
+            device = self._devices[folder] = os.stat(folder).st_dev
+        return device
+
+    def _reflink(self, src, dst):
+        """Clone src into dst without copying its bytes. Return False if the filesystem can't."""
+        try:
+            self._write_over(src, dst, self._clone)
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY):
+                raise
+            # Don't keep trying on a filesystem that doesn't support it
+            self._reflink_supported = False
+            return False
+        return True
+
+    @staticmethod
+    def _clone(src, dst):
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+
+    @classmethod
+    def _write_over(cls, src, dst, write):
+        """Write src to a temporary name beside dst (by linking, cloning, or copying), then move it over dst.
+
+        An existing destination is only replaced once the new file is complete, so
+        it's kept if writing fails.
+        """
+        tmp_path = "{}.mpfam_tmp".format(dst)
+        cls._remove(tmp_path)
+        try:
+            write(src, tmp_path)
+            os.replace(tmp_path, dst)
+        finally:
+            # Left behind if writing failed, or if dst was already a hardlink of src (the rename does nothing)
+            cls._remove(tmp_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except(FileNotFoundError):
+            pass
+
+    def _report(self, count, size, methods, elapsed):
+        """Log the throughput of a batch."""
+        elapsed = max(elapsed, 1e-6)
+        linked = ", ".join("{} {}ed".format(methods[m], m) for m in LINK_MODES + ("extract",) if methods[m])
+        self.log.info("  Wrote {} files ({:.1f} MB) in {:.2f} seconds: {:.1f} files/s, {:.1f} MB/s{}".format(
+            count, size / 1000000, elapsed, count / elapsed, size / 1000000 / elapsed,
+            " ({})".format(linked) if linked else ""))
@@ -0,0 +1,166 @@
+from datetime import datetime
+import hashlib
+import json
+import os
+
+# Seconds of mtime difference to tolerate, since copying a source folder to
+# another computer (or a FAT drive) can round its timestamps
+MTIME_TOLERANCE = 2
+OPERATIONS = ("delete", "move", "copy")
+# Journal entries are flushed to disk at least this often while copying
+JOURNAL_SYNC_EVERY = 200
+
+
+class ExecutionPlan(object):
+    """Class to record the deletes, moves, and copies of an update, so they can be applied later or elsewhere.
+
+    Paths are stored relative to the machine and source folders, so a plan made
+    on one computer can be applied to a copy of the project on another. Each
+    operation carries the size and mtime its file had when the plan was made.
+    """
+
+    VERSION = 1
+
+    def __init__(self, operations=None, created=None, source_is_archive=False):
+        """Initialize with a list of operation dicts."""
+        self.operations = operations or []
+        self.created = created or datetime.now().isoformat(timespec="seconds")
+        self.source_is_archive = source_is_archive
+
+    def add(self, op, path=None, src=None, dst=None, stat=None, size=None, kind="audio", root=None):
+        """Add an operation, with the size and mtime of the file it reads (or deletes) as its precondition.
+
+        Deletes take a machine-relative path. Moves take machine-relative src and
+        dst, and copies take a src relative to one of the source folders (root is
+        its index in priority order) and a machine-relative dst.
+        """
+        if op not in OPERATIONS:
+            raise ValueError("Unknown plan operation '{}'".format(op))
+        operation = {"id": len(self.operations), "op": op, "kind": kind}
+        if path is not None:
+            operation["path"] = path
+        if src is not None:
+            operation["src"] = src
+            operation["dst"] = dst
+        if root is not None:
+            operation["root"] = root
+        operation["size"] = stat.st_size if stat else size
+        operation["mtime"] = stat.st_mtime if stat else None
+        self.operations.append(operation)
+        return operation
+
+    def by_op(self, op):
+        """Return the operations of one type, in plan order."""
+        return [operation for operation in self.operations if operation["op"] == op]
+
+    @staticmethod
+    def matches(operation, stat=None, size=None):
+        """Check that a file still has the size and mtime it had when the plan was made.
+
+        Zip members are only compared by size.
+        """
+        if stat is not None:
+            size = stat.st_size
+        if size != operation["size"]:
+            return False
+        return stat is None or operation["mtime"] is None or abs(stat.st_mtime - operation["mtime"]) <= MTIME_TOLERANCE
+
+    @classmethod
+    def load(cls, path):
+        """Read a plan file, raising ValueError if it isn't a plan this version can apply."""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") != cls.VERSION:
+            raise ValueError("{} is not a version {} mpfam plan".format(path, cls.VERSION))
+        return cls(data["operations"], data.get("created"), data.get("source_is_archive", False))
+
+    def save(self, path):
+        """Write the plan as JSON."""
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": self.VERSION, "created": self.created, "source_is_archive": self.source_is_archive,
+                       "operations": self.operations}, f, indent=1)
+        os.replace(tmp_path, path)
+
+    @property
+    def digest(self):
+        """Return a hash of the plan's contents, which identifies it in its journal."""
+        content = json.dumps([self.created, self.source_is_archive, self.operations], sort_keys=True)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        """Length is the number of operations."""
+        return len(self.operations)
+
+
+class PlanJournal(object):
+    """Append-only record of the plan operations already applied, so an interrupted apply can resume.
+
+    The first line holds the digest of the plan it belongs to. A journal left by a
+    different plan (one written again to the same file) is discarded.
+    """
+
+    def __init__(self, plan_path, digest):
+        """Initialize: read the operations completed by any earlier apply of the same plan."""
+        self.path = self.get_path(plan_path)
+        self.completed = set()  # Operation ids
+        self.discarded = False
+        self._unsynced = 0
+        header = "plan {}\n".format(digest)
+        line = "\n"
+        found = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                found = f.readline() == header
+                self.discarded = not found
+                for line in (f if found else []):
+                    status, __, opid = line.rstrip("\n").partition(" ")
+                    # A line cut short by a crash is ignored, and that operation runs again
+                    if line.endswith("\n") and status == "done" and opid.isdigit():
+                        self.completed.add(int(opid))
+        except(FileNotFoundError):
+            pass
+        if not found:
+            self._file = open(self.path, 'w', encoding='utf-8')
+            self._file.write(header)
+            self.sync()
+            return
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if not line.endswith("\n"):
+            # End the partial line, so it isn't joined to the next entry
+            self._file.write("\n")
+
+    @staticmethod
+    def get_path(plan_path):
+        """Return the path of the journal kept beside a plan file."""
+        return "{}.journal".format(plan_path)
+
+    @classmethod
+    def remove(cls, plan_path):
+        """Delete the journal of a plan file, if it has one."""
+        try:
+            os.remove(cls.get_path(plan_path))
+        except(FileNotFoundError):
+            pass
+
+    def record(self, operation):
+        """Mark an operation as applied."""
+        self._file.write("done {}\n".format(operation["id"]))
+        self.completed.add(operation["id"])
+        self._unsynced += 1
+        if self._unsynced >= JOURNAL_SYNC_EVERY:
+            self.sync()
+
+    def sync(self):
+        """Flush recorded operations to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    def __contains__(self, operation):
+        """Check whether an operation was already applied."""
+        return operation["id"] in self.completed
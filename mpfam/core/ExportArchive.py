@@ -0,0 +1,193 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import os
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+
+# Compression per file extension. Compressed audio/video gains nothing from deflate, so it is stored.
+COMPRESSION_TYPES = {"stored": ZIP_STORED, "deflate": ZIP_DEFLATED}
+DEFAULT_COMPRESSION = {"wav": "deflate", "aif": "deflate", "aiff": "deflate", "txt": "deflate", "json": "deflate"}
+# Files larger than this are streamed from disk by the writer, rather than read ahead into memory on the pool
+MAX_POOLED_SIZE = 64 * 1024 * 1024
+# Written at the root of every export, so it can be compared to later exports and used as a source
+EXPORT_MANIFEST_NAME = "_manifest.json"
+# Written beside the manifest when transcoding renamed files: the rename map and a patch for the configs
+RENAMES_NAME = "_renames.json"
+CONFIG_PATCH_NAME = "_config.patch"
+
+
+def parse_compression(spec):
+    """Parse a compression spec like "wav:deflate,ogg:stored" into a mapping of extension to method name."""
+    compression = dict(DEFAULT_COMPRESSION)
+    if not spec:
+        return compression
+    for item in spec.split(","):
+        try:
+            extension, method = item.split(":")
+        except(ValueError):
+            raise ValueError("Invalid compression '{}', expected extension:method".format(item))
+        if method not in COMPRESSION_TYPES:
+            raise ValueError("Unknown compression method '{}', expected one of: {}".format(
+                method, ", ".join(COMPRESSION_TYPES)))
+        compression[extension.lower().lstrip(".")] = method
+    return compression
+
+
+def _read_file(path, arcname):
+    """Read a whole file, returning its ZipInfo (with its timestamp and mode) and its contents."""
+    with open(path, 'rb') as f:
+        return ZipInfo.from_file(path, arcname), f.read()
+
+
+class ExportArchive(object):
+    """Class to write export zip files, reading members ahead in parallel but writing them in order."""
+
+    def __init__(self, zipfilename, log, compression=None, threads=None, level=6):
+        """Initialize: open the zip file for writing."""
+        self.log = log
+        self.compression = compression if compression is not None else dict(DEFAULT_COMPRESSION)
+        self.threads = threads or (os.cpu_count() or 1)
+        self.level = level
+        self.zipfile = ZipFile(zipfilename, mode='w', allowZip64=True, compresslevel=level)
+
+    def get_compression(self, arcname):
+        """Return the zip compression type for a member name."""
+        extension = arcname.rsplit(".", 1)[-1].lower() if "." in arcname else ""
+        return COMPRESSION_TYPES[self.compression.get(extension, "stored")]
+
+    def write_files(self, entries):
+        """Write each (path, archive name) pair to the zip, returning the bytes written."""
+        size = 0
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for path, arcname in entries:
+                future = None
+                if os.stat(path).st_size <= MAX_POOLED_SIZE:
+                    future = executor.submit(_read_file, path, arcname)
+                pending.append((path, arcname, future))
+                # Keep a bounded number of files in memory ahead of the writer
+                while len(pending) > self.threads * 2:
+                    size += self._write_pending(*pending.popleft())
+            while pending:
+                size += self._write_pending(*pending.popleft())
+        return size
+
+    def _write_pending(self, path, arcname, future):
+        """Write one member, either from the contents read ahead or streamed from disk."""
+        if future is None:
+            self.zipfile.write(path, arcname, compress_type=self.get_compression(arcname))
+            return os.stat(path).st_size
+        zinfo, data = future.result()
+        self.zipfile.writestr(zinfo, data, compress_type=self.get_compression(arcname), compresslevel=self.level)
+        return len(data)
+
+    def writestr(self, arcname, data):
+        """Write a small text or bytes member."""
+        self.zipfile.writestr(arcname, data, compress_type=self.get_compression(arcname))
+
+    def write(self, path, arcname):
+        """Write a single file member."""
+        self.zipfile.write(path, arcname, compress_type=self.get_compression(arcname))
+
+    def close(self):
+        """Finish the archive by writing its central directory."""
+        self.zipfile.close()
+
+
+class ExportManifest(object):
+    """Class to record the path, size, mtime, and hash of every exported file, to find changes between exports.
+
+    A file whose contents were written under another name has a "blob" entry
+    with that name, so identical audio is only exported once. A transcoded file
+    has a "name" entry with the filename it was written as, and the "profile" it
+    was transcoded with.
+    """
+
+    VERSION = 1
+
+    def __init__(self, files=None, exported=None):
+        """Initialize with a mapping of archive name to file details."""
+        self.files = files or {}  # Key: archive name, Value: dict of path, size, mtime, hash
+        self.exported = exported
+
+    @classmethod
+    def build(cls, entries, hash_index):
+        """Create a manifest for (path, archive name) pairs, hashing with a HashIndex."""
+        hashes = hash_index.get_hashes([path for path, __arcname in entries])
+        hash_index.save()
+        files = {}
+        for path, arcname in entries:
+            stat = os.stat(path)
+            files[arcname] = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime, "hash": hashes[path]}
+        return cls(files, exported=datetime.now().isoformat(timespec="seconds"))
+
+    @classmethod
+    def load(cls, path):
+        """Read a manifest file, returning an empty manifest if there isn't a valid one."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls.loads(f.read())
+        except(FileNotFoundError):
+            return cls()
+
+    @classmethod
+    def loads(cls, text):
+        """Parse a manifest from a JSON string, returning an empty manifest if it isn't valid."""
+        try:
+            data = json.loads(text)
+        except(ValueError):
+            return cls()
+        if data.get("version") != cls.VERSION:
+            return cls()
+        return cls(data.get("files"), data.get("exported"))
+
+    def save(self, path):
+        """Write the manifest as JSON."""
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.dumps())
+        os.replace(tmp_path, path)
+
+    def dumps(self):
+        """Return the manifest as a JSON string."""
+        return json.dumps({"version": self.VERSION, "exported": self.exported, "files": self.files},
+                          indent=1, sort_keys=True)
+
+    def deduplicate(self, arcnames):
+        """Point each archive name whose contents match an earlier one at that name, and return the names to write."""
+        blobs = {}  # Key: content hash, Value: archive name written with those contents
+        unique = []
+        for arcname in arcnames:
+            details = self.files[arcname]
+            blob = blobs.setdefault(details["hash"], arcname)
+            if blob == arcname:
+                details.pop("blob", None)
+                unique.append(arcname)
+            else:
+                details["blob"] = blob
+        return unique
+
+    def get_aliases(self):
+        """Return a mapping of each deduplicated file to the file its contents were written as, by written name."""
+        return {details.get("name", arcname): self.files[details["blob"]].get("name", details["blob"])
+                for arcname, details in self.files.items() if details.get("blob")}
+
+    def get_renames(self):
+        """Return a mapping of each transcoded archive name to the filename it was written as."""
+        return {arcname: details["name"] for arcname, details in self.files.items()
+                if details.get("name", arcname) != arcname}
+
+    def changed_since(self, previous):
+        """Return the archive names that are new or whose contents differ from a previous manifest."""
+        return [arcname for arcname, details in self.files.items()
+                if (previous.files.get(arcname, {}).get("hash"), previous.files.get(arcname, {}).get("profile")) !=
+                (details["hash"], details.get("profile"))]
+
+    def removed_since(self, previous):
+        """Return the archive names in a previous manifest that are no longer exported."""
+        return [arcname for arcname in previous.files if arcname not in self.files]
+
+    def __len__(self):
+        """Length is the number of files."""
+        return len(self.files)
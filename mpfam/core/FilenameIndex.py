@@ -0,0 +1,115 @@
+from collections import Counter
+import math
+import re
+
+# Runs of separators are compared as a single space, so "Ball_Save-1" matches "ball save 1"
+SEPARATORS = re.compile(r"[\s_\-.]+")
+# Trigrams in more than this share of the filenames (and at least COMMON_MIN) are only checked, not counted
+COMMON_SHARE = 0.05
+COMMON_MIN = 200
+# Candidates sharing the most trigrams, scored first to set the score the rest must beat
+FIRST_SCORED = 20
+
+
+def get_trigrams(filename):
+    """Return the set of trigrams of a filename, ignoring case, extension, and separators."""
+    stem = filename.rpartition(".")[0] or filename
+    name = "  {} ".format(SEPARATORS.sub(" ", stem.lower()).strip())
+    return {name[idx:idx + 3] for idx in range(len(name) - 2)}
+
+
+class FilenameIndex(object):
+    """Class to index filenames by trigram, to suggest the closest matches for a name that isn't found.
+
+    Candidates are only the filenames sharing a trigram with the name, so a
+    lookup doesn't compare against every file.
+    """
+
+    def __init__(self, filenames=()):
+        """Initialize with a collection of filenames."""
+        self._postings = {}  # Key: trigram, Value: set of filenames containing it
+        self._sizes = {}  # Key: filename, Value: number of distinct trigrams
+        for filename in filenames:
+            self.add(filename)
+
+    def add(self, filename):
+        """Index a filename by its trigrams, unless it's already indexed."""
+        if filename in self._sizes:
+            return
+        trigrams = get_trigrams(filename)
+        self._sizes[filename] = len(trigrams)
+        for trigram in trigrams:
+            self._postings.setdefault(trigram, set()).add(filename)
+
+    def remove(self, filename):
+        """Remove a filename from the index, if it's there."""
+        if self._sizes.pop(filename, None) is None:
+            return
+        for trigram in get_trigrams(filename):
+            postings = self._postings.get(trigram)
+            if postings is not None:
+                postings.discard(filename)
+                if not postings:
+                    del self._postings[trigram]
+
+    def suggest(self, filename, limit=3, cutoff=0.5):
+        """Return up to limit (score, filename) tuples for the closest matches, best first.
+
+        The score is the Dice coefficient of the trigram sets, from 0 to 1, and
+        matches scoring below the cutoff are dropped.
+
+        Shared trigrams are counted from the postings of all but the most common
+        trigrams (like "sfx"), which are only checked for the candidates that could
+        still make the results. The candidates with the highest counts are scored
+        first, and the lowest of the best limit scores then rules out every
+        candidate sharing too few trigrams to beat it, without scoring them.
+        """
+        # Rarest trigrams first, so the common ones are left to check last
+        trigrams = sorted(get_trigrams(filename), key=lambda trigram: len(self._postings.get(trigram, ())))
+        size = len(trigrams)
+        common = max(COMMON_MIN, len(self._sizes) * COMMON_SHARE)
+        # A match must share at least one of the rarest (size - min_shared + 1) trigrams
+        counted = max(size - self._get_bounds(size, cutoff)[2] + 1,
+                      len([trigram for trigram in trigrams if len(self._postings.get(trigram, ())) <= common]))
+        shared = Counter()
+        for trigram in trigrams[:counted]:
+            shared.update(self._postings.get(trigram, ()))
+        rest = [self._postings[trigram] for trigram in trigrams[counted:] if trigram in self._postings]
+
+        def score(candidate):
+            count = shared[candidate] + sum(1 for postings in rest if candidate in postings)
+            return 2 * count / (size + self._sizes[candidate])
+
+        scores = {}
+        for candidate, __count in shared.most_common(FIRST_SCORED):
+            scores[candidate] = score(candidate)
+        best = sorted([value for candidate, value in scores.items() if candidate != filename], reverse=True)
+        threshold = max(cutoff, best[limit - 1]) if len(best) >= limit else cutoff
+        # Bounds are loosened by a rounding error, so a candidate tying the threshold isn't ruled out
+        bound = threshold - 1e-9
+        __min_size, max_size, min_shared = self._get_bounds(size, bound)
+        # Even with every common trigram, a candidate needs this many of the counted ones to reach the threshold
+        floor = min_shared - len(rest)
+        sizes = self._sizes
+        for candidate in [candidate for candidate, count in shared.items() if count >= floor and
+                          2 * (count + len(rest)) >= bound * (size + sizes[candidate])]:
+            if candidate not in scores and sizes[candidate] <= max_size:
+                scores[candidate] = score(candidate)
+        results = [(value, candidate) for candidate, value in scores.items()
+                   if value >= threshold and candidate != filename]
+        results.sort(key=lambda item: (-item[0], item[1]))
+        return results[:limit]
+
+    @staticmethod
+    def _get_bounds(size, cutoff):
+        """Return the (min size, max size, min shared trigrams) of a filename scoring at least cutoff against size."""
+        min_size = size * cutoff / (2 - cutoff)
+        max_size = size * (2 - cutoff) / cutoff if cutoff > 0 else float("inf")
+        return min_size, max_size, max(1, math.ceil(cutoff * (size + min_size) / 2 - 1e-9))
+
+    def __contains__(self, filename):
+        return filename in self._sizes
+
+    def __len__(self):
+        """Length is the number of indexed filenames."""
+        return len(self._sizes)
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import zlib
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """Return the hex content hash of a file, read in chunks."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def crc32_file(path):
+    """Return the CRC-32 of a file, as stored in zip archives."""
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+class HashIndex(object):
+    """Class to look up file content hashes, recomputing them only when a file's size or mtime changes."""
+
+    def __init__(self, cache, log, threads=None):
+        """Initialize with a StatCache to persist hashes between runs."""
+        self.cache = cache
+        self.log = log
+        self.threads = threads or min(32, (os.cpu_count() or 1) * 2)
+
+    def get_hashes(self, paths):
+        """Return a mapping of path to content hash, hashing uncached files on a thread pool."""
+        results = {}
+        misses = []
+        for path in paths:
+            stat = os.stat(path)
+            filehash = self.cache.get(path, stat)
+            if filehash is None:
+                misses.append((path, stat))
+            else:
+                results[path] = filehash
+        if misses:
+            self.log.debug("    - Hashing {} files ({} cached)".format(len(misses), len(results)))
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                for (path, stat), filehash in zip(misses, executor.map(hash_file, [path for path, __stat in misses])):
+                    results[path] = filehash
+                    self.cache.set(path, filehash, stat)
+        return results
+
+    def save(self):
+        """Persist any newly computed hashes."""
+        self.cache.save()
@@ -0,0 +1,98 @@
+import json
+
+# MPF decodes sounds to 16-bit samples when loading them into memory
+BYTES_PER_SAMPLE = 2
+MEGABYTE = 1024 * 1024
+
+
+class MemoryFootprint(object):
+    """Class to estimate how much memory each mode's sounds take once MPF has decoded them."""
+
+    def __init__(self, samplerate=None, channels=None, bytes_per_sample=BYTES_PER_SAMPLE):
+        """Initialize with the playback rate and channels, if MPF converts sounds to them when loading."""
+        self.samplerate = samplerate
+        self.channels = channels
+        self.bytes_per_sample = bytes_per_sample
+        self._files = []  # Dicts of filename, path, mode, track, parent, streaming, decoded bytes
+
+    def get_decoded_size(self, info):
+        """Return the bytes a sound occupies in memory after decoding."""
+        frames = info.frames
+        if self.samplerate and info.samplerate:
+            frames = int(round(frames * self.samplerate / info.samplerate))
+        return frames * (self.channels or info.channels) * self.bytes_per_sample
+
+    def add(self, filename, path, info, mode, track, parent, streaming=False):
+        """Add a sound, with its header metadata, to the report."""
+        self._files.append({"filename": filename, "path": path, "mode": mode, "track": track, "parent": parent,
+                            "streaming": streaming, "bytes": 0 if streaming else self.get_decoded_size(info),
+                            "samplerate": info.samplerate, "channels": info.channels, "frames": info.frames})
+
+    def by_mode(self):
+        """Return totals for each mode and track, largest mode first."""
+        modes = {}
+        for entry in self._files:
+            mode = modes.setdefault(entry["mode"], {"parent": entry["parent"], "files": 0, "streamed": 0,
+                                                    "bytes": 0, "tracks": {}})
+            mode["files"] += 1
+            mode["streamed"] += 1 if entry["streaming"] else 0
+            mode["bytes"] += entry["bytes"]
+            mode["tracks"][entry["track"]] = mode["tracks"].get(entry["track"], 0) + entry["bytes"]
+        return dict(sorted(modes.items(), key=lambda x: x[1]["bytes"], reverse=True))
+
+    def by_parent(self):
+        """Return totals for each parent mode (a mode plus the child configs it imports), largest first."""
+        parents = {}
+        for entry in self._files:
+            parent = parents.setdefault(entry["parent"], {"files": 0, "bytes": 0})
+            parent["files"] += 1
+            parent["bytes"] += entry["bytes"]
+        return dict(sorted(parents.items(), key=lambda x: x[1]["bytes"], reverse=True))
+
+    def largest(self, count=10):
+        """Return the files using the most memory."""
+        return sorted(self._files, key=lambda x: x["bytes"], reverse=True)[:count]
+
+    def total(self):
+        """Return the memory used by all sounds."""
+        return sum(entry["bytes"] for entry in self._files)
+
+    def over_budget(self, budget):
+        """Return the parent modes whose sounds exceed a budget in bytes."""
+        return {name: parent["bytes"] for name, parent in self.by_parent().items() if parent["bytes"] > budget}
+
+    def to_dict(self, top=10):
+        """Return the full report as JSON-serializable data."""
+        return {
+            "settings": {"samplerate": self.samplerate, "channels": self.channels,
+                         "bytes_per_sample": self.bytes_per_sample},
+            "total_bytes": self.total(),
+            "modes": self.by_mode(),
+            "parents": self.by_parent(),
+            "largest": self.largest(top),
+        }
+
+    def to_json(self, top=10):
+        """Return the full report as a JSON string."""
+        return json.dumps(self.to_dict(top), indent=2)
+
+    def format_table(self, top=10):
+        """Return the report as lines of text."""
+        lines = ["", "{:<32} {:<24} {:>6} {:>8} {:>10}".format("Mode", "Parent", "Files", "Streamed", "MB")]
+        for name, mode in self.by_mode().items():
+            lines.append("{:<32} {:<24} {:>6} {:>8} {:>10.1f}".format(
+                name, mode["parent"], mode["files"], mode["streamed"], mode["bytes"] / MEGABYTE))
+        lines += ["", "{:<32} {:>6} {:>10}".format("Parent mode", "Files", "MB")]
+        for name, parent in self.by_parent().items():
+            lines.append("{:<32} {:>6} {:>10.1f}".format(name, parent["files"], parent["bytes"] / MEGABYTE))
+        lines += ["", "Largest {} files:".format(top)]
+        for entry in self.largest(top):
+            lines.append("  {:>8.1f} MB  {} ({}/{})".format(
+                entry["bytes"] / MEGABYTE, entry["filename"], entry["mode"], entry["track"]))
+        lines += ["", "Total decoded size: {:.1f} MB across {} files".format(self.total() / MEGABYTE,
+                                                                              len(self._files))]
+        return lines
+
+    def __len__(self):
+        """Length is the number of files."""
+        return len(self._files)
@@ -8,6 +8,8 @@ class ModeAssets(object):
         self._dict = {}
         self._tracks = []
         self._files = []
+        self._tracks_by_file = {}  # Key: filename, Value: track name
+        self._streaming = set()  # Filenames streamed from disk instead of loaded into memory
         self._pool_tracks = {}
         self.name = mode_name
         self.log = log
@@ -46,12 +48,17 @@ class ModeAssets(object):
         self._add_track(trackname)
         self._files.append(filename)
         self._dict[trackname].append(filename)
+        self._tracks_by_file.setdefault(filename, trackname)
+        if sound_dict.get('streaming'):
+            self._streaming.add(filename)
 
     def find_track_for_sound(self, filename):
         """Identify the track requested for the filename (to know its folder)."""
-        for trackname, sounds in self._dict.items():
-            if filename in sounds:
-                return trackname
+        return self._tracks_by_file.get(filename)
+
+    def is_streaming(self, filename):
+        """Check whether the config streams this file rather than keeping it decoded in memory."""
+        return filename in self._streaming
 
     def _add_track(self, trackname):
         if trackname not in self._tracks:
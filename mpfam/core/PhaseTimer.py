@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+
+class PhaseSpan(object):
+    """A single timed phase, with the number of files and bytes it handled."""
+
+    def __init__(self, name, depth, start):
+        self.name = name
+        self.depth = depth
+        self.start = start
+        self.elapsed = 0.0
+        self.count = 0
+        self.bytes = 0
+
+    def add(self, count=0, size=0):
+        """Add to the files and bytes handled by this phase."""
+        self.count += count
+        self.bytes += size
+
+
+class PhaseTimer(object):
+    """Class to time the phases of an operation, e.g. config load, source scan, and copy."""
+
+    def __init__(self):
+        """Initialize with no recorded phases."""
+        self.origin = time.perf_counter()
+        self.spans = []  # PhaseSpan objects in the order they started
+        self._open = []  # Spans that haven't finished, innermost last
+
+    @contextmanager
+    def phase(self, name):
+        """Time the wrapped block as a phase, yielding its span so counts can be added.
+
+        Phases can be nested, e.g. the video copy within an export.
+        """
+        span = self.start(name)
+        try:
+            yield span
+        finally:
+            self.stop(span)
+
+    def start(self, name):
+        """Start timing a phase and return its span, for phases that don't fit a single block."""
+        span = PhaseSpan(name, len(self._open), time.perf_counter())
+        self.spans.append(span)
+        self._open.append(span)
+        return span
+
+    def stop(self, span):
+        """Finish timing a phase."""
+        span.elapsed = time.perf_counter() - span.start
+        if span in self._open:
+            self._open.remove(span)
+
+    @property
+    def current(self):
+        """Return the innermost running phase, or an unrecorded span if none is running."""
+        return self._open[-1] if self._open else PhaseSpan(None, 0, time.perf_counter())
+
+    def report(self, log):
+        """Log the elapsed time, file count, and bytes of each phase."""
+        if not self.spans:
+            return
+        log.info("\nPhase timings:")
+        for span in self.spans:
+            log.info("  {:<36} {:>9.1f} ms {:>8} files {:>10.1f} MB".format(
+                "{}{}".format("  " * span.depth, span.name), span.elapsed * 1000, span.count,
+                span.bytes / 1000000))
+
+    def to_trace(self):
+        """Return the phases as a Chrome trace (open in chrome://tracing or Perfetto)."""
+        pid, tid = os.getpid(), threading.get_ident()
+        return {"traceEvents": [{"name": span.name, "ph": "X", "pid": pid, "tid": tid,
+                                 "ts": round((span.start - self.origin) * 1000000),
+                                 "dur": round(span.elapsed * 1000000),
+                                 "args": {"files": span.count, "bytes": span.bytes}}
+                                for span in self.spans],
+                "displayTimeUnit": "ms"}
+
+    def save_trace(self, path):
+        """Write the phases to a JSON trace file."""
+        with open(path, mode="w") as f:
+            json.dump(self.to_trace(), f, indent=1)
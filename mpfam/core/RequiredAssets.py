@@ -2,40 +2,66 @@
 
 from mpf.file_interfaces.yaml_interface import YamlInterface
 from mpfam.core.ModeAssets import ModeAssets
+from mpfam.core.TreeWalker import CONFIG_EXTENSIONS, walk_tree
+from mpfam.core.WorkerPool import process_map
 
+from collections import namedtuple
 import io
 import os
+import time
+
+# Where a required asset belongs: the ModeAssets requiring it, its track, and the parent mode that holds its folder
+SoundLocation = namedtuple("SoundLocation", ["mode", "track", "parent"])
+
+
+def parse_config_file(configpath):
+    """Read and parse a single yaml config file, returning the config and seconds spent."""
+    starttime = time.perf_counter()
+    with io.open(configpath, 'r', encoding='utf-8') as f:
+        source = f.read()
+    conf = YamlInterface.process(source)
+    return conf, time.perf_counter() - starttime
+
 
 class RequiredAssets(object):
     """Class object to parse, return, and query mode config files."""
 
-    def __init__(self, machine_path, log):
-        """Initialize: create config mappings and walk config files."""
+    def __init__(self, machine_path, log, cache=None, workers=None, report_timing=False, configs=None):
+        """Initialize: create config mappings and walk config files.
+
+        Configs can be given as (path, stat) tuples (e.g. from a MachineScan) to skip walking the modes folder.
+        """
         self._allconfigs = {}  # Key: mode/config name, Value: ModeSounds object
         self._childconfigs = {}  # Key: mode/config name, Value: ModeSounds object
-        self._sounds_by_filename = {}  # Key: array of filenames, Value: ModeSounds object
+        self._configpaths = {}  # Key: mode/config name, Value: path of its config file
+        self._sounds_by_filename = {}  # Key: filename, Value: SoundLocation
+        self.conflicts = []  # Tuples of (filename, owning mode, other mode) for files required by two modes
         self._source = None
-        self._allsoundfiles = []
         # Track modes that are imported into parent modes, so we don't scan them twice
         self._configparents = {}  # Key: child config name, Value: parent config
+        self.log = log
 
         #loader_roundtrip = YamlRoundtrip()
         #config = YamlInterface.process(config_spec)
-        for path, __dirs, files in os.walk(os.path.join(machine_path, 'modes')):
-            for filename in files:
-                if filename.endswith('.yaml'):
-                    configfilename = filename[:-5]
-                    with io.open('{}/{}'.format(path, filename), 'r', encoding='utf-8') as f:
-                        source = f.read()
-                    #conf = loader_roundtrip.process(source)
-                    conf = YamlInterface.process(source)
-                    sounds = ModeAssets(configfilename, log)
-                    sounds.parse_config(conf)
-                    if len(sounds) > 0:
-                        self._allconfigs[configfilename] = sounds
-
-                    for importedconfigname in conf.get('config', []):
-                        self._configparents[importedconfigname[:-5]] = configfilename
+        if configs is None:
+            configs = [(os.path.join(path, filename), stat)
+                       for path, __mtime, __dirs, files, stats in walk_tree(
+                           os.path.join(machine_path, 'modes'), CONFIG_EXTENSIONS, with_stats=True)
+                       for filename, stat in zip(files, stats)]
+        configpaths = [configpath for configpath, __stat in configs]
+
+        parsed = self._load_configs(configs, cache, workers, report_timing)
+        for configpath in configpaths:
+            conf = parsed[configpath]
+            configfilename = os.path.basename(configpath)[:-5]
+            self._configpaths[configfilename] = configpath
+            sounds = ModeAssets(configfilename, log)
+            sounds.parse_config(conf)
+            if len(sounds) > 0:
+                self._allconfigs[configfilename] = sounds
+
+            for importedconfigname in conf.get('config', []):
+                self._configparents[importedconfigname[:-5]] = configfilename
 
         # Wait until all configs have been imported, because load order is unpredictable
         for configfilename in self._configparents:
@@ -45,6 +71,63 @@ class RequiredAssets(object):
                 # Commenting this line after the YamlParser change stopped importing child yaml sounds
                 # del self._allconfigs[configfilename]
 
+        self._build_index()
+
+    def _load_configs(self, configstats, cache, workers, report_timing):
+        """Return parsed configs by path, parsing only files that changed since they were cached."""
+        configs = {}
+        timings = {}  # Key: config path, Value: seconds spent parsing (None if cached)
+        stats = dict(configstats)
+        configpaths = list(stats)
+        misses = []
+        for configpath in configpaths:
+            conf = cache.get(configpath, stats[configpath]) if cache is not None else None
+            if conf is None:
+                misses.append(configpath)
+            else:
+                configs[configpath] = conf
+                timings[configpath] = None
+
+        if misses:
+            self.log.info("    - Parsing {} of {} config files{}".format(
+                len(misses), len(configpaths), " ({} cached)".format(len(configpaths) - len(misses)) if cache is not None else ""))
+            for configpath, result in zip(misses, process_map(parse_config_file, misses, workers, self.log)):
+                configs[configpath], timings[configpath] = result
+                if cache is not None:
+                    cache.set(configpath, configs[configpath], stats[configpath])
+
+        if cache is not None:
+            cache.prune(configpaths)
+            cache.save()
+
+        if report_timing:
+            self._report_timing(timings)
+        return configs
+
+    def _report_timing(self, timings):
+        """Log the time spent on each config file, slowest first."""
+        self.log.info("    Config parse times:")
+        parsed = sorted((path for path in timings if timings[path] is not None), key=lambda x: timings[x], reverse=True)
+        for configpath in parsed:
+            self.log.info("      {:8.1f} ms  {}".format(timings[configpath] * 1000, configpath))
+        self.log.info("      {:8.1f} ms  total for {} parsed files, {} from cache".format(
+            sum(timings[path] for path in parsed) * 1000, len(parsed), len(timings) - len(parsed)))
+
+    def _build_index(self):
+        """Map every required filename to its mode, track, and parent mode."""
+        self._sounds_by_filename = {}
+        self.conflicts = []
+        for configfilename, sounds in self._allconfigs.items():
+            parent = self.get_mode_parent(configfilename)
+            for track, filenames in sounds.by_track().items():
+                for filename in filenames:
+                    # The first config to claim a file owns it, and any other mode or track is a conflict
+                    location = self._sounds_by_filename.get(filename)
+                    if location is None:
+                        self._sounds_by_filename[filename] = SoundLocation(sounds, track, parent)
+                    elif location.mode is not sounds or location.track != track:
+                        self.conflicts.append((filename, location.mode.name, configfilename))
+
     def get_all_configs(self):
         """Return all configs mapped by the MPF machine project."""
         return self._allconfigs
@@ -56,23 +139,33 @@ class RequiredAssets(object):
             name = self._configparents[name]
         return name
 
+    def get_config_path(self, modename):
+        """Return the path of the config file for a mode or child config, or None."""
+        return self._configpaths.get(modename)
+
     def find_requiring_mode(self, filename):
         """For a given asset filename, find the mode that includes that filename in its config file."""
-        # So we only have to do this once, make all of the sound files in a Mode into an array key
-        if not self._sounds_by_filename:
-            for sounds in self._allconfigs.values():
-                for soundname in sounds.all():
-                    self._sounds_by_filename[soundname] = sounds
-                    self._allsoundfiles.append(soundname)
-
-        # Easiest check: is this file required _anywhere_ ?
-        if filename not in self._allsoundfiles:
-            return None
-
-        # Next check: find which mode requires it
-        for filelist in self._sounds_by_filename:
-            if filename in filelist:
-                return self._sounds_by_filename[filelist]
+        location = self._sounds_by_filename.get(filename)
+        return location.mode if location else None
+
+    def find_sound_location(self, filename):
+        """For a given asset filename, return its SoundLocation or None if no config requires it."""
+        return self._sounds_by_filename.get(filename)
+
+    def get_required_files(self):
+        """Return every filename required by a config, in config order."""
+        return list(self._sounds_by_filename)
+
+    def get_changed_files(self, previous):
+        """Return the filenames whose mode, track, or parent mode differ from a previous RequiredAssets."""
+        changed = set()
+        for filename in set(self._sounds_by_filename) | set(previous._sounds_by_filename):
+            location = self._sounds_by_filename.get(filename)
+            old = previous._sounds_by_filename.get(filename)
+            if (location and (location.mode.name, location.track, location.parent)) != \
+               (old and (old.mode.name, old.track, old.parent)):
+                changed.add(filename)
+        return changed
 
     def __len__(self):
         """Get the length of config files."""
@@ -0,0 +1,65 @@
+import os
+
+# Requires: numpy and pysoundfile (via pip)
+import numpy as np
+import soundfile as sf
+from mpfam.core.AssetTree import get_backup_path
+
+# Seconds of mirrored audio padded onto each end, so the FFT doesn't wrap the end of a sound into its start
+EDGE_PADDING = 0.1
+
+
+def replace_keeping_original(path, tmp_path):
+    """Replace an asset file with a new version written beside it, backing up the original."""
+    backup_path = get_backup_path(path)
+    # Keep the oldest original if a file has been converted before
+    if os.path.exists(backup_path):
+        os.remove(path)
+    else:
+        os.rename(path, backup_path)
+    os.rename(tmp_path, path)
+
+
+def resample_audio(data, source_rate, target_rate):
+    """Resample a (frames, channels) array from one sample rate to another using the FFT."""
+    frames = data.shape[0]
+    ratio = target_rate / source_rate
+    pad = min(frames - 1, int(source_rate * EDGE_PADDING))
+    if pad > 0:
+        data = np.pad(data, ((pad, pad), (0, 0)), mode="reflect")
+    padded_out = int(round(data.shape[0] * ratio))
+
+    spectrum = np.fft.rfft(data, axis=0)
+    bins = padded_out // 2 + 1
+    resized = np.zeros((bins, data.shape[1]), dtype=spectrum.dtype)
+    keep = min(bins, spectrum.shape[0])
+    resized[:keep] = spectrum[:keep]
+    output = np.fft.irfft(resized, n=padded_out, axis=0) * (padded_out / data.shape[0])
+
+    start = int(round(pad * ratio))
+    output = output[start:start + int(round(frames * ratio))]
+    return np.clip(output, -1.0, 1.0)
+
+
+def resample_file(job):
+    """Resample one asset file in place, keeping a ".original." backup.
+
+    Takes a (path, target rate) tuple so it can run on a process pool, and
+    returns (path, source rate, error message or None).
+    """
+    path, target_rate = job
+    # Written beside the original, so a failure never leaves a half-written asset
+    tmp_path = "{}.resample.tmp".format(path)
+    try:
+        info = sf.info(path)
+        if info.samplerate == target_rate:
+            return path, info.samplerate, None
+        data, source_rate = sf.read(path, always_2d=True)
+        output = resample_audio(data, source_rate, target_rate)
+        sf.write(tmp_path, output, target_rate, subtype=info.subtype, format=info.format)
+        replace_keeping_original(path, tmp_path)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return path, None, str(e) or type(e).__name__
+    return path, source_rate, None
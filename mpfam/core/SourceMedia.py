@@ -0,0 +1,105 @@
+import os
+
+
+class SourceMedia(object):
+    """Class to merge the asset trees of several source folders into one filename index.
+
+    Trees are given in priority order: when a filename exists in more than one
+    source folder, the copy in the earliest folder is used. Within a folder the
+    first copy in scan order is used, as with a single AssetTree.
+    """
+
+    def __init__(self, trees, log):
+        """Initialize with AssetTree (or ZipAssetTree) objects, highest priority first."""
+        self.trees = list(trees)
+        self._index = {}  # Key: filename, Value: highest priority tree containing it
+        self._shadowed = set()  # Filenames also found in a lower priority tree
+        self.changed_files = set()  # Filenames added or removed by the last revalidate()
+        self.changed_trees = []  # Trees with folders rescanned by the last revalidate()
+        for tree in reversed(self.trees):
+            for filename in tree.get_files():
+                if filename in self._index:
+                    self._shadowed.add(filename)
+                self._index[filename] = tree
+        if len(self.trees) > 1 and self._shadowed:
+            log.info("    - {} files exist in more than one source folder, using the highest priority copy".format(
+                     len(self._shadowed)))
+
+    @property
+    def is_archive(self):
+        """A zip file is only used as the sole source."""
+        return len(self.trees) == 1 and self.trees[0].is_archive
+
+    @property
+    def roots(self):
+        return [tree.root for tree in self.trees]
+
+    def _resolve(self, filename):
+        """Re-index a single filename against every tree, after a revalidate."""
+        trees = [tree for tree in self.trees if filename in tree]
+        if trees:
+            self._index[filename] = trees[0]
+        else:
+            self._index.pop(filename, None)
+        if len(trees) > 1:
+            self._shadowed.add(filename)
+        else:
+            self._shadowed.discard(filename)
+
+    def revalidate(self, log):
+        """Rescan the changed folders of every tree and update the merged index. Return the count rescanned."""
+        self.changed_files = set()
+        self.changed_trees = []
+        total = 0
+        for tree in self.trees:
+            changed = tree.revalidate(log)
+            if changed:
+                total += changed
+                self.changed_trees.append(tree)
+                self.changed_files.update(tree.changed_files)
+        for filename in self.changed_files:
+            self._resolve(filename)
+        return total
+
+    def get_tree(self, path):
+        """Return the tree whose root contains a path, or None."""
+        for tree in self.trees:
+            if path == tree.root or path.startswith(os.path.join(tree.root, "")):
+                return tree
+        return None
+
+    def get_file_path(self, filename):
+        """Return the path of a filename in the highest priority source folder containing it."""
+        try:
+            return self._index[filename].get_file_path(filename)
+        except(KeyError):
+            raise ValueError("{} is not in the source media".format(filename))
+
+    def get_file_paths(self, filename):
+        """Return the paths of every occurrance of a filename, in priority order."""
+        return [path for tree in self.trees for path in tree.get_file_paths(filename)]
+
+    def suggest(self, filename, limit=3):
+        """Return up to limit (score, filename) tuples for the closest filenames across all source folders."""
+        scores = {}
+        for tree in self.trees:
+            for score, candidate in tree.suggest(filename, limit):
+                scores[candidate] = max(score, scores.get(candidate, 0))
+        return sorted(((score, candidate) for candidate, score in scores.items()),
+                      key=lambda item: (-item[0], item[1]))[:limit]
+
+    def get_files(self):
+        """Return the asset filenames across all source folders."""
+        return list(self._index)
+
+    def get_folder_count(self):
+        """Return the number of folders scanned across all source folders."""
+        return sum(tree.get_folder_count() for tree in self.trees)
+
+    def __contains__(self, filename):
+        """Check whether a filename exists in any source folder."""
+        return filename in self._index
+
+    def __len__(self):
+        """Length is the number of unique filenames across all source folders."""
+        return len(self._index)
@@ -0,0 +1,76 @@
+import os
+import pickle
+import tempfile
+
+
+def get_cache_path(name):
+    """Return the path of a named mpfam cache file in the temp directory."""
+    return os.path.join(tempfile.gettempdir(), "mpfam_{}".format(name))
+
+
+class StatCache(object):
+    """Persistent mapping of file paths to values that stay valid while the file's size and mtime are unchanged."""
+
+    # Bump when the pickled structure changes, so stale caches are discarded
+    VERSION = 1
+
+    def __init__(self, cache_path, log):
+        """Initialize: load the existing cache file, if any."""
+        self.cache_path = cache_path
+        self.log = log
+        self._entries = {}  # Key: file path, Value: (size, mtime_ns, value)
+        self._dirty = False
+        try:
+            with open(self.cache_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get("version") == self.VERSION:
+                self._entries = data["entries"]
+        except(FileNotFoundError):
+            pass
+        except Exception as e:
+            self.log.warning("    - Could not load cache file {}:\n        {}".format(self.cache_path, e))
+
+    def get(self, path, stat=None):
+        """Return the cached value for a path, or None if it is missing or the file has changed."""
+        entry = self._entries.get(path)
+        if not entry:
+            return None
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except(FileNotFoundError):
+                return None
+        if entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            return None
+        return entry[2]
+
+    def set(self, path, value, stat=None):
+        """Store a value for a path, stamped with the file's current size and mtime."""
+        if stat is None:
+            stat = os.stat(path)
+        self._entries[path] = (stat.st_size, stat.st_mtime_ns, value)
+        self._dirty = True
+
+    def prune(self, paths):
+        """Drop entries for any path not in the given collection."""
+        keep = set(paths)
+        for path in [path for path in self._entries if path not in keep]:
+            del self._entries[path]
+            self._dirty = True
+
+    def save(self):
+        """Write the cache to disk if anything changed."""
+        if not self._dirty:
+            return
+        tmp_path = "{}.tmp".format(self.cache_path)
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({"version": self.VERSION, "entries": self._entries}, f)
+            os.replace(tmp_path, self.cache_path)
+            self._dirty = False
+        except Exception as e:
+            self.log.warning("    - Could not write cache file {}:\n        {}".format(self.cache_path, e))
+
+    def __len__(self):
+        """Length is the number of cached entries."""
+        return len(self._entries)
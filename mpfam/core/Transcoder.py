@@ -0,0 +1,79 @@
+from collections import namedtuple
+import os
+
+# Output settings for deployment. Quality is 0-10 for lossy formats, and samplerate None keeps each file's rate.
+TranscodeProfile = namedtuple("TranscodeProfile", ["name", "extension", "quality", "samplerate"])
+PROFILES = {
+    "cabinet": TranscodeProfile("cabinet", "ogg", 6, 44100),
+}
+# Key: output extension, Value: (soundfile format, subtype)
+FORMATS = {"ogg": ("OGG", "VORBIS"), "wav": ("WAV", "PCM_16"), "flac": ("FLAC", "PCM_16")}
+
+
+def parse_profile(spec):
+    """Parse a profile name (e.g. "cabinet") or "extension[:quality[:samplerate]]" (e.g. "ogg:6:44100")."""
+    if not spec:
+        return None
+    if spec in PROFILES:
+        return PROFILES[spec]
+    extension, __, rest = spec.lower().lstrip(".").partition(":")
+    quality, __, samplerate = rest.partition(":")
+    if extension not in FORMATS:
+        raise ValueError("Unknown transcode profile '{}', expected one of {} or {}[:quality[:rate]]".format(
+            spec, ", ".join(PROFILES), "|".join(FORMATS)))
+    try:
+        quality = float(quality) if quality else None
+        samplerate = int(samplerate) if samplerate else None
+    except(ValueError):
+        raise ValueError("Invalid transcode profile '{}', expected {}[:quality[:rate]]".format(spec, extension))
+    if quality is not None and not 0 <= quality <= 10:
+        raise ValueError("Transcode quality must be from 0 to 10, not {}".format(quality))
+    return TranscodeProfile(spec, extension, quality, samplerate)
+
+
+def get_profile_key(profile):
+    """Return a short string identifying a profile's output settings, for cache and manifest entries."""
+    return "{}_q{}_{}".format(profile.extension, "" if profile.quality is None else profile.quality,
+                              profile.samplerate or "src")
+
+
+def get_output_name(filename, profile):
+    """Return the filename of an asset once transcoded with a profile."""
+    return "{}.{}".format(filename.rpartition(".")[0] or filename, profile.extension)
+
+
+def get_cached_path(folder, filehash, profile):
+    """Return where the output for a source file's contents is cached, so unchanged files are never re-encoded."""
+    return os.path.join(folder, "{}_{}.{}".format(filehash, get_profile_key(profile), profile.extension))
+
+
+def transcode_file(job):
+    """Transcode one audio file, returning (source path, error message or None).
+
+    Takes a (source path, output path, profile) tuple so it can run on a process
+    pool. The output is written beside its destination and renamed into place,
+    so an interrupted run never leaves a partial file.
+    """
+    # Requires: numpy and pysoundfile (via pip). Imported here, so parsing a profile doesn't load them.
+    import soundfile as sf
+    from mpfam.core.Resampler import resample_audio
+
+    src, dst, profile = job
+    fileformat, subtype = FORMATS[profile.extension]
+    tmp_path = "{}.tmp".format(dst)
+    try:
+        data, samplerate = sf.read(src, always_2d=True)
+        if profile.samplerate and profile.samplerate != samplerate:
+            data = resample_audio(data, samplerate, profile.samplerate)
+            samplerate = profile.samplerate
+        # Vorbis takes a compression level from 0 (best quality) to 1
+        level = None if profile.quality is None or subtype != "VORBIS" else 1 - profile.quality / 10
+        with sf.SoundFile(tmp_path, "w", samplerate=samplerate, channels=data.shape[1], subtype=subtype,
+                          format=fileformat, compression_level=level) as f:
+            f.write(data)
+        os.replace(tmp_path, dst)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return src, str(e) or type(e).__name__
+    return src, None
@@ -0,0 +1,80 @@
+import os
+
+SOUND_EXTENSIONS = frozenset(("ogg", "wav", "mp3", "flac", "aac"))
+CONFIG_EXTENSIONS = frozenset(("yaml",))
+
+
+def get_extension(filename):
+    """Return the extension of a filename without its dot, or an empty string."""
+    base, dot, extension = filename.rpartition(".")
+    return extension if dot and base else ""
+
+
+def scan_folder(path, extensions=None, exclude=(), with_stats=False):
+    """List the subfolders and matching files directly inside a folder.
+
+    Returns (subfolder paths, filenames, stats). Subfolders whose path starts
+    with one of the exclude prefixes are left out, so walks never descend into
+    them, even if they were created after the prefixes were chosen. Stats are
+    only collected when asked for, and are otherwise an empty list.
+    """
+    subdirs, files, stats = [], [], []
+    exclude = tuple(exclude)
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                # Match os.walk, which doesn't descend into symlinked folders
+                if not entry.is_symlink() and not (exclude and entry.path.startswith(exclude)):
+                    subdirs.append(entry.path)
+            elif extensions is None or get_extension(entry.name) in extensions:
+                files.append(entry.name)
+                if with_stats:
+                    stats.append(entry.stat())
+    return subdirs, files, stats
+
+
+def walk_tree(root, extensions=None, exclude=(), with_stats=False):
+    """Yield (path, mtime_ns, subfolder paths, filenames, stats) for every folder under root.
+
+    Folders are visited top-down in the same order as os.walk. Folders matching
+    an exclude prefix are pruned along with everything beneath them.
+    """
+    exclude = tuple(exclude)
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            subdirs, files, stats = scan_folder(path, extensions, exclude, with_stats)
+        except(FileNotFoundError, NotADirectoryError):
+            continue
+        yield path, mtime, subdirs, files, stats
+        stack.extend(reversed(subdirs))
+
+
+class MachineScan(object):
+    """Class to walk the MPF machine folder once, sorting out its audio, video, and config files."""
+
+    def __init__(self, machine_path, exclude=()):
+        """Initialize: walk the machine folder, skipping excluded subtrees."""
+        self.machine_path = machine_path
+        self.sound_folders = []  # Tuples of (folder path, mtime_ns, subfolder paths, sound filenames)
+        self.configs = []  # Tuples of (yaml path, stat) for configs under modes/
+        self.videos = []  # Tuples of (path, stat) for every file under videos/ that isn't hidden
+        modesroot = os.path.join(machine_path, "modes")
+        for path, mtime, subdirs, files, stats in walk_tree(machine_path, SOUND_EXTENSIONS | CONFIG_EXTENSIONS,
+                                                            exclude, with_stats=True):
+            sounds = []
+            in_modes = path == modesroot or path.startswith(modesroot + os.sep)
+            for filename, stat in zip(files, stats):
+                extension = get_extension(filename)
+                if extension in SOUND_EXTENSIONS:
+                    sounds.append(filename)
+                elif in_modes:
+                    self.configs.append((os.path.join(path, filename), stat))
+            self.sound_folders.append((path, mtime, subdirs, sounds))
+        # Videos come in any format, so the (small) videos folder is listed again without an extension filter
+        for path, __mtime, __subdirs, files, stats in walk_tree(os.path.join(machine_path, "videos"), None,
+                                                                exclude, with_stats=True):
+            self.videos.extend((os.path.join(path, filename), stat)
+                               for filename, stat in zip(files, stats) if filename[0] != ".")
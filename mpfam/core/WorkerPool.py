@@ -0,0 +1,20 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pickle
+
+
+def process_map(func, items, workers=None, log=None):
+    """Return func(item) for every item, computed in a process pool when there is more than one item.
+
+    The function must be importable at module level. If the pool can't be
+    started (or results can't be pickled), the items are processed serially.
+    """
+    items = list(items)
+    if len(items) > 1 and workers != 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(func, items, chunksize=max(1, len(items) // 32)))
+        except(OSError, BrokenProcessPool, pickle.PicklingError) as e:
+            if log:
+                log.warning("    - Unable to start worker processes, continuing serially: {}".format(e))
+    return [func(item) for item in items]
@@ -0,0 +1,164 @@
+import os
+import shutil
+import struct
+import threading
+import time
+from zipfile import ZipFile, ZIP_STORED
+
+from mpfam.core.AssetTree import AssetTree
+from mpfam.core.CopyEngine import CopyEngine
+from mpfam.core.ExportArchive import EXPORT_MANIFEST_NAME, ExportManifest
+
+# Size of a zip local file header before its variable-length filename and extra fields
+LOCAL_HEADER_SIZE = 30
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class ZipAssetTree(AssetTree):
+    """Class to index the members of an exported zip file, so it can be used as a media source without unzipping."""
+
+    is_archive = True
+
+    def __init__(self, zippath, log, paths_to_exclude=[]):
+        """Initialize: read the zip's central directory and map asset filenames."""
+        self.version = self.VERSION
+        self.root = zippath
+        self._paths_to_exclude = []
+        self._folders = {}
+        self.changed_files = set()
+        self._handles = threading.local()
+        self._open_handles = []
+        self._read_directory(log)
+
+    def _read_directory(self, log):
+        """Index every member of the zip by its filename."""
+        self._soundfiles = {}
+        self._originalfiles = {}
+        self._duplicates = set()
+        self._names = None
+        self._aliases = {}
+        self._members = {}  # Key: member name, Value: ZipInfo
+        stat = os.stat(self.root)
+        self._signature = (stat.st_size, stat.st_mtime_ns)
+        with ZipFile(self.root) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                self._members[info.filename] = info
+                folder, filename = os.path.split(info.filename)
+                self._add_file(os.path.join(self.root, folder) if folder else self.root, filename, log)
+            if EXPORT_MANIFEST_NAME in self._members:
+                manifest = ExportManifest.loads(zf.read(EXPORT_MANIFEST_NAME).decode("utf-8"))
+                self._set_aliases(manifest.get_aliases())
+
+    def revalidate(self, log):
+        """Re-read the central directory if the zip has changed. Return 1 if it was re-read, otherwise 0."""
+        stat = os.stat(self.root)
+        self.changed_files = set()
+        if (stat.st_size, stat.st_mtime_ns) == self._signature:
+            return 0
+        previous = set(self.get_files())
+        self._read_directory(log)
+        # Members may have been replaced in place, so every file is treated as changed
+        self.changed_files = previous | set(self.get_files())
+        return 1
+
+    def get_folder_count(self):
+        """A zip is a single source."""
+        return 1
+
+    def get_folders(self):
+        """Return the zip's folders with their asset filenames, all stamped with the zip's mtime."""
+        folders = {}
+        for index in (self._soundfiles, self._originalfiles):
+            for filename, paths in index.items():
+                for path in paths:
+                    folders.setdefault(path, (self._signature[1], [], []))[2].append(filename)
+        return folders
+
+    def get_member_info(self, path):
+        """Return the ZipInfo for a path returned by get_file_path()."""
+        return self._members[self._get_member_name(path)]
+
+    def get_member_names(self, prefix=""):
+        """Return the names of all members starting with a prefix (e.g. "videos/")."""
+        return [name for name in self._members if name.startswith(prefix)]
+
+    def _get_member_name(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def _get_handle(self):
+        """Return a zip file handle for the current thread, so members can be read in parallel."""
+        handle = getattr(self._handles, "zipfile", None)
+        if handle is None:
+            handle = self._handles.zipfile = ZipFile(self.root)
+            self._open_handles.append(handle)
+        return handle
+
+    def close_handles(self):
+        """Close the zip handles opened by extract_member()."""
+        while self._open_handles:
+            self._open_handles.pop().close()
+        self._handles = threading.local()
+
+    def extract_member(self, path, dst):
+        """Write the member for a path returned by get_file_path() to dst, returning its size.
+
+        The member is written to a temporary name and moved over dst once complete, so
+        an existing file is kept if extracting fails.
+        """
+        info = self.get_member_info(path)
+        CopyEngine._write_over(info, dst, self._write_member)
+        return info.file_size
+
+    def _write_member(self, info, dst):
+        if info.compress_type == ZIP_STORED:
+            self._copy_stored_member(info, dst)
+        else:
+            with self._get_handle().open(info) as fsrc, open(dst, 'wb') as fdst:
+                shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+        mode = (info.external_attr >> 16) & 0o777
+        if mode:
+            os.chmod(dst, mode)
+        # Keep the exported timestamp, so size/mtime comparisons stay meaningful
+        stamp = time.mktime(info.date_time + (0, 0, -1))
+        os.utime(dst, (stamp, stamp))
+
+    def _copy_stored_member(self, info, dst):
+        """Copy an uncompressed member straight out of the zip by its byte range."""
+        with open(self.root, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fsrc.seek(info.header_offset)
+            header = fsrc.read(LOCAL_HEADER_SIZE)
+            namelength, extralength = struct.unpack("<HH", header[26:30])
+            offset = info.header_offset + LOCAL_HEADER_SIZE + namelength + extralength
+            remaining = info.file_size
+            if hasattr(os, "copy_file_range"):
+                try:
+                    while remaining:
+                        copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining, offset)
+                        if not copied:
+                            break
+                        offset += copied
+                        remaining -= copied
+                except(OSError):
+                    # Not supported between these filesystems, fall back to reading
+                    pass
+            fsrc.seek(offset)
+            while remaining:
+                chunk = fsrc.read(min(remaining, COPY_CHUNK_SIZE))
+                if not chunk:
+                    raise OSError("Unexpected end of zip data in {}".format(info.filename))
+                fdst.write(chunk)
+                remaining -= len(chunk)
+
+    def __getstate__(self):
+        """Don't pickle open zip handles."""
+        state = self.__dict__.copy()
+        del state["_handles"]
+        del state["_open_handles"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._handles = threading.local()
+        self._open_handles = []
@@ -1,9 +1,16 @@
 """Sound asset manager for MPF."""
 from mpfam.core import AssetManager
+from mpfam.core.CopyEngine import LINK_MODES
+from mpfam.core.ExportArchive import parse_compression
+from mpfam.core.Transcoder import parse_profile
 
 from datetime import datetime
+import os
 import sys
 
+# Commands that don't need the machine or source folders, so they never ask for them
+PATHLESS_COMMANDS = ("clear",)
+
 def interactive(manager):
     """Interactive shell mode."""
     running = True
@@ -30,11 +37,14 @@ MPF Asset Manager
     7. Analyze sample rates (takes time)
         7e - export uncommon sample files
         7i - import converted sample files
+        7c - convert all files to the most common sample rate
+
+    8. Force refresh of files that differ from the source
 
-    8. Force refresh of all files
+    9. Watch configs and source folder, updating assets as they change
 
     0. Exit this program
-""".format(manager.machine_path, manager.source_path))
+""".format(manager.machine_path, "\n                    ".join(manager.source_paths)))
         selection = input(">> ")
         if selection == "1" or selection == "2":
             write_mode = selection == "1"
@@ -53,60 +63,175 @@ MPF Asset Manager
             manager.analyze_sample_rates(mode="export")
         elif selection == "7i":
             manager.analyze_sample_rates(mode="import")
+        elif selection == "7c":
+            manager.analyze_sample_rates(mode="convert")
         elif selection == "8":
             manager.cleanup_machine_assets(write_mode=True, force_update=True)
+        elif selection == "9":
+            manager.watch()
         elif selection == "0" or not selection:
             running = False
 
 
+def get_option(args, name, default=None):
+    """Return the value of a --name=value argument, or the default."""
+    prefix = "--{}=".format(name)
+    for arg in args:
+        if arg.startswith(prefix):
+            return arg[len(prefix):]
+    return default
+
+
 def launch():
     """Primary method: do something."""
     args = sys.argv[1:]
+    if args and (args[0] == "help" or "-h" in args[0]):
+        print_usage()
+        return
     verbose = "-v" in args
     write_mode = "-w" in args
     export_zip = "-z" in args
+    timing = "--timing" in args
+    profile = get_option(args, "profile", "mpfam_profile" if "--profile" in args else None)
+    verify = "--verify" in args
+    workers = get_option(args, "workers")
+    threads = get_option(args, "threads")
+    link_mode = get_option(args, "link")
+    if link_mode and link_mode not in LINK_MODES:
+        print("ERROR: Unknown link mode '{}', expected one of: {}".format(link_mode, ", ".join(LINK_MODES)))
+        return 2
 
-    manager = AssetManager.AssetManager(verbose=verbose)
+    try:
+        compression = parse_compression(get_option(args, "compress"))
+        transcode = parse_profile(get_option(args, "transcode"))
+    except(ValueError) as e:
+        print("ERROR: {}".format(e))
+        return 2
 
-    if not manager.source_path:
-        print("ERROR: Source media not found. Exiting.")
-        return
-    elif not manager.machine_path:
-        print("Error: Machine path not found, Exiting.")
-        return
+    manager = AssetManager.AssetManager(verbose=verbose, workers=int(workers) if workers else None, timing=timing,
+                                        threads=int(threads) if threads else None, link_mode=link_mode,
+                                        transcode=transcode)
+
+    if args and args[0] == "check":
+        # Check runs in CI and git hooks, so it takes the machine folder from the command line and never asks
+        machine_path = get_option(args, "machine", os.getcwd())
+        if not os.path.isdir(os.path.join(machine_path, "modes")):
+            print("ERROR: No modes folder in {}, run check in a machine folder or pass --machine=PATH".format(
+                  os.path.abspath(machine_path)))
+            return 2
+        manager.use_machine_path(machine_path)
+    elif not args or args[0] not in PATHLESS_COMMANDS:
+        if not manager.source_path:
+            print("ERROR: Source media not found. Exiting.")
+            return 2
+        elif not manager.machine_path:
+            print("Error: Machine path not found, Exiting.")
+            return 2
 
     if not args or args[0] == "-i":
         interactive(manager)
         return
 
-    if args[0] == "help" or "-h" in args[0]:
-        args = None
-
     valid_arg = None
+    exit_code = 0
     if args:
         starttime = datetime.now()
         valid_arg = True
+        profiler = None
+        if profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
         if args[0] == "analyze" or args[0] == "analyse":
-            manager.parse_machine_assets(write_mode=write_mode)
+            manager.parse_machine_assets(write_mode=write_mode, verify=verify)
         elif args[0] == "sim" or args[0] == "simulate":
-            manager.cleanup_machine_assets(write_mode=False)
+            manager.cleanup_machine_assets(write_mode=False, verify=verify)
         elif args[0] == "update":
-            manager.cleanup_machine_assets(write_mode=True)
+            manager.cleanup_machine_assets(write_mode=True, verify=verify)
         elif args[0] == "clear":
             manager.clear_cache()
         elif args[0] == "export":
-            manager.export_machine_assets(saveAsZip=export_zip)
+            manager.export_machine_assets(saveAsZip=export_zip, delta="--delta" in args, compression=compression,
+                                          dedup="--no-dedup" not in args)
         elif args[0] == "resample" or args[0] == "sample":
-            mode = "export" if "--export" in args else "import" if "--import" in args else None
-            manager.analyze_sample_rates(mode=mode)
+            mode = "export" if "--export" in args else "import" if "--import" in args else \
+                   "convert" if "--convert" in args else None
+            rate = get_option(args, "rate")
+            manager.analyze_sample_rates(mode=mode, target_rate=int(rate) if rate else None)
+        elif args[0] == "plan":
+            plan_path = args[1] if len(args) > 1 and not args[1].startswith("-") else "mpfam_plan.json"
+            manager.create_plan(plan_path, verify=verify)
+        elif args[0] == "apply":
+            if len(args) < 2 or args[1].startswith("-"):
+                print("ERROR: Usage: mpfam apply <plan file>")
+                return 2
+            exit_code = manager.apply_plan(args[1])
+        elif args[0] == "sources":
+            if len(args) > 2 and args[1] in ("add", "remove"):
+                if args[1] == "add":
+                    done = manager.add_source_path(args[2], first="--first" in args)
+                else:
+                    done = manager.remove_source_path(args[2])
+                exit_code = 0 if done else 1
+            elif len(args) > 1 and not args[1].startswith("-"):
+                print("ERROR: Usage: mpfam sources [add|remove <folder>]")
+                return 2
+            manager.list_source_paths()
+        elif args[0] == "watch":
+            manager.watch(interval=float(get_option(args, "interval", 1)), verify=verify)
+        elif args[0] == "which":
+            if len(args) < 2:
+                print("ERROR: Usage: mpfam which <filename>")
+                return 2
+            exit_code = 0 if manager.find_asset(args[1]) else 1
+        elif args[0] == "suggest":
+            missing = manager.suggest_missing(patch_path=get_option(args, "patch"), limit=int(get_option(args, "top", 3)))
+            exit_code = 1 if missing else 0
+        elif args[0] == "duplicates":
+            manager.report_duplicate_content(top=int(get_option(args, "top", 10)))
+        elif args[0] == "levels":
+            threshold = get_option(args, "threshold")
+            manager.analyze_levels(trim="--trim" in args, threshold=float(threshold) if threshold else None,
+                                   top=int(get_option(args, "top", 10)))
+        elif args[0] == "check":
+            exit_code = manager.check_machine_assets(json_path=get_option(args, "json"))
+        elif args[0] == "changes":
+            manager.report_changes()
+        elif args[0] == "footprint":
+            rate = get_option(args, "rate")
+            channels = get_option(args, "channels")
+            budget = get_option(args, "budget")
+            total_budget = get_option(args, "total-budget")
+            exit_code = manager.report_footprint(samplerate=int(rate) if rate else None,
+                                                 channels=int(channels) if channels else None,
+                                                 budget=float(budget) if budget else None,
+                                                 total_budget=float(total_budget) if total_budget else None,
+                                                 top=int(get_option(args, "top", 10)),
+                                                 json_path=get_option(args, "json"))
         else:
             valid_arg = False
 
+        if profiler:
+            profiler.disable()
         if valid_arg:
             endtime = datetime.now()
+            if timing or profile:
+                manager.timer.report(manager.log)
+            if profile:
+                profiler.dump_stats("{}.prof".format(profile))
+                manager.timer.save_trace("{}_trace.json".format(profile))
+                manager.log.info("\nProfile written to {0}.prof and trace to {0}_trace.json".format(profile))
             manager.log.info("\nOperation complete in {:.2f} seconds".format((endtime - starttime).total_seconds()))
-            return
+            return exit_code
+
+    print_usage()
+    if valid_arg is False:
+        print("ERROR: Unknown command '{}'.".format(args[0]))
+        return 2
 
+
+def print_usage():
+    """Print the commands, arguments, and flags."""
     print("""
 ---Mission Pinball Asset File Script---
 
@@ -122,12 +247,98 @@ Options:
                     to the appropriate modes/(name)/sounds/(track) folders,
                     and remove all audio files not referenced in config files
 
+    check - Verify that the mode folders match the configs, for CI and git
+                    hooks. No changes are made. Only the configs and folders
+                    changed since the last check are read again. The exit code
+                    adds up the problems found: 4 missing (in no source
+                    folder), 8 misplaced, 16 orphaned or duplicated, 32 not
+                    copied yet. 0 means no problems.
+
+        Optional arguments for check:
+        -----------------------------
+        --machine=path:  The machine folder to check, instead of the current
+                    folder. The saved source folders are used if they exist;
+                    without one, every file not in place counts as missing.
+        --json=path:  Also write the report as JSON.
+
     export - Export the asset files from the MPF mode folders to a single folder
                     for easy transfer to a machine without the complete source
                     asset folder.
 
-    clear - Clear cached source media tree. Necessary if the source media files
-                    have changed.
+        Optional arguments for export:
+        ------------------------------
+        --delta:    Only export assets added or changed since the last export,
+                    to a new timestamped folder (or zip) beside the full export.
+
+        --no-dedup: Write every audio file, even those with the same contents
+                    as another. By default each unique file is written once,
+                    and update from the export restores the other names.
+
+        --compress=ext:method,...
+                    Zip compression per file extension, "stored" or "deflate".
+                    By default wav/aiff files are deflated and all others stored.
+
+        --transcode=profile
+                    Transcode audio files as they are exported (see Flags). The
+                    export includes _renames.json and a _config.patch with the
+                    new filenames, to apply in the machine folder using it.
+
+    clear - Clear cached source media tree, parsed configs, and the asset
+                    catalog. Changed source folders are rescanned automatically,
+                    so this is rarely needed.
+
+    plan [file] - Write every delete, move, and copy that update would make to
+                    a plan file (default: mpfam_plan.json), without changing
+                    anything. Paths are relative to the machine and source
+                    folders, so the plan can be applied on another computer.
+
+    apply <file> - Apply a plan. Files that changed since the plan was made
+                    (by size or mtime) are skipped. Progress is journaled
+                    beside the plan, so an interrupted apply resumes where it
+                    stopped when run again. Skipped and failed operations are
+                    retried by the next apply.
+
+    watch - Run an update, then keep watching the mode configs and the source
+                    folder, updating the mode folders whenever either changes.
+                    Only the changed configs are parsed again.
+
+        Optional arguments for watch:
+        -----------------------------
+        --interval=S: Seconds between checks for changes (default: 1).
+
+    sources - List the source folders in priority order. When a file exists in
+                    more than one, the copy in the highest priority folder is used.
+
+        sources add <folder> [--first]
+                    Add a source folder at the lowest priority (or the highest,
+                    with --first).
+
+        sources remove <folder>
+                    Remove a source folder.
+
+    which <filename> - Show which mode requires a file, where it belongs, and
+                    where it currently exists in the machine and source folders.
+
+    suggest - For each file the configs require that isn't in the source
+                    folders, list the most similar source filenames.
+
+        Optional arguments for suggest:
+        -------------------------------
+        --top=N:    Number of suggestions per file (default: 3).
+
+        --patch=path:
+                    Also write a patch to the mode configs replacing each
+                    missing file with its best match, to review and apply
+                    in the machine folder (e.g. "git apply path").
+
+    duplicates - Report audio files with the same contents under different
+                    names, and the space they waste in each mode.
+
+        Optional arguments for duplicates:
+        ----------------------------------
+        --top=N:    Number of largest duplicate groups to list (default: 10).
+
+    changes - List the assets added, changed, or removed since the last export.
 
     resample - Inspect all audio files and generate a report of the sample rates.
                     Useful to determine ideal target sample rate for conversion
@@ -143,14 +354,71 @@ Options:
                     from the batch conversion process. All original asset files
                     are are preserved with an \".original\" extension.
 
-    clear -  Clear cached directory trees (use when source media files change)
+        --convert:  Resample every asset that is not the most common sample
+                    rate, directly in the mode folders. All original asset files
+                    are preserved with an \".original\" extension.
+
+        --rate=N:   With --convert, resample to N Hz instead of the most
+                    common sample rate.
+
+    levels - Measure the peak, RMS, and leading/trailing silence of every
+                    asset, and list the files with the most silence.
+
+        Optional arguments for levels:
+        ------------------------------
+        --trim:     Trim the silence from assets in place, keeping a little
+                    at each end. All original asset files are preserved with
+                    an \".original\" extension.
+
+        --threshold=dB:
+                    Level below which audio counts as silence (default: -60).
+
+        --top=N:    Number of files to list (default: 10).
+
+    footprint - Report how much memory each mode's sounds use once decoded,
+                    by mode, track, and parent mode, with the largest files.
+                    Sounds with "streaming: true" are not counted.
+
+        Optional arguments for footprint:
+        ---------------------------------
+        --rate=N / --channels=N
+                    Measure as if decoded to N Hz / N channels (default: each
+                    file's own rate and channels, at 16 bits per sample).
+
+        --budget=MB:  Exit with an error if any parent mode uses more than MB.
+
+        --total-budget=MB:
+                    Exit with an error if all sounds together use more than MB.
+
+        --top=N:    Number of largest files to list (default: 10).
+
+        --json=path:  Also write the full report as JSON.
 
 Flags:
     -v    - Verbose mode
     -z    - Save as zip file (when exporting)
+    --verify      - Compare assets already in place to the source folder (size and
+                    mtime, then content hash) and replace any that differ. A
+                    file resampled or trimmed in place counts as current while
+                    its ".original" backup still matches the source; replacing
+                    a file removes its backup.
+    --timing      - Report the time spent parsing each config file, and the
+                    time, file count, and bytes of each phase of the operation
+    --profile[=name]
+                  - Also write a cProfile dump (name.prof, for snakeviz or
+                    pstats) and a phase trace (name_trace.json, for Perfetto or
+                    chrome://tracing). The default name is "mpfam_profile".
+    --workers=N   - Number of parallel worker processes (default: one per CPU)
+    --threads=N   - Number of parallel file copies (default: four per CPU, max 32)
+    --link=hardlink|reflink
+                  - When the source and machine folders share a filesystem,
+                    link files into the mode folders instead of copying them
+    --transcode=profile
+                  - With update or export, transcode audio files for deployment,
+                    e.g. "cabinet" (ogg, quality 6, 44100 Hz) or
+                    "ogg[:quality[:rate]]", "flac[::rate]", "wav[::rate]". Update
+                    only transcodes files whose configs already use that format.
+                    Outputs are cached, so unchanged files are encoded once.
 Usage:
->> mpfam [sim|update|export|clear|resample] [-v]
+>> mpfam [sim|update|check|plan|apply|watch|export|clear|resample|levels|footprint|sources|which|suggest|duplicates|changes] [-v]
 """)
-
-    if valid_arg is False:
-        print("ERROR: Unknown command '{}'.".format(args[0]))